@@ -0,0 +1,210 @@
+'''
+Benchmarks for loading the input files, the eligibility and priority checks,
+and the match itself, on synthetic data of various sizes (see synthetic.py).
+
+For every combination of --students, --courses and --wishlists given, this
+writes a term's worth of input files, then times (best of --repeat runs)
+and measures the peak memory (with tracemalloc, in a separate run) of:
+    course.loadCourses
+    student.loadStudentsFromRegistrarData
+    student.addPreferenceDataToStudentDictionary
+    Course.cannotTake, for every course on every wishlist
+    Course.priority, for every course on every wishlist
+    match.match, with each engine (along with the number of proposals made)
+
+Results are saved as JSON (--output), so runs can be compared across
+commits: with --baseline, any benchmark that got more than --threshold
+slower (or bigger) than in the baseline is reported, and the exit status is
+1.
+'''
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import course
+import match
+import matchEngine
+import priorityDict
+import student
+import synthetic
+
+SENIOR_CLASS_YEAR = 2023
+
+
+def timeCall(function, setup, repeat):
+    '''
+    Returns (the best time in seconds of function(setup()) over repeat runs,
+    the result of the last run).  Only function is timed.
+    '''
+    best = None
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        result = function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def measurePeakMemory(function, setup):
+    '''
+    Returns the peak number of bytes allocated while running function(setup()).
+    '''
+    argument = setup()
+    tracemalloc.start()
+    try:
+        function(argument)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def runConfiguration(numStudents, numCourses, wishlistLength, repeat=3, measureMemory=True, seed=0):
+    '''
+    Runs every benchmark on one size of synthetic term, returning a list of
+    result dictionaries.
+    '''
+    results = []
+    def record(benchmark, function, setup=lambda: None, **extra):
+        seconds, result = timeCall(function, setup, repeat)
+        results.append(dict(benchmark=benchmark, students=numStudents, courses=numCourses,
+                            wishlistLength=wishlistLength, seconds=seconds,
+                            peakMemoryBytes=measurePeakMemory(function, setup) if measureMemory else None,
+                            **extra))
+        print("%-50s %8d students %5d courses %3d wishlist %10.4fs" %
+              (benchmark, numStudents, numCourses, wishlistLength, seconds), file=sys.stderr)
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        coursesFileName, registrarFileName, preferenceFileName = synthetic.writeTerm(
+            directory, numStudents=numStudents, numCourses=numCourses, wishlistLength=wishlistLength,
+            seniorClassYear=SENIOR_CLASS_YEAR, seed=seed)
+        tiebreaker = priorityDict.PriorityDictionary(debug=True)
+        student.Student.setGeneralCalendarInfo(SENIOR_CLASS_YEAR, "fall")
+
+        courseDictionary = record("course.loadCourses",
+                                  lambda _: course.loadCourses(coursesFileName, tiebreaker))
+        record("student.loadStudentsFromRegistrarData",
+               lambda _: student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0))
+        def loadRegistrarData():
+            return student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+        def addPreferences(studentDictionary):
+            student.addPreferenceDataToStudentDictionary(preferenceFileName, studentDictionary,
+                                                         courseDictionary, warningsLevel=0)
+            return studentDictionary
+        studentDictionary = record("student.addPreferenceDataToStudentDictionary",
+                                   addPreferences, loadRegistrarData)
+        # Make sure nothing the generator wrote was left out, so the numbers
+        # are for the size of term asked for
+        with open(preferenceFileName, encoding="utf-8", newline="") as preferenceFile:
+            formCourseNames = student.PreferenceFormPlan(next(csv.reader(preferenceFile))).courseNames
+        if not len(courseDictionary) == len(formCourseNames) == numCourses:
+            raise ValueError("Asked for %d courses, but loaded %d from the courses file and %d from the form"
+                             % (numCourses, len(courseDictionary), len(formCourseNames)))
+
+        participants = [email for email in studentDictionary if studentDictionary[email].submittedPreferences()]
+        course.assignTiebreakers(courseDictionary, participants)
+        pairs = [(courseDictionary[courseName], studentDictionary[email])
+                 for email in participants for courseName in studentDictionary[email].getWishList()]
+        record("Course.cannotTake", lambda _: [c.cannotTake(s) for c, s in pairs], checks=len(pairs))
+        record("Course.priority", lambda _: [c.priority(s) for c, s in pairs], checks=len(pairs))
+
+        problem = matchEngine.MatchProblem(studentDictionary, courseDictionary)
+        state = matchEngine.MatchState(problem)
+        state.run()
+        def resetRanks():
+            for c in courseDictionary.values():
+                c.priorityRanks = None
+        for engine in ["classic", "fast"]:
+            record("match.match (%s)" % engine,
+                   lambda _: match.match(studentDictionary, courseDictionary, engine=engine),
+                   resetRanks, proposals=state.numArrivals)
+    return results
+
+def findRegressions(results, baseline, threshold, minSeconds):
+    '''
+    Returns a list of descriptions of results that are more than threshold
+    (a fraction) slower, or use more than threshold more memory, than the
+    same benchmark in baseline.  Times under minSeconds are too noisy to
+    compare.
+    '''
+    def key(result):
+        return (result["benchmark"], result["students"], result["courses"], result["wishlistLength"])
+    baselineResults = {key(result) : result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = baselineResults.get(key(result))
+        if old is None:
+            continue
+        if result["seconds"] >= minSeconds and result["seconds"] > old["seconds"] * (1 + threshold):
+            regressions.append("%s %s: %.4fs, was %.4fs" % (result["benchmark"], key(result)[1:],
+                                                            result["seconds"], old["seconds"]))
+        if result["peakMemoryBytes"] is not None and old["peakMemoryBytes"] is not None \
+           and result["peakMemoryBytes"] > old["peakMemoryBytes"] * (1 + threshold):
+            regressions.append("%s %s: peak memory %d bytes, was %d" % (
+                result["benchmark"], key(result)[1:], result["peakMemoryBytes"], old["peakMemoryBytes"]))
+    return regressions
+
+def getCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark loading and matching on synthetic data.')
+    parser.add_argument('--students', type=int, nargs='*', default=[1000, 10000, 100000],
+                        help='numbers of students to benchmark with')
+    parser.add_argument('--courses', type=int, nargs='*', default=[10, 100, 500],
+                        help='numbers of courses to benchmark with')
+    parser.add_argument('--wishlists', type=int, nargs='*', default=[3, 12],
+                        help='wishlist lengths to benchmark with')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='time each benchmark this many times and keep the best')
+    parser.add_argument('--no_memory', action='store_true',
+                        help="don't measure peak memory (which runs each benchmark an extra time)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the synthetic data')
+    parser.add_argument('--output', type=str, default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None,
+                        help='JSON file from an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fail if a benchmark is more than this fraction slower or bigger than the baseline')
+    parser.add_argument('--min_seconds', type=float, default=0.01,
+                        help="don't compare times shorter than this")
+    args = parser.parse_args()
+
+    results = []
+    for numStudents in args.students:
+        for numCourses in args.courses:
+            for wishlistLength in args.wishlists:
+                results.extend(runConfiguration(numStudents, numCourses, wishlistLength, repeat=args.repeat,
+                                                measureMemory=not args.no_memory, seed=args.seed))
+
+    report = {"commit" : getCommit(),
+              "python" : platform.python_version(),
+              "date" : datetime.datetime.now().isoformat(timespec="seconds"),
+              "results" : results}
+    if args.output is not None:
+        with open(args.output, "w") as outputFile:
+            json.dump(report, outputFile, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baselineFile:
+            regressions = findRegressions(results, json.load(baselineFile), args.threshold, args.min_seconds)
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
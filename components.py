@@ -0,0 +1,213 @@
+'''
+Runs the match as separate pieces in parallel.  Students and courses form a
+bipartite graph, with an edge for each course on a student's wishlist.
+When many students only rank intro courses and many others only rank
+upper-level electives, that graph splits into independent connected
+components.
+
+A proposal only changes the roster of the course it's made to and the
+queue entry of whoever that course dumps, so one component's queue entries
+are handled in the same order whether or not other components' entries are
+mixed in with them.  Running each component on its own therefore gives
+exactly the rosters of the full match.  Rejections are put back into the
+full match's order using where each one came from in the starting queue
+(see MatchState.trackQueueOrigins).
+
+The components are shared out among the workers, biggest first, each one
+to the worker with the least work so far.  Each worker builds and runs a
+single MatchProblem for its share, so pruning wishlists and ranking
+students is split up too.  Only the order of the ranks matters, so ranking
+just a worker's students is as good as ranking everyone.  Tiebreakers are
+drawn before any workers are forked, as the full match would draw them, so
+they don't depend on how the work is divided.
+'''
+import gc
+import heapq
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import course
+import diagnostics
+import matchEngine
+
+# Set up by componentMatch before any workers are forked, so they inherit them
+sharedStudentDictionary = None
+sharedCourseDictionary = None
+sharedParts = None
+
+
+class MatchPart:
+    '''
+    Some of the connected components of a match, to be run together as one
+    smaller match.
+
+    emails - the students in these components, in the full match's order
+    courseNames - the courses in these components
+    maxCoursesDictionary - the full match's exceptions for these students
+    positions - positions in the full match's starting queue of the entries
+                in this part's starting queue
+    '''
+    def __init__(self, emails, courseNames, maxCoursesDictionary):
+        self.emails = emails
+        self.courseNames = courseNames
+        self.maxCoursesDictionary = maxCoursesDictionary
+        self.positions = []
+
+
+def findComponents(studentDict, emails, courseNames):
+    '''
+    Returns a list of (indices into emails, course names) for each connected
+    component of the graph of the given students' wishlists, in order of
+    their first student.  Courses nobody wants aren't in any of them.
+    '''
+    courseIndex = {courseName : c for c, courseName in enumerate(courseNames)}
+    # Union-find over the students followed by the courses
+    parents = list(range(len(emails) + len(courseNames)))
+    def find(node):
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+    for s, email in enumerate(emails):
+        root = find(s)
+        for courseName in studentDict[email].getWishList():
+            other = find(len(emails) + courseIndex[courseName])
+            if other != root:
+                parents[other] = root
+
+    components = {}
+    for s in range(len(emails)):
+        components.setdefault(find(s), ([], []))[0].append(s)
+    for c, courseName in enumerate(courseNames):
+        root = find(len(emails) + c)
+        if root in components:
+            components[root][1].append(courseName)
+    return list(components.values())
+
+def getMatchParts(studentDict, courseDict, emails, maxCoursesDictionary={}, numParts=1):
+    '''
+    Divides the match of the given students into at most numParts
+    MatchParts, with roughly the same number of proposals to make in each.
+    '''
+    def getSize(component):
+        studentIndices, _ = component
+        return sum(len(studentDict[emails[s]].getWishList()) + maxCoursesDictionary.get(emails[s], 1)
+                   for s in studentIndices)
+    groups = [(0, group, [], []) for group in range(numParts)]
+    for component in sorted(findComponents(studentDict, emails, list(courseDict)), key=getSize, reverse=True):
+        size, group, studentIndices, courseNames = heapq.heappop(groups)
+        studentIndices.extend(component[0])
+        courseNames.extend(component[1])
+        heapq.heappush(groups, (size + getSize(component), group, studentIndices, courseNames))
+
+    parts = []
+    studentParts = [None] * len(emails)
+    for _, _, studentIndices, courseNames in groups:
+        if not studentIndices:
+            continue
+        studentIndices.sort()
+        partEmails = set(emails[s] for s in studentIndices)
+        part = MatchPart([emails[s] for s in studentIndices], courseNames,
+                         {email : numCourses for email, numCourses in maxCoursesDictionary.items()
+                          if email in partEmails})
+        for s in studentIndices:
+            studentParts[s] = part
+        parts.append(part)
+
+    # Number the starting queue the way MatchState builds it: everyone once,
+    # then the extra entries for extra courses
+    studentIndex = {email : s for s, email in enumerate(emails)}
+    startingQueue = list(range(len(emails)))
+    for email, numCourses in maxCoursesDictionary.items():
+        startingQueue.extend([studentIndex[email]] * (numCourses - 1))
+    for position, s in enumerate(startingQueue):
+        studentParts[s].positions.append(position)
+    return parts
+
+def getTiebreakers(courseDict):
+    return list({id(c.tiebreaker) : c.tiebreaker for c in courseDict.values()}.values())
+
+def runMatchPart(i):
+    '''
+    Runs shared MatchPart i in a worker process.  Returns a list of (course
+    name, roster emails) for its courses, a list of ((round, position),
+    email) for its rejections, a Counter of what happened (see
+    MatchState.addCounters), the diagnostics reported, and the numbers of
+    priority evaluations and of lookups in each tiebreaker made.
+    '''
+    part = sharedParts[i]
+    diagnostics.collectInWorker()
+    tiebreakers = getTiebreakers(sharedCourseDictionary)
+    numLookups = [tiebreaker.numLookups for tiebreaker in tiebreakers]
+    numEvaluations = course.PriorityRanks.numEvaluations
+
+    studentDict = {email : sharedStudentDictionary[email] for email in part.emails}
+    courseDict = {courseName : sharedCourseDictionary[courseName] for courseName in part.courseNames}
+    problem = matchEngine.MatchProblem(studentDict, courseDict, part.maxCoursesDictionary)
+    state = matchEngine.MatchState(problem, part.maxCoursesDictionary)
+    state.trackQueueOrigins(part.positions)
+    state.run()
+    counters = Counter()
+    state.addCounters(counters)
+    return ([(c.getCourseName(), roster) for c, roster in state.getRosters().items()],
+            list(zip(state.rejectionOrigins, state.getRejections())),
+            counters,
+            diagnostics.takeMessages(),
+            course.PriorityRanks.numEvaluations - numEvaluations,
+            [tiebreaker.numLookups - lookups for tiebreaker, lookups in zip(tiebreakers, numLookups)])
+
+def componentMatch(studentDict, courseDict, show_steps=False, maxCoursesDictionary={}, counters=None,
+                   workers=1):
+    '''
+    Same inputs and outputs as match.match(), but runs the connected
+    components of the match on their own, using workers processes.  With
+    show_steps, or if the match doesn't split up, it's run as fastMatch
+    does.
+    '''
+    global sharedStudentDictionary, sharedCourseDictionary, sharedParts
+    emails = [s for s in studentDict if studentDict[s].submittedPreferences()]
+    parts = getMatchParts(studentDict, courseDict, emails, maxCoursesDictionary,
+                          1 if show_steps else workers)
+    # Workers need to inherit the match data rather than have it pickled
+    if len(parts) <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return matchEngine.fastMatch(studentDict, courseDict, show_steps=show_steps,
+                                     maxCoursesDictionary=maxCoursesDictionary, counters=counters)
+
+    # Ranking everyone (as the full match does) draws tiebreakers for the
+    # students who aren't in the match too, after everyone who is
+    course.assignTiebreakers(courseDict, emails)
+    course.assignTiebreakers(courseDict, list(studentDict))
+    sharedStudentDictionary = studentDict
+    sharedCourseDictionary = courseDict
+    sharedParts = parts
+    # Keep the garbage collector in the workers from touching (and so
+    # copying) every object they inherit
+    gc.freeze()
+    try:
+        with ProcessPoolExecutor(max_workers=len(parts),
+                                 mp_context=multiprocessing.get_context("fork")) as pool:
+            results = list(pool.map(runMatchPart, range(len(parts))))
+    finally:
+        gc.unfreeze()
+
+    rosters = {c : [] for c in courseDict.values()}
+    rejections = []
+    messages = []
+    for partRosters, partRejections, partCounters, partMessages, numEvaluations, numLookups in results:
+        for courseName, roster in partRosters:
+            rosters[courseDict[courseName]] = roster
+        rejections.extend(partRejections)
+        if counters is not None:
+            counters.update(partCounters)
+        messages.extend(partMessages)
+        course.PriorityRanks.numEvaluations += numEvaluations
+        for tiebreaker, lookups in zip(getTiebreakers(courseDict), numLookups):
+            tiebreaker.numLookups += lookups
+    rejections.sort()
+    # Wishlists are pruned one student at a time, so put the warnings about
+    # them back in the order of the students
+    studentIndex = {email : s for s, email in enumerate(emails)}
+    messages.sort(key=lambda message: studentIndex[message[1]])
+    diagnostics.addMessages(messages)
+    return rosters, [email for _, email in rejections]
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import csv
-import warnings
+import functools
+import re
+import sys
+import diagnostics
 from priorityDict import PriorityDictionary
 
 # Avoids circular import when importing student. This is a recommended practice
@@ -20,7 +23,7 @@ CF_OTHER_COURSE_TYPE = "other"
 CF_PREREQUISITES_HEADER = "Prerequisites"
 CF_STUDENTS_WITH_PREREQ_WAIVER_HEADER = "Students with Prereq Waiver"
 
-IGNORE_COURSES = ["", "CS.099", "CS.100", "CS.102", "CS.399", "CS.400", "CS.290", "CS.291", "CS.292", "CS.298", "CS.390", "CS.391", "CS.392"]
+IGNORE_COURSES = frozenset(["", "CS.099", "CS.100", "CS.102", "CS.399", "CS.400", "CS.290", "CS.291", "CS.292", "CS.298", "CS.390", "CS.391", "CS.392"])
 
 CORE_EQUIVALENCY = {
     "CS.111" : "CS.111", "CS.111P" : "CS.111", "CS.111AP" : "CS.111",
@@ -35,6 +38,63 @@ CORE_EQUIVALENCY = {
 
 CORE_COURSES = set(CORE_EQUIVALENCY.values())
 
+
+class CourseIdTable:
+    '''
+    Gives every (regularized) course name a bit position the first time it's
+    seen, so that a set of courses can be stored as a single integer bitmask.
+    Also keeps masks of which known courses are core courses and which are
+    electives.
+    '''
+    def __init__(self):
+        self.names = []
+        self.bits = {}
+        self.coreMask = 0
+        self.electiveMask = 0
+
+    def getMask(self, courseName):
+        '''
+        Returns the single-bit mask for courseName, assigning it a bit if it
+        doesn't have one yet.
+        '''
+        mask = self.bits.get(courseName)
+        if mask is None:
+            mask = 1 << len(self.names)
+            self.names.append(sys.intern(courseName))
+            self.bits[courseName] = mask
+            if isCore(courseName):
+                self.coreMask |= mask
+            elif isElective(courseName):
+                self.electiveMask |= mask
+        return mask
+
+    def getKnownMask(self, courseName):
+        '''
+        Returns the single-bit mask for courseName, or 0 if it doesn't have
+        one (so nobody has taken it).
+        '''
+        return self.bits.get(courseName, 0)
+
+    def getMaskForCourses(self, courseNames):
+        mask = 0
+        for courseName in courseNames:
+            mask |= self.getMask(courseName)
+        return mask
+
+    def getCourseNames(self, mask):
+        '''
+        Returns the names of the courses in mask, in bit order.
+        '''
+        courseNames = []
+        while mask:
+            lowestBit = mask & -mask
+            courseNames.append(self.names[lowestBit.bit_length() - 1])
+            mask ^= lowestBit
+        return courseNames
+
+# Shared by every Student, so that their course history masks are comparable
+COURSE_IDS = CourseIdTable()
+
     
 class Course:
     
@@ -50,6 +110,7 @@ class Course:
             splitPrerequisites = splitPrerequisites[1:]
         self.prerequisites = [regularize(c) for c in splitPrerequisites]
         self.studentsWithWaivers = studentsWithWaivers.split(",")
+        self.priorityRanks = None # shared PriorityRanks, see assignPriorityRanks
         
     def __repr__(self):
         return self.courseName + " " + str(self.capacity)
@@ -77,16 +138,16 @@ class Course:
         
         if not self.orPrerequisites:
             # Most cases fall here: need all the prerequisites
-            missingPrereqs = [c for c in self.prerequisites if c not in student.getCoursesTaken()]
+            missingPrereqs = [c for c in self.prerequisites if not student.hasTaken(c)]
             if len(missingPrereqs) > 0:
                 errorMessage += "missing prerequisites: " + " ".join(missingPrereqs)
         else:
             # Occasionally, a course requires that you have at least one of several prerequisite options
-            prereqsTaken = [c for c in self.prerequisites if c in student.getCoursesTaken()]
+            prereqsTaken = [c for c in self.prerequisites if student.hasTaken(c)]
             if len(self.prerequisites) > 0 and len(prereqsTaken) == 0:
                 errorMessage += "missing any prerequisites for or-d prereq course: " + self.getCourseName() + " " + " ".join(student.getCoursesTaken())
          
-        alreadyTaken = self.courseName in student.getRawCoursesTaken()
+        alreadyTaken = student.hasTakenRaw(self.courseName)
         if alreadyTaken:
             errorMessage += "course was already taken"
         if len(errorMessage) > 0:
@@ -107,6 +168,22 @@ class Course:
              *** MUST BE IMPLEMENTED BY SUBCLASSES. ***
         '''
         raise ValueError("No priority for a generic Course!")
+
+    def priorityBeforeTiebreaker(self, _: Student):
+        '''
+        Returns priority() without the random tiebreaker, which is always
+        its last element.
+             *** MUST BE IMPLEMENTED BY SUBCLASSES. ***
+        '''
+        raise ValueError("No priority for a generic Course!")
+
+    def rank(self, student: Student):
+        '''
+        Returns an integer that orders students exactly as priority() does
+        (bigger is better), looked up from the ranks shared by all courses of
+        this type. assignPriorityRanks must have been called first.
+        '''
+        return self.priorityRanks.getRank(student)
     
 
 class ElectiveCourse(Course):
@@ -123,10 +200,14 @@ class ElectiveCourse(Course):
            breaking ties by preferring students who have taken fewer CS 
            electives. Any remaining ties are broken randomly.
         '''
+        return self.priorityBeforeTiebreaker(student) \
+               + (+1 * self.tiebreaker.getPriority(student.getEmail()),) # big is good
+
+    def priorityBeforeTiebreaker(self, student: Student):
+        '''priority() without the random tiebreaker on the end.'''
         return (+1 * student.getRegistrationClassYear(),              # big is good, now using enum
-                +1 * len(student.getCoreCoursesTaken()),              # big is good
-                -1 * len(student.getElectivesTaken()),                # small is good
-                +1 * self.tiebreaker.getPriority(student.getEmail())) # big is good
+                +1 * student.getNumCoreCoursesTaken(),                # big is good
+                -1 * student.getNumElectivesTaken())                  # small is good
     
         
 class CoreCourse(Course):
@@ -140,27 +221,118 @@ class CoreCourse(Course):
            254, 257) prefer students by descending seniority (seniors over
            juniors over sophomores over first years), breaking ties randomly.
         '''
-        return (+1 * student.getRegistrationClassYear(),              # big is good, now using enum
-                +1 * self.tiebreaker.getPriority(student.getEmail())) # big is good
+        return self.priorityBeforeTiebreaker(student) \
+               + (+1 * self.tiebreaker.getPriority(student.getEmail()),) # big is good
+
+    def priorityBeforeTiebreaker(self, student: Student):
+        '''priority() without the random tiebreaker on the end.'''
+        return (+1 * student.getRegistrationClassYear(),)             # big is good, now using enum
 
     
+class PriorityRanks:
+    '''
+    Every course of the same type (with the same tiebreaker) orders students
+    identically, so rather than each course building priority tuples on every
+    comparison, the students are sorted once by priority and each is given a
+    single integer rank, where a bigger rank means a more preferred student.
+
+    Ranks are recomputed (for everyone, since ranks are relative) the next
+    time one is asked for after a student is added or any student's course
+    history changes.  numEvaluations counts the priority() calls made by
+    every PriorityRanks, for profiling.
+    '''
+    numEvaluations = 0
+
+    def __init__(self, exemplarCourse: Course, studentDictionary):
+        self.exemplarCourse = exemplarCourse
+        # Courses can be handed a new tiebreaker, so remember the one ranked by
+        self.tiebreaker = exemplarCourse.tiebreaker
+        self.studentDictionary = studentDictionary
+        self.ranks = {}
+        self.versions = {}
+
+    def rankStudents(self):
+        PriorityRanks.numEvaluations += len(self.studentDictionary)
+        keyed = sorted((self.exemplarCourse.priority(s), s.getEmail())
+                       for s in self.studentDictionary.values())
+        self.ranks = {}
+        rank = -1
+        previousKey = None
+        for key, email in keyed:
+            if key != previousKey:
+                rank += 1
+                previousKey = key
+            self.ranks[email] = rank
+        self.versions = {s.getEmail() : s.getHistoryVersion()
+                         for s in self.studentDictionary.values()}
+
+    def getRank(self, student: Student):
+        email = student.getEmail()
+        if self.versions.get(email) != student.getHistoryVersion():
+            self.rankStudents()
+            if email not in self.ranks:
+                raise ValueError("Can't rank " + email + ", who isn't in the student dictionary.")
+        return self.ranks[email]
+
+
+def assignPriorityRanks(courseDictionary, studentDictionary):
+    '''
+    Gives every course in courseDictionary the PriorityRanks shared by all
+    courses of its type and tiebreaker, ranking the students in
+    studentDictionary.  Courses that already share ranks over this
+    studentDictionary keep them.
+    '''
+    sharedRanks = {}
+    for c in courseDictionary.values():
+        rankingKey = (type(c), id(c.tiebreaker))
+        if rankingKey not in sharedRanks:
+            if c.priorityRanks is not None and c.priorityRanks.studentDictionary is studentDictionary \
+               and type(c.priorityRanks.exemplarCourse) is type(c) \
+               and c.priorityRanks.tiebreaker is c.tiebreaker:
+                sharedRanks[rankingKey] = c.priorityRanks
+            else:
+                sharedRanks[rankingKey] = PriorityRanks(c, studentDictionary)
+        c.priorityRanks = sharedRanks[rankingKey]
+
+
+# An already stripped course string with dots and spaces removed: department,
+# course number, then any suffix (e.g. P or AP)
+COURSE_NAME_PATTERN = re.compile(r"([^0-9]*)([0-9]+)([^0-9]*)")
+
+# There are only a few hundred distinct course strings in a term's data, so
+# this comfortably holds all of them
+REGULARIZE_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=REGULARIZE_CACHE_SIZE)
 def regularize(s, substituteEquivalent=True):
     '''
     Convert all strings that represent courses in form like
     CS.201 or CS201 or CS 201 or Math/MATH + space/dot + 236 + P etc and converts to
-    consistent format.
+    consistent format.  Results are memoized and interned, since the same few
+    strings come up over and over; see getRegularizeCacheInfo().
     '''
     if "or" in s:
         # Keep only the first option if multiple equivalent courses are listed
         s = s[0:s.index("or")]
     s = s.strip().replace(".","").replace(" ","")
-    courseNumber = "".join([c for c in s if c.isdigit()])
-    courseDepartment = s[:s.find(courseNumber)]
-    courseSuffix = s[s.find(courseNumber) + len(courseNumber):]
+    parsed = COURSE_NAME_PATTERN.fullmatch(s) if s.isascii() else None
+    if parsed:
+        courseDepartment, courseNumber, courseSuffix = parsed.groups()
+    else:
+        # Unusual strings (no number, or digits split up) get the original treatment
+        courseNumber = "".join([c for c in s if c.isdigit()])
+        courseDepartment = s[:s.find(courseNumber)]
+        courseSuffix = s[s.find(courseNumber) + len(courseNumber):]
     dottedName = courseDepartment.upper() + "." + courseNumber + courseSuffix
     if substituteEquivalent and dottedName in CORE_EQUIVALENCY:
         dottedName = CORE_EQUIVALENCY[dottedName]
-    return dottedName
+    return sys.intern(dottedName)
+
+def getRegularizeCacheInfo():
+    '''
+    Returns the hits, misses, maxsize and currsize of regularize()'s memo table.
+    '''
+    return regularize.cache_info()
     
     
 def loadCourses(coursesFileName,tiebreaker):
@@ -184,7 +356,8 @@ def loadCourses(coursesFileName,tiebreaker):
             elif line[CF_COURSE_TYPE_HEADER] == CF_ELECTIVE_COURSE_TYPE:
                 courseClassHandle = ElectiveCourse
             else:
-                warnings.warn("Course type for " + courseName + " is " + line[CF_COURSE_TYPE_HEADER] +  " - defaulting to elective.")
+                diagnostics.report(diagnostics.UNKNOWN_COURSE_TYPE, None, courseName,
+                                   line[CF_COURSE_TYPE_HEADER])
                 courseClassHandle = ElectiveCourse
             courseNamesToCourses[courseName] = courseClassHandle(courseName, tiebreaker,
                                                                  line[CF_PREREQUISITES_HEADER],
@@ -192,6 +365,17 @@ def loadCourses(coursesFileName,tiebreaker):
                                                                  capacity=int(line[CF_CAPACITY_HEADER]))
     return courseNamesToCourses
 
+def assignTiebreakers(courseDictionary, emails):
+    '''
+    Draws the tiebreakers for all of the given students, in the order given,
+    for every tiebreaker used by a course in courseDictionary. Doing this up
+    front means results don't depend on the order in which courses happen to
+    compare students.
+    '''
+    tiebreakers = {id(c.tiebreaker) : c.tiebreaker for c in courseDictionary.values()}
+    for tiebreaker in tiebreakers.values():
+        tiebreaker.assignPriorities(emails)
+
 def isElective(regularizedCourseName):
     return not isCore(regularizedCourseName) and not isIgnoredCourse(regularizedCourseName)
     
@@ -0,0 +1,233 @@
+'''
+Warnings about the input data and the match, collected instead of being
+issued one at a time with warnings.warn.
+
+Code that finds a problem reports a code (one of the constants below), the
+email and course name it's about, and any other arguments.  Nothing is
+formatted then: with --warnings 0, report() returns straight away, and
+otherwise the diagnostic is buffered and only turned into text when the
+buffer is flushed.  Arguments are kept as they are until then, so they
+mustn't be changed after being reported: anything that can change, like a
+Student's course history, is turned into text by the code reporting it,
+after checking enabled() so that costs nothing with --warnings 0.
+
+Flushing writes every new message in one go, to stderr (as WARNING: lines)
+or to a JSONL file of {"code", "email", "course", "message"} records.  A
+message that's already been written isn't written again.  configure() sets
+up the sink for a run; until it's called, nothing is collected.
+'''
+import atexit
+import json
+import sys
+
+# How many diagnostics to buffer before flushing on our own
+FLUSH_SIZE = 10000
+
+# Codes: the data
+UNKNOWN_COURSE_TYPE = "unknown-course-type"
+DUPLICATE_COURSE = "duplicate-course"
+EMPTY_EMAIL_LINE = "empty-email-line"
+SHORT_LINE = "short-line"
+MULTIPLE_COURSES_IN_HEADER = "multiple-courses-in-header"
+NO_COURSES_TAKEN_HEADER = "no-courses-taken-header"
+NOT_IN_REGISTRAR = "not-in-registrar"
+DIFFERENT_ID = "different-id"
+CLASS_YEAR_MISMATCH = "class-year-mismatch"
+UNREADABLE_CLASS_YEAR = "unreadable-class-year"
+UNKNOWN_CLASS_YEAR = "unknown-class-year"
+GRADUATION_YEAR_TOO_EARLY = "graduation-year-too-early"
+GRADUATION_YEAR_TOO_LATE = "graduation-year-too-late"
+REPORTED_NOT_IN_REGISTRAR = "reported-not-in-registrar"
+REGISTRAR_NOT_REPORTED = "registrar-not-reported"
+NO_CS_TAKEN = "no-cs-taken"
+# Codes: preferences
+INVERTED_PREFERENCES = "inverted-preferences"
+INELIGIBLE_ABOVE_ELIGIBLE = "ineligible-above-eligible"
+INELIGIBLE_ABOVE_ELIGIBLE_REASON = "ineligible-above-eligible-reason"
+NO_PREFERENCES = "no-preferences"
+INELIGIBLE_CHOICE_DROPPED = "ineligible-choice-dropped"
+# Codes: the match
+SECTION = "section"
+FORCE_UNKNOWN_COURSE = "force-unknown-course"
+FORCE_UNKNOWN_STUDENT = "force-unknown-student"
+BAD_MATCH = "bad-match"
+MISSING_REQUIREMENTS = "missing-requirements"
+OVER_CAPACITY = "over-capacity"
+INELIGIBLE_MATCH = "ineligible-match"
+BLOCKING_PAIR = "blocking-pair"
+
+# Turns (email, course name, other arguments) into the text for each code
+MESSAGES = {
+    UNKNOWN_COURSE_TYPE : lambda _, courseName, courseType:
+        "Course type for " + courseName + " is " + courseType + " - defaulting to elective.",
+    DUPLICATE_COURSE : lambda email, courseName:
+        courseName + " appears twice for " + email,
+    EMPTY_EMAIL_LINE : lambda _, __, line:
+        "Line has length zero email - skipping: %s" % str(line),
+    SHORT_LINE : lambda _, __, numColumns, line:
+        "Line has %d values but %d are needed - skipping: %s" % (len(line), numColumns, str(line)),
+    MULTIPLE_COURSES_IN_HEADER : lambda _, __, header:
+        "Your header " + header + " contains more than one course.",
+    NO_COURSES_TAKEN_HEADER : lambda _, __, line:
+        "No header present that matched courses taken" + str(line),
+    NOT_IN_REGISTRAR : lambda email, _, classYear:
+        email + " submitted preference information but not in registrar data;"
+        + " adding with the year they gave:" + classYear,
+    DIFFERENT_ID : lambda email, _, registrarId, reportedId:
+        email + " reported a different ID than registrar:" + str(registrarId) + " vs " + str(reportedId),
+    CLASS_YEAR_MISMATCH : lambda email, _, registrarYear, formYear:
+        email + ": Class year from registrar " + str(registrarYear)
+        + " didn't match preferences form year " + str(formYear) + "; using year from registrar.",
+    UNREADABLE_CLASS_YEAR : lambda _, __, classYear:
+        "Couldn't interpret " + classYear + " as an int.",
+    UNKNOWN_CLASS_YEAR : lambda _, __, numericYear:
+        "Couldn't interpret " + str(numericYear) + " as a class year.",
+    GRADUATION_YEAR_TOO_EARLY : lambda email, _:
+        email + " has graduation year before current senior class.",
+    GRADUATION_YEAR_TOO_LATE : lambda email, _:
+        email + " has graduation year further in the future than any first year student",
+    REPORTED_NOT_IN_REGISTRAR : lambda email, _, courseNames:
+        email + " reported courses not  in registrar data: " + str(courseNames),
+    REGISTRAR_NOT_REPORTED : lambda email, _, courseNames:
+        email + " did not report courses in  registrar data: " + str(courseNames),
+    NO_CS_TAKEN : lambda email, _:
+        "Skipping printing email due to no CS taken: " + email,
+    INVERTED_PREFERENCES : lambda email, _, preferences:
+        "%s may have inverted preferences: prefs=%s" % (email, str(preferences)),
+    INELIGIBLE_ABOVE_ELIGIBLE : lambda email, _, preferences:
+        email + " has some ineligible courses with higher priority than eligible courses"
+        + " (adding anyway); wishlist: " + str(preferences),
+    INELIGIBLE_ABOVE_ELIGIBLE_REASON : lambda email, courseName, reason:
+        email + " error message " + courseName + " " + reason,
+    NO_PREFERENCES : lambda email, _:
+        email + " has no preferences.",
+    INELIGIBLE_CHOICE_DROPPED : lambda email, courseName, reason:
+        email + " ranked " + courseName + " but " + reason + " so it was dropped from their wishlist",
+    SECTION : lambda _, __, title:
+        "\n---- " + title + " ----",
+    FORCE_UNKNOWN_COURSE : lambda email, courseName:
+        "Trying to force " + email + " into the nonexistent course " + courseName + "; doing nothing.",
+    FORCE_UNKNOWN_STUDENT : lambda email, courseName:
+        "Trying to force nonexistent " + email + " into course " + courseName + "; doing nothing.",
+    BAD_MATCH : lambda email, courseName, reason, studentText:
+        "%s matched to %s but %-45s.\tstudent: %s" % (email, courseName, reason, studentText),
+    MISSING_REQUIREMENTS : lambda email, _, matchedCourses, missingRequirements:
+        "%s, a senior with CS.399 who matched to [%s], is missing [%s]"
+        % (email, ", ".join(matchedCourses), ", ".join(missingRequirements)),
+    OVER_CAPACITY : lambda _, courseName, size, capacity:
+        "%s has %d students but only %d seats" % (courseName, size, capacity),
+    INELIGIBLE_MATCH : lambda email, courseName:
+        "%s matched to %s, which they can't take or didn't ask for" % (email, courseName),
+    BLOCKING_PAIR : lambda email, courseName:
+        "%s and %s would both rather have each other than what they got" % (email, courseName),
+}
+
+
+class DiagnosticsSink:
+    '''
+    Collects diagnostics and writes the new ones out when flushed.
+
+    level - the --warnings level; at 0 nothing is collected.  Warnings that
+            only show at level 1 are left out by the code reporting them,
+            which is told the level (its warningsLevel argument).
+    fileName - JSONL file to write to instead of stderr
+    flushSize - how many diagnostics to buffer before flushing, or None to
+                only flush when asked
+    '''
+    def __init__(self, level=0, fileName=None, flushSize=FLUSH_SIZE):
+        self.level = level
+        self.fileName = fileName
+        self.flushSize = flushSize
+        self.buffer = []
+        self.written = set()
+        if fileName is not None:
+            open(fileName, "w").close()
+
+    def report(self, code, email, courseName, args, message=None):
+        self.buffer.append((code, email, courseName, args, message))
+        if self.flushSize is not None and len(self.buffer) >= self.flushSize:
+            self.flush()
+
+    def takeMessages(self):
+        '''
+        Empties the buffer, returning (code, email, course name, message) for
+        each diagnostic in it.
+        '''
+        buffer, self.buffer = self.buffer, []
+        return [(code, email, courseName,
+                 message if message is not None else MESSAGES[code](email, courseName, *args))
+                for code, email, courseName, args, message in buffer]
+
+    def flush(self):
+        lines = []
+        for code, email, courseName, message in self.takeMessages():
+            if (code, message) in self.written:
+                continue
+            self.written.add((code, message))
+            if self.fileName is not None:
+                lines.append(json.dumps({"code" : code, "email" : email, "course" : courseName,
+                                         "message" : message}) + "\n")
+            else:
+                lines.extend("WARNING: %s\n" % line for line in message.split("\n"))
+        if not lines:
+            return
+        if self.fileName is not None:
+            with open(self.fileName, "a") as diagnosticsFile:
+                diagnosticsFile.write("".join(lines))
+        else:
+            sys.stderr.write("".join(lines))
+            sys.stderr.flush()
+
+
+sink = DiagnosticsSink()
+
+def configure(level, fileName=None):
+    '''
+    Starts collecting diagnostics at the given --warnings level, written to
+    stderr or to the JSONL file fileName.  Anything left unflushed is
+    written when the program exits.
+    '''
+    global sink
+    flush()
+    sink = DiagnosticsSink(level, fileName)
+    atexit.register(sink.flush)
+
+def enabled():
+    '''
+    Returns True if diagnostics are being collected.
+    '''
+    return sink.level > 0
+
+def report(code, email=None, courseName=None, *args):
+    '''
+    Records a diagnostic: code is one of the codes above, and the arguments
+    are what its message in MESSAGES takes.
+    '''
+    if sink.level == 0:
+        return
+    sink.report(code, email, courseName, args)
+
+def flush():
+    sink.flush()
+
+def collectInWorker(level=None):
+    '''
+    Makes a worker process keep its diagnostics to hand back with
+    takeMessages() instead of writing them itself.  A worker that wasn't
+    forked has to be told the level.
+    '''
+    global sink
+    sink = DiagnosticsSink(sink.level if level is None else level, flushSize=None)
+
+def takeMessages():
+    return sink.takeMessages()
+
+def addMessages(messages):
+    '''
+    Records diagnostics already formatted by takeMessages() (e.g. in a
+    worker process).
+    '''
+    if sink.level == 0:
+        return
+    for code, email, courseName, message in messages:
+        sink.report(code, email, courseName, None, message)
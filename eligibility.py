@@ -0,0 +1,139 @@
+'''
+Precomputed answers to Course.cannotTake() for every student and course.
+
+Each course in the match gets a bit position; each student gets a row: an
+integer bitmask of the courses they can't take, plus a bitmask per reason
+code.  Rows are computed once per student (and again only if their course
+history changes), with courses that share prerequisites checked together,
+after which eligibility checks are O(1).
+The wordy explanation from Course.cannotTake() is only built when a warning
+actually needs it.
+'''
+import course
+import diagnostics
+
+# Reasons a student can't take a course; these combine as bit flags.
+MISSING_PREREQUISITES = 1     # missing at least one of the prerequisites
+MISSING_ANY_PREREQUISITE = 2  # has none of the options for an OR-PREREQS course
+ALREADY_TAKEN = 4             # course was already taken
+
+
+class EligibilityMatrix:
+
+    def __init__(self, courseDictionary):
+        '''
+        courseDictionary - dictionary mapping from course names to Course objects
+        '''
+        self.courseDictionary = courseDictionary
+        self.courseBits = {courseName : bit for bit, courseName in enumerate(courseDictionary)}
+
+        # Courses with the same prerequisites are checked together: maps
+        # (prerequisites as a mask over course.COURSE_IDS, OR-PREREQS?) to the
+        # mask of matrix bits for the courses with those prerequisites
+        self.requirementGroups = {}
+        # Maps course.COURSE_IDS masks of the courses themselves to matrix bits
+        self.courseIdsToBits = {}
+        # Maps emails to the mask of matrix bits for courses they have waivers for
+        self.waivers = {}
+        for bit, c in enumerate(courseDictionary.values()):
+            requirement = (course.COURSE_IDS.getMaskForCourses(c.prerequisites), c.orPrerequisites)
+            self.requirementGroups[requirement] = self.requirementGroups.get(requirement, 0) | 1 << bit
+            courseMask = course.COURSE_IDS.getMask(c.getCourseName())
+            self.courseIdsToBits[courseMask] = self.courseIdsToBits.get(courseMask, 0) | 1 << bit
+            for email in c.studentsWithWaivers:
+                self.waivers[email] = self.waivers.get(email, 0) | 1 << bit
+        self.rows = {} # email -> (history version, ineligible bitmask, {reason code : bitmask})
+
+    def getRow(self, student):
+        '''
+        Returns (ineligible bitmask, {reason code : bitmask of courses with
+        that problem}) for this student, computing it if we haven't yet or
+        their course history has changed.
+        '''
+        email = student.getEmail()
+        row = self.rows.get(email)
+        if row is None or row[0] != student.getHistoryVersion():
+            coursesTaken = student.getCoursesTakenMask()
+            missingPrerequisites = 0
+            missingAnyPrerequisite = 0
+            for (prerequisites, orPrerequisites), courseBits in self.requirementGroups.items():
+                if not orPrerequisites:
+                    if prerequisites & ~coursesTaken:
+                        missingPrerequisites |= courseBits
+                elif prerequisites and not prerequisites & coursesTaken:
+                    missingAnyPrerequisite |= courseBits
+            alreadyTaken = 0
+            rawCoursesTaken = student.getRawCoursesTakenMask()
+            while rawCoursesTaken:
+                lowestBit = rawCoursesTaken & -rawCoursesTaken
+                alreadyTaken |= self.courseIdsToBits.get(lowestBit, 0)
+                rawCoursesTaken ^= lowestBit
+            # Prereq waivers override everything else
+            waived = ~self.waivers.get(email, 0)
+            reasons = {MISSING_PREREQUISITES : missingPrerequisites & waived,
+                       MISSING_ANY_PREREQUISITE : missingAnyPrerequisite & waived,
+                       ALREADY_TAKEN : alreadyTaken & waived}
+            ineligible = (missingPrerequisites | missingAnyPrerequisite | alreadyTaken) & waived
+            row = (student.getHistoryVersion(), ineligible, reasons)
+            self.rows[email] = row
+        return row[1], row[2]
+
+    def canTake(self, student, courseName):
+        '''
+        Returns True if student can take the course, matching
+        not courseDictionary[courseName].cannotTake(student).
+        '''
+        ineligible, _ = self.getRow(student)
+        return not (ineligible >> self.courseBits[courseName]) & 1
+
+    def getReason(self, student, courseName):
+        '''
+        Returns the reason code(s) for why student can't take the course, or
+        0 if they can.
+        '''
+        _, reasons = self.getRow(student)
+        bit = self.courseBits[courseName]
+        return sum(reason for reason, courses in reasons.items() if (courses >> bit) & 1)
+
+    def describe(self, student, courseName):
+        '''
+        Returns the description of why student can't take the course, as
+        given by Course.cannotTake(), or False if they can.
+        '''
+        if self.canTake(student, courseName):
+            return False
+        return self.courseDictionary[courseName].cannotTake(student)
+
+    def splitWishList(self, student, wishlist):
+        '''
+        Splits wishlist (a list of course names) into the courses student
+        can take and the courses they can't, each in their original order.
+        '''
+        ineligible, _ = self.getRow(student)
+        courseBits = self.courseBits
+        eligibleCourses = []
+        ineligibleCourses = []
+        for courseName in wishlist:
+            if (ineligible >> courseBits[courseName]) & 1:
+                ineligibleCourses.append(courseName)
+            else:
+                eligibleCourses.append(courseName)
+        return eligibleCourses, ineligibleCourses
+
+
+def getEligibleWishLists(studentDict, emails, eligibilityMatrix: EligibilityMatrix):
+    '''
+    Returns a dictionary from each of the given emails to that student's
+    wishlist with every course they can't take removed, so that the match
+    never wastes a proposal on one.  Warns about each course removed.
+    '''
+    wishlists = {}
+    for email in emails:
+        student = studentDict[email]
+        wishlists[email], ineligibleCourses = eligibilityMatrix.splitWishList(student, student.getWishList())
+        if not diagnostics.enabled():
+            continue
+        for courseName in ineligibleCourses:
+            diagnostics.report(diagnostics.INELIGIBLE_CHOICE_DROPPED, email, courseName,
+                               str(eligibilityMatrix.describe(student, courseName)))
+    return wishlists
@@ -1,62 +1,86 @@
 import sys
-import warnings
+import heapq
 import argparse
+import os
+import random
 
+import components
 import course
+import diagnostics
 import student
 import filenames
 import priorityDict
+import profiling
+import matchEngine
+import matchOutput
+import eligibility
+import parallelLoad
+import registrarStore
+import snapshot
+import verify
+import simulate
 from collections import defaultdict
 
 def printMatch(rosters, rejections, courseDictionary, studentDictionary=None):
-    print()
-    numMatches = 0
-    for c in courseDictionary:
-        roster = rosters[courseDictionary[c]]
-        numMatches += len(roster)        
-        print(c,
-              "%d/%d" % (len(roster), courseDictionary[c].getCapacity()),
-              " ".join(sorted(roster)).replace("@carleton.edu",""))
-        if studentDictionary is not None:
-            verbose_strings = [(
-                studentDictionary[s].getName()
-                + ","
-                + str(studentDictionary[s].getRegistrationClassYear())
-                + ","
-                + str(studentDictionary[s].getWishList()))
-                               for s in roster]
-            print(c,
-              "%d/%d" % (len(roster), courseDictionary[c].getCapacity()))
-            print(
-              "\n".join(verbose_strings).replace("@carleton.edu",""))
-
-    print(":( :( ", "%d   " % len(rejections),
-          " ".join(sorted(rejections)).replace("@carleton.edu",""))
-    print(":) :) ", "%d   " % numMatches)
-    print("total students processed", "%d   " % (numMatches + len(rejections)))
+    matchOutput.writeRosters(sys.stdout, rosters, rejections, courseDictionary, studentDictionary)
 
 def printRegistrarMatch(rosters, rejections, courseDictionary, studentDictionary):
-    for c in courseDictionary:
-        roster = rosters[courseDictionary[c]]
-        print("New capacity for %s:    %d"
-              % (c, courseDictionary[c].getCapacity() - len(roster)))
-        print("New capacity for %s.M:  %d" % (c, len(roster)))
-        print()
-    for c in courseDictionary:
-        roster = rosters[courseDictionary[c]]
-        for email in sorted(roster):
-            print("%-25s%-18s%s.M" % (email.replace("@carleton.edu",""),
-                                        studentDictionary[email].getID(), c))
-        print()
-    print("DID NOT MATCH:", ", ".join(sorted(rejections)))  
-    
-def match(studentDict, courseDict, show_steps=False, maxCoursesDictionary={}):
-    wishlists = {s : studentDict[s].getWishList() for s in studentDict
-                 if studentDict[s].submittedPreferences()}
+    matchOutput.writeRegistrarText(sys.stdout, rosters, rejections, courseDictionary, studentDictionary)
+
+def match(studentDict, courseDict, show_steps=False, maxCoursesDictionary={}, engine="classic",
+          counters=None, workers=1):
+    '''
+    Runs student-proposing Gale-Shapley.  Returns rosters (keys=Course
+    objects, values=lists of student emails) and the list of emails of
+    students who ran out of options.  engine="fast" runs the same algorithm
+    on integer-indexed arrays (see matchEngine.py); the result is identical.
+    If counters (a Counter) is given, counts of what happened are added to
+    it (see profiling.py).  With workers > 1, each group of students and
+    courses that's independent of the rest is matched on its own by the
+    integer engine, using that many processes (see components.py); the
+    result is again identical.
+    '''
+    # PriorityRanks.numEvaluations is a running total, so count what this
+    # match adds to it
+    numEvaluations = course.PriorityRanks.numEvaluations
+    if workers > 1:
+        result = components.componentMatch(studentDict, courseDict, show_steps=show_steps,
+                                           maxCoursesDictionary=maxCoursesDictionary, counters=counters,
+                                           workers=workers)
+    elif engine == "fast":
+        result = matchEngine.fastMatch(studentDict, courseDict, show_steps=show_steps,
+                                       maxCoursesDictionary=maxCoursesDictionary, counters=counters)
+    elif engine == "classic":
+        result = classicMatch(studentDict, courseDict, show_steps=show_steps,
+                              maxCoursesDictionary=maxCoursesDictionary, counters=counters)
+    else:
+        raise ValueError("Unknown match engine: " + str(engine))
+    if counters is not None:
+        counters["priorityEvaluations"] += course.PriorityRanks.numEvaluations - numEvaluations
+    return result
+
+def classicMatch(studentDict, courseDict, show_steps=False, maxCoursesDictionary={}, counters=None):
+    '''
+    match() with the classic engine: the match is run on Course and Student
+    objects, with each roster a heap of course ranks.
+    '''
+    participants = [s for s in studentDict if studentDict[s].submittedPreferences()]
+    wishlists = eligibility.getEligibleWishLists(studentDict, participants,
+                                                 eligibility.EligibilityMatrix(courseDict))
+    if counters is not None:
+        counters["cannotTakeSkips"] += sum(len(studentDict[email].getWishList()) - len(wishlists[email])
+                                           for email in participants)
+    # While matching, each roster is a min-heap of (course rank, email,
+    # arrival number) entries, so the student a course likes least is always
+    # at the front.
     rosters = {c : [] for c in courseDict.values()}
+    numArrivals = 0
 
     universallyRejected = []
-    singleStudentEmails = [s for s in wishlists]
+    singleStudentEmails = [s for s in participants]
+
+    course.assignTiebreakers(courseDict, singleStudentEmails)
+    course.assignPriorityRanks(courseDict, studentDict)
 
     # Add in exceptions for extra courses for a student
     for email in maxCoursesDictionary:
@@ -75,39 +99,49 @@ def match(studentDict, courseDict, show_steps=False, maxCoursesDictionary={}):
         proposee = max([courseDict[c] for c in wishlists[proposerEmail]],
                              key = studentDict[proposerEmail].priority)
         wishlists[proposerEmail].remove(proposee.getCourseName())
-        cannotTakeProposedCourse = proposee.cannotTake(studentDict[proposerEmail])
-        if cannotTakeProposedCourse:
-            warnings.warn(proposerEmail + " tried to propose to " + proposee.getCourseName()
-                          + " but " + cannotTakeProposedCourse + " so returning to singledom")
-            singleStudentEmails.append(proposerEmail)            
-        else:
-            # Otherwise, add proposer to top remaining choice, which dumps
-            # one member of its roster if it's just now gone over capacity.
-            rosters[proposee].append(proposerEmail)
-            if show_steps: print("Adding", proposerEmail, "to", proposee.getCourseName(),
-                                 "which now has", len(rosters[proposee]), "matches", end="")
-
-            if len(rosters[proposee]) > proposee.getCapacity():
-                # You're the worst.
-                dumpeeEmail = min([studentDict[s] for s in rosters[proposee]],
-                                  key = proposee.priority).getEmail()
-                if show_steps: print(" but, bad news,", proposee, "is dumping", dumpeeEmail,end="")
-                rosters[proposee].remove(dumpeeEmail)
-                singleStudentEmails.append(dumpeeEmail)
-            if show_steps: print(".")
 
+        # Add proposer to top remaining choice (which they're eligible for,
+        # since wishlists were pruned), which dumps one member of its roster
+        # if it's just now gone over capacity.
+        heapq.heappush(rosters[proposee],
+                       (proposee.rank(studentDict[proposerEmail]), proposerEmail, numArrivals))
+        numArrivals += 1
+        if show_steps: print("Adding", proposerEmail, "to", proposee.getCourseName(),
+                             "which now has", len(rosters[proposee]), "matches", end="")
+
+        if len(rosters[proposee]) > proposee.getCapacity():
+            # You're the worst.
+            _, dumpeeEmail, _ = heapq.heappop(rosters[proposee])
+            if show_steps: print(" but, bad news,", proposee, "is dumping", dumpeeEmail,end="")
+            singleStudentEmails.append(dumpeeEmail)
+        if show_steps: print(".")
+
+    if counters is not None:
+        # Every proposal makes one rank lookup, and either stays on a roster
+        # or is evicted
+        counters["proposals"] += numArrivals
+        counters["rankLookups"] += numArrivals
+        counters["evictions"] += numArrivals - sum(len(roster) for roster in rosters.values())
+
+    # Hand back plain lists of emails, in the order students joined each roster
+    rosters = {c : [email for _, email, _ in sorted(rosters[c], key=lambda entry: entry[2])]
+               for c in rosters}
     return rosters, universallyRejected
 
 def warnForBadMatches(studentDictionary, rosters):
-    warnings.warn("")
-    warnings.warn("---- students who matched to a course they can't take? ----")
+    # Checking every match takes an eligibility matrix of its own
+    if not diagnostics.enabled():
+        return
+    diagnostics.report(diagnostics.SECTION, None, None, "students who matched to a course they can't take?")
+    courseDictionary = {c.getCourseName() : c for c in rosters}
+    eligibilityMatrix = eligibility.EligibilityMatrix(courseDictionary)
     for course in rosters:
         for sEmail in rosters[course]:
-            if course.cannotTake(studentDictionary[sEmail]):
-                warnings.warn("%s matched to %s but %-45s.\tstudent: %s"
-                              % (sEmail, course.getCourseName(),
-                                 course.cannotTake(studentDictionary[sEmail]),
-                                 studentDictionary[sEmail]))
+            if not eligibilityMatrix.canTake(studentDictionary[sEmail], course.getCourseName()):
+                diagnostics.report(diagnostics.BAD_MATCH, sEmail, course.getCourseName(),
+                                   str(eligibilityMatrix.describe(studentDictionary[sEmail],
+                                                                  course.getCourseName())),
+                                   str(studentDictionary[sEmail]))
                               
 def warnForMissingRequirements(studentDictionary, courseDictionary, rosters, currentYear, threshold=1, useOnlyCoreCoursesForMajor=False):
     '''Issue warnings for any students who (i) are seniors [grad year =
@@ -115,10 +149,11 @@ def warnForMissingRequirements(studentDictionary, courseDictionary, rosters, cur
     records), and (iii) are missing at least threshold requirements
     for the major.
     '''
-    warnings.warn("")
-    warnings.warn("---- CS majors who may not be on pace for graduation? ----")
-    coreTaken = {s : s.getCoreCoursesTaken() for s in studentDictionary.values()}
-    elecTaken = {s : s.getElectivesTaken() for s in studentDictionary.values()}
+    diagnostics.report(diagnostics.SECTION, None, None, "CS majors who may not be on pace for graduation?")
+    # The getters hand back shared, read-only histories, so add the matches
+    # to copies of them
+    coreTaken = {s : list(s.getCoreCoursesTaken()) for s in studentDictionary.values()}
+    elecTaken = {s : list(s.getElectivesTaken()) for s in studentDictionary.values()}
     myMatch = defaultdict(list)
     for c in courseDictionary.values():
         for s in rosters[c]:
@@ -133,15 +168,14 @@ def warnForMissingRequirements(studentDictionary, courseDictionary, rosters, cur
         missingRequirements += ["elective"] * (2 - len(elecTaken[s]))
         #
         if int(s.getRegistrationClassYear()) == student.ClassYear.SENIOR \
-           and (useOnlyCoreCoursesForMajor or course.regularize("CS.399") in s.getCoursesTaken()) \
+           and (useOnlyCoreCoursesForMajor or s.hasTaken(course.regularize("CS.399"))) \
            and isMajor(s, coreTaken) \
            and len(missingRequirements) >= threshold:
-            warnings.warn("%s, a senior with CS.399 who matched to [%s], is missing [%s]"
-                          % (s.getEmail(), ", ".join(myMatch[s.getEmail()]),
-                             ", ".join(missingRequirements)))
+            diagnostics.report(diagnostics.MISSING_REQUIREMENTS, s.getEmail(), None,
+                               myMatch[s.getEmail()], missingRequirements)
 
 def isMajor(s, coreTaken):
-     comps = course.regularize("CS.399") in s.getCoursesTaken()
+     comps = s.hasTaken(course.regularize("CS.399"))
      missingRequirements = list(course.CORE_COURSES.difference(set(coreTaken[s])))
      return comps or len(missingRequirements) < 3
 
@@ -160,11 +194,9 @@ def prepareForForcedMatches(forcedMatches, courseDictionary,
         email = pair.split(':')[0]
         courseName = course.regularize(pair.split(':')[1])
         if courseName not in courseDictionary:
-            warnings.warn("Trying to force " + email + " into the nonexistent "
-                          + "course " + courseName + "; doing nothing.")
+            diagnostics.report(diagnostics.FORCE_UNKNOWN_COURSE, email, courseName)
         elif email not in studentDictionary:
-            warnings.warn("Trying to force nonexistent " + email + " into "
-                          + "course " + courseName + "; doing nothing.")
+            diagnostics.report(diagnostics.FORCE_UNKNOWN_STUDENT, email, courseName)
         else:
             courseDictionary[courseName].decrementCapacity()
             studentDictionary[email].markIneligibleForMatch()
@@ -237,8 +269,7 @@ def applyForcedMatches(forcedMatches, courseDictionary,
         email = pair.split(':')[0]
         courseName = course.regularize(pair.split(':')[1])
         if courseDictionary[courseName] not in rosters:
-            warnings.warn("Trying to force " + email + " into the nonexistent "
-                          + "course " + courseName + "; doing nothing.")
+            diagnostics.report(diagnostics.FORCE_UNKNOWN_COURSE, email, courseName)
         courseDictionary[courseName].incrementCapacity()
         rosters[courseDictionary[courseName]].append(email)
         studentDictionary[email].markEligibleForMatch()
@@ -247,13 +278,134 @@ def applyForcedMatches(forcedMatches, courseDictionary,
 
 
             
-def main():
-    
+def addInputArguments(parser):
+    '''
+    Adds the options that say which term the input files are for and how to
+    load them (the ones loadMatchInputs reads from its args) to parser, for
+    match.py and the tools built on it.
+    '''
+    parser.add_argument('--senior_class_year', type=str, required=True,
+                        help='senior class grad year (4 digits) at the time data was pulled')
+    parser.add_argument('--upcoming_term', type=str, choices=['fall', 'winter', 'spring'],
+                        help='term that students are registering for', required=True)
+    parser.add_argument('--registrar_store', type=str, default=None,
+                        help='SQLite store of registrar histories (see registrarStore.py): the registrar file \
+                              is added to it if it is new, and students are loaded from it; match.py only \
+                              loads students in the preference file or named in --force/--num_courses_exception, \
+                              as with --participants_only')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='load the input files from scratch instead of using (or saving) a snapshot')
+    parser.add_argument('--clear_cache', action='store_true',
+                        help='delete every saved snapshot before running')
+    parser.add_argument('--cache_dir', type=str, default=snapshot.DEFAULT_CACHE_DIRECTORY,
+                        help='directory for snapshots of the loaded input files')
+
+def loadInputFiles(args, tiebreaker, participants=None, profile=profiling.DISABLED, warningsLevel=0,
+                   workers=1, advertisingFileName=None):
+    '''
+    Loads the files named in filenames.py, as described by args (see
+    addInputArguments), with the given --warnings level and number of
+    processes.  Returns (courseDictionary, studentDictionary, number of
+    students in the preference file); if advertisingFileName is given,
+    writes the emails to advertise to there and exits instead.
+    '''
+    with profile.phase("course_load"):
+        courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+
+    loadedInParallel = workers > 1 and args.registrar_store is None
+    if args.registrar_store is not None:
+        store = registrarStore.RegistrarStore(args.registrar_store)
+        try:
+            with profile.phase("registrar_ingest"):
+                store.ingest(filenames.registrarFileName)
+            with profile.phase("registrar_load"):
+                studentDictionary = store.loadStudents(participants, warningsLevel=warningsLevel)
+        finally:
+            store.close()
+    elif loadedInParallel:
+        # The workers read both files at once
+        with profile.phase("registrar_load_and_preference_merge"):
+            studentDictionary, numStudents = parallelLoad.loadStudentsInParallel(
+                filenames.registrarFileName,
+                filenames.preferenceFileName if advertisingFileName is None else None,
+                courseDictionary, workers, warningsLevel=warningsLevel, emails=participants)
+    else:
+        with profile.phase("registrar_load"):
+            studentDictionary = student.loadStudentsFromRegistrarData(
+                filenames.registrarFileName, warningsLevel=warningsLevel, emails=participants)
 
-    def warning_on_one_line(message, category, filename, lineno, file=None, line=None):
-        return 'WARNING: %s\n' % (message)     # See https://pymotw.com/2/warnings/
-    warnings.formatwarning = warning_on_one_line    
+    if advertisingFileName is not None:
+        student.writeUniqueEmails(studentDictionary, advertisingFileName)
+        sys.exit(0)
 
+    if not loadedInParallel:
+        with profile.phase("preference_merge"):
+            numStudents = student.addPreferenceDataToStudentDictionary(
+                filenames.preferenceFileName, studentDictionary, courseDictionary,
+                warningsLevel=warningsLevel)
+    return courseDictionary, studentDictionary, numStudents
+
+def loadMatchInputs(args, tiebreaker, participants=None, profile=profiling.DISABLED, warningsLevel=0,
+                    workers=1, advertisingFileName=None):
+    '''
+    Same as loadInputFiles, but uses (and saves) a snapshot of what was
+    loaded unless args.no_cache is set.
+    '''
+    if args.clear_cache:
+        snapshot.clearSnapshots(args.cache_dir)
+
+    # Reruns against the same input files can reuse what was loaded last time.
+    # Loading warnings aren't saved, so runs that show them always load.
+    snapshotKey = None
+    loaded = None
+    # The store is already quick to load from, and what it holds depends on
+    # more than the current registrar file
+    if not args.no_cache and warningsLevel == 0 and advertisingFileName is None \
+       and args.registrar_store is None:
+        snapshotKey = snapshot.getSnapshotKey(
+            [filenames.coursesFileName, filenames.registrarFileName, filenames.preferenceFileName],
+            [args.senior_class_year, args.upcoming_term,
+             sorted(participants) if participants is not None else None])
+        with profile.phase("snapshot_load"):
+            loaded = snapshot.loadSnapshot(args.cache_dir, snapshotKey, tiebreaker)
+
+    if loaded is not None:
+        return loaded
+    courseDictionary, studentDictionary, numStudents = loadInputFiles(
+        args, tiebreaker, participants, profile, warningsLevel=warningsLevel, workers=workers,
+        advertisingFileName=advertisingFileName)
+    if snapshotKey is not None:
+        with profile.phase("snapshot_save"):
+            snapshot.saveSnapshot(args.cache_dir, snapshotKey,
+                                  courseDictionary, studentDictionary, numStudents)
+    return courseDictionary, studentDictionary, numStudents
+
+def runSimulation(args, studentDictionary, courseDictionary, maxCoursesDictionary,
+                  forcedMatchDictionary):
+    '''
+    Runs args.simulate draws of the match (see simulate.py) and writes the
+    results to the files named by args.simulation_output.
+    '''
+    seed = args.seed if args.seed is not None else random.SystemRandom().randrange(2**63)
+    print("Simulating", args.simulate, "draws with seed", seed)
+    forcedMatches = {email : [courseName for courseName in courseNames if courseName in courseDictionary]
+                     for email, courseNames in forcedMatchDictionary.items() if email in studentDictionary}
+    lottery = simulate.Lottery(studentDictionary, courseDictionary, maxCoursesDictionary, forcedMatches)
+    results = simulate.simulate(lottery, args.simulate, seed, workers=args.workers)
+    simulate.writeProbabilities(lottery, results, args.simulation_output + "_probabilities.csv")
+    simulate.writeDistributions(lottery, results, args.simulation_output + "_distributions.csv")
+
+def saveProfile(args, profile, tiebreaker):
+    '''
+    Adds the counts kept outside the match to profile and saves it to the
+    file named by args.profile, if there is one.
+    '''
+    if args.profile is None:
+        return
+    profile.count(tiebreakerLookups=tiebreaker.numLookups)
+    profile.save(args.profile)
+
+def main():
     parser = argparse.ArgumentParser(description='Run The Match.')
     parser.add_argument('--force', type=str, nargs='*', default=[],
                         help="forced pairings list; format: 'email:course'")
@@ -263,73 +415,133 @@ def main():
                               between registrar course report and student course report, \
                               and mismatches between student stated id and actual id. "\
                               no warnings printed if not specified or set to level 0.')
+    parser.add_argument('--warnings_file', type=str, default=None,
+                        help='write warnings to this file (as JSON lines, with a code, student and course \
+                              for each) instead of to stderr')
     parser.add_argument('--verbose', action='store_true',
                         help='display Gale-Shapley status reports')
     parser.add_argument('--deterministic', action='store_true',
                         help='use nonrandom [reproducible] tiebreaker based on MD5 hash of student email address')
     parser.add_argument('--seed', type=int,
                         help='use reproducible random tiebreakers seeded by value given (deterministic takes priority)')
+    parser.add_argument('--registrar_output', type=str, default=None,
+                        help='also save the data for the registrar to this file: CSV if the name ends in \
+                              .csv, JSON lines if it ends in .jsonl, and the --registrar text otherwise')
     parser.add_argument('--suppress_match_output', action='store_true',
                         help='do not print the match (debugging/warnings only)')
     parser.add_argument('--registrar', action='store_true',
                         help='print the data for registrar email in addition to other data')
-    parser.add_argument('--senior_class_year', type=str, required=True,
-                        help='senior class grad year (4 digits) at the time data was pulled')
-    parser.add_argument('--upcoming_term', type=str, choices=['fall', 'winter', 'spring'],
-                        help='term that students are registering for', required=True)
+    addInputArguments(parser)
     parser.add_argument('--missing_requirement_threshold', type=int, default=1, help='how many unfilled requirements are okay?')
     parser.add_argument('--use_course_threshold_for_major',action='store_true', help='if true, warning for missing requirements wil use hving a large number of core courses, not enrollment in 399, to determine majors')
     parser.add_argument('--num_courses_exception', type=str, nargs='*', default=[],
                         help="exceptions where student is allowed multiple matches; format: 'email:num matches'")
+    parser.add_argument('--engine', type=str, choices=['classic', 'fast'], default='classic',
+                        help='match implementation to use; fast uses integer-indexed arrays and gives the same match')
+    parser.add_argument('--participants_only', action='store_true',
+                        help='only load registrar data for students in the preference file or named in \
+                              --force/--num_courses_exception; the missing requirements warnings then \
+                              only cover those students')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to use for loading the registrar and preference files, \
+                              and for matching independent groups of students and courses')
+    parser.add_argument('--lottery_file', type=str, default=None,
+                        help='CSV file of tiebreakers: if it exists, students in it keep their tiebreakers, \
+                              and every tiebreaker used is saved to it after the match')
+    parser.add_argument('--simulate', type=int, default=None, metavar='N',
+                        help='instead of one match, run N matches with independent random tiebreakers \
+                              (seeded by --seed if given) and write how likely each outcome is')
+    parser.add_argument('--simulation_output', type=str, default='simulation',
+                        help='prefix for the files written by --simulate: PREFIX_probabilities.csv \
+                              and PREFIX_distributions.csv')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='save the time and peak memory of each phase of the run, and counts of what \
+                              happened in the match, to this file: JSON, or a Prometheus textfile if the \
+                              name ends in .prom')
+    parser.add_argument('--verify', action='store_true',
+                        help='check that the final match (with forced matches) is stable, within capacity and \
+                              only has students in courses they can take and asked for; problems are \
+                              warnings, and make the exit status 1')
     parser.add_argument('--write_emails_for_advertising', type=str, default=None,
                         help="print only the emails of students who should be notified about the match (based on registrar data")
     args = parser.parse_args()
-    if args.warnings == 0:
-        warnings.filterwarnings('ignore')
+    diagnostics.configure(args.warnings, args.warnings_file)
+    profile = profiling.Profile() if args.profile is not None else profiling.DISABLED
 
     tiebreaker = priorityDict.PriorityDictionary(debug=args.deterministic, seed=args.seed)
-
-    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+    if args.lottery_file is not None and os.path.exists(args.lottery_file):
+        tiebreaker.loadPriorities(args.lottery_file)
 
     student.Student.setGeneralCalendarInfo(
         student.getNumericYearFromText(args.senior_class_year),
         args.upcoming_term)
 
-    studentDictionary = student.loadStudentsFromRegistrarData(
-        filenames.registrarFileName, warningsLevel=args.warnings)
+    # Advertising needs everyone, so only restrict who we load when matching
+    participants = None
+    if (args.participants_only or args.registrar_store is not None) \
+       and args.write_emails_for_advertising is None:
+        participants = student.readPreferenceEmails(filenames.preferenceFileName)
+        participants.update(pair.split(':')[0] for pair in args.force + args.num_courses_exception)
 
-    if args.write_emails_for_advertising is not None:
-        student.writeUniqueEmails(studentDictionary, args.write_emails_for_advertising)
-        sys.exit(0)
-
-    numStudents = student.addPreferenceDataToStudentDictionary(
-        filenames.preferenceFileName, studentDictionary, courseDictionary,
-        warningsLevel=args.warnings)
+    courseDictionary, studentDictionary, numStudents = loadMatchInputs(
+        args, tiebreaker, participants, profile, warningsLevel=args.warnings, workers=args.workers,
+        advertisingFileName=args.write_emails_for_advertising)
 
     if args.verbose:
+        print("Course name regularization cache:", course.getRegularizeCacheInfo())
         for s in studentDictionary:
             if studentDictionary[s].submittedPreferences():
                 print(studentDictionary[s])
-    prepareForForcedMatches(args.force, courseDictionary, studentDictionary, show_steps=args.verbose)
-    forcedMatchDictionary = parseForcedMatchExceptionString(args.force)
-    maxCoursesDictionary = parseMaxCoursesExceptionString(args.num_courses_exception)
-    applyNumberOfCoursesExceptionWithForcedCourses(forcedMatchDictionary, maxCoursesDictionary, studentDictionary)
+    with profile.phase("forced_match_preparation"):
+        prepareForForcedMatches(args.force, courseDictionary, studentDictionary, show_steps=args.verbose)
+        forcedMatchDictionary = parseForcedMatchExceptionString(args.force)
+        maxCoursesDictionary = parseMaxCoursesExceptionString(args.num_courses_exception)
+        applyNumberOfCoursesExceptionWithForcedCourses(forcedMatchDictionary, maxCoursesDictionary, studentDictionary)
 
-    rosters, rejections = match(studentDictionary, courseDictionary, show_steps=args.verbose, maxCoursesDictionary=maxCoursesDictionary)
+    if args.simulate is not None:
+        with profile.phase("simulation"):
+            runSimulation(args, studentDictionary, courseDictionary, maxCoursesDictionary, forcedMatchDictionary)
+        saveProfile(args, profile, tiebreaker)
+        return
 
+    with profile.phase("match"):
+        rosters, rejections = match(studentDictionary, courseDictionary, show_steps=args.verbose,
+                                    maxCoursesDictionary=maxCoursesDictionary, engine=args.engine,
+                                    counters=profile.counters, workers=args.workers)
+    if args.lottery_file is not None:
+        tiebreaker.savePriorities(args.lottery_file)
 
-    applyForcedMatches(args.force, courseDictionary, studentDictionary, rosters, show_steps=args.verbose)
-    if args.registrar:
-        printRegistrarMatch(rosters, rejections, courseDictionary, studentDictionary)
-    if not args.suppress_match_output:
-        printMatch(rosters, rejections, courseDictionary, studentDictionary)
-        print("total students in preferences file (should match total students processed minus 1 extra for each extra matched course due to exceptions):", numStudents)
-        
-    for rejection in rejections:
-        print(studentDictionary[rejection], studentDictionary[rejection].getWishList())
-                  
-    warnForBadMatches(studentDictionary, rosters)
-    warnForMissingRequirements(studentDictionary, courseDictionary, rosters, args.senior_class_year, threshold=args.missing_requirement_threshold, useOnlyCoreCoursesForMajor=args.use_course_threshold_for_major)
+
+    with profile.phase("forced_match_application"):
+        applyForcedMatches(args.force, courseDictionary, studentDictionary, rosters, show_steps=args.verbose)
+    with profile.phase("output"):
+        if args.registrar:
+            printRegistrarMatch(rosters, rejections, courseDictionary, studentDictionary)
+        if not args.suppress_match_output:
+            printMatch(rosters, rejections, courseDictionary, studentDictionary)
+            print("total students in preferences file (should match total students processed minus 1 extra for each extra matched course due to exceptions):", numStudents)
+
+        matchOutput.writeRejectedStudents(sys.stdout, rejections, studentDictionary)
+        if args.registrar_output is not None:
+            matchOutput.saveRegistrarMatch(args.registrar_output, rosters, rejections,
+                                           courseDictionary, studentDictionary)
+
+    with profile.phase("warn_for_bad_matches"):
+        warnForBadMatches(studentDictionary, rosters)
+    with profile.phase("warn_for_missing_requirements"):
+        warnForMissingRequirements(studentDictionary, courseDictionary, rosters, args.senior_class_year, threshold=args.missing_requirement_threshold, useOnlyCoreCoursesForMajor=args.use_course_threshold_for_major)
+    verification = None
+    if args.verify:
+        with profile.phase("verification"):
+            verification = verify.verifyMatch(studentDictionary, courseDictionary, rosters, rejections,
+                                              forcedMatchDictionary)
+            verify.reportVerification(verification)
+        print("Verified the match:", verification.getSummary())
+    with profile.phase("warnings_output"):
+        diagnostics.flush()
+    saveProfile(args, profile, tiebreaker)
+    if verification is not None and not (verification.isValid() and verification.isStable()):
+        sys.exit(1)
     
 if __name__ == "__main__":
     main()
@@ -0,0 +1,482 @@
+'''
+An integer-indexed implementation of the student-proposing deferred
+acceptance loop in match.match(), for registrar-scale runs.
+
+Students and courses are mapped to dense integer IDs once, each student's
+wishlist becomes an array of course IDs walked with a next-choice cursor,
+and proposals are run from a FIFO queue.  Proposals happen in exactly the
+same order as in match.match(), so the rosters and rejections it returns
+are identical.
+
+A MatchState can also keep a history of every proposal and rejection, so
+that after a change (a capacity change, a student added, removed or forced
+into a course) only the part of the match that depended on what changed is
+undone and rerun.  Deferred acceptance ends with the same match whatever
+order proposals are made in, so the result is the same match a full rerun
+would give, though rosters may list students in a different order.
+'''
+import bisect
+import heapq
+from collections import deque
+
+import course
+import eligibility
+
+
+class MatchProblem:
+    '''
+    The read-only part of a match: who wants what, and how much each course
+    likes each of the students who want it.
+
+    emails[s] - email of student s
+    courses[c] - Course object with ID c
+    preferences[s] - course IDs on student s's wishlist that they're eligible
+                     for, most preferred first
+    priorities[s] - priorities[s][k] is course preferences[s][k]'s integer rank
+                    for student s (bigger is better)
+    slots[s] - number of courses student s may be matched to
+    capacities[c] - number of seats in course c
+    '''
+    def __init__(self, studentDict, courseDict, maxCoursesDictionary={}):
+        self.emails = [s for s in studentDict if studentDict[s].submittedPreferences()]
+        self.studentIndex = {email : s for s, email in enumerate(self.emails)}
+        self.courses = list(courseDict.values())
+        self.courseIndex = {c.getCourseName() : i for i, c in enumerate(self.courses)}
+
+        course.assignTiebreakers(courseDict, self.emails)
+        course.assignPriorityRanks(courseDict, studentDict)
+
+        self.studentDict = studentDict
+        self.eligibilityMatrix = eligibility.EligibilityMatrix(courseDict)
+        wishlists = eligibility.getEligibleWishLists(studentDict, self.emails,
+                                                     self.eligibilityMatrix)
+        self.preferences = []
+        self.priorities = []
+        for email in self.emails:
+            student = studentDict[email]
+            wishlist = wishlists[email]
+            self.preferences.append([self.courseIndex[c] for c in wishlist])
+            self.priorities.append([courseDict[c].rank(student) for c in wishlist])
+
+        self.slots = [1] * len(self.emails)
+        for email in maxCoursesDictionary:
+            self.slots[self.studentIndex[email]] += maxCoursesDictionary[email] - 1
+        self.capacities = [c.getCapacity() for c in self.courses]
+        self.students = [studentDict[email] for email in self.emails]
+
+    def addStudent(self, email, numCourses=1):
+        '''
+        Adds the student with this email (who must already be in the student
+        dictionary the problem was built from) and returns their ID.  Adding
+        a student can change every other student's integer rank, so all of
+        the priorities are looked up again.
+        '''
+        return self.addStudents([email], [numCourses])[0]
+
+    def addStudents(self, emails, numCourses):
+        '''
+        Same as addStudent for each of emails in turn, with numCourses[i]
+        courses for emails[i], but only looking up the priorities once.
+        Returns their IDs.
+        '''
+        wishlists = eligibility.getEligibleWishLists(self.studentDict, emails,
+                                                     self.eligibilityMatrix)
+        ids = []
+        for email, studentNumCourses in zip(emails, numCourses):
+            s = len(self.emails)
+            self.emails.append(email)
+            self.studentIndex[email] = s
+            self.students.append(self.studentDict[email])
+            self.preferences.append([self.courseIndex[c] for c in wishlists[email]])
+            self.slots.append(studentNumCourses)
+            ids.append(s)
+        self.priorities = [[self.courses[c].rank(self.students[s]) for c in self.preferences[s]]
+                           for s in range(len(self.emails))]
+        return ids
+
+
+class MatchHistory:
+    '''
+    Every proposal made in a match, in order.  Proposal t (which is also
+    arrival number t in the rosters) is student proposers[t] proposing to
+    course courses[t], their choices[t]'th choice.  rejected[t] is the
+    arrival number of the proposal the course dumped to make room for
+    proposal t (or -1), and rejectedBy[t] is the proposal that caused
+    proposal t to be dumped (or -1 if it's still held).
+    '''
+    def __init__(self, numStudents, numCourses):
+        self.proposers = []
+        self.courses = []
+        self.choices = []
+        self.rejected = []
+        self.rejectedBy = []
+        self.studentProposals = [[] for _ in range(numStudents)]
+        self.courseProposals = [[] for _ in range(numCourses)]
+
+    def recordProposal(self, proposer, proposee, choice):
+        self.studentProposals[proposer].append(len(self.proposers))
+        self.courseProposals[proposee].append(len(self.proposers))
+        self.proposers.append(proposer)
+        self.courses.append(proposee)
+        self.choices.append(choice)
+        self.rejected.append(-1)
+        self.rejectedBy.append(-1)
+
+    def recordRejection(self, proposal, dumpedProposal):
+        self.rejected[proposal] = dumpedProposal
+        self.rejectedBy[dumpedProposal] = proposal
+
+    def addStudent(self):
+        self.studentProposals.append([])
+
+    def findCapacityCut(self, c, capacity):
+        '''
+        Returns the first proposal to course c that would have been handled
+        differently had c had this capacity (no more than its current one)
+        instead, or None if there isn't one.
+        '''
+        # Nothing at c is rejected until its roster first overflows
+        proposals = self.courseProposals[c]
+        capacity = max(capacity, 0)
+        return proposals[capacity] if capacity < len(proposals) else None
+
+    def undo(self, courseCuts, studentCuts):
+        '''
+        Removes every proposal that could have gone differently, given that
+        courses need to be rerun from the proposals in courseCuts (course ID
+        -> proposal) and students from the proposals in studentCuts (student
+        ID -> proposal).  Anything that was rejected by a removed proposal is
+        held again, and any student who was, or who proposed to a course
+        that's being rerun, is rerun from that point too.
+
+        Returns the set of course IDs and the set of student IDs affected.
+        '''
+        courseCut = {}
+        studentCut = {}
+        pending = []
+        def cutCourse(c, t):
+            if t < courseCut.get(c, len(self.proposers)):
+                courseCut[c] = t
+                proposals = self.courseProposals[c]
+                for u in proposals[bisect.bisect_left(proposals, t):]:
+                    heapq.heappush(pending, u)
+        def cutStudent(s, t):
+            if t < studentCut.get(s, len(self.proposers)):
+                studentCut[s] = t
+                proposals = self.studentProposals[s]
+                for u in proposals[bisect.bisect_left(proposals, t):]:
+                    heapq.heappush(pending, u)
+        for c, t in courseCuts.items():
+            cutCourse(c, t)
+        for s, t in studentCuts.items():
+            cutStudent(s, t)
+
+        # Going forward in time, so a cut never reaches back before a
+        # proposal that's already been dealt with
+        removed = set()
+        while pending:
+            t = heapq.heappop(pending)
+            if t in removed:
+                continue
+            removed.add(t)
+            cutCourse(self.courses[t], t)
+            cutStudent(self.proposers[t], t)
+            if self.rejected[t] != -1:
+                cutStudent(self.proposers[self.rejected[t]], t)
+
+        for t in removed:
+            if self.rejected[t] != -1 and self.rejected[t] not in removed:
+                self.rejectedBy[self.rejected[t]] = -1
+        for c, t in courseCut.items():
+            proposals = self.courseProposals[c]
+            del proposals[bisect.bisect_left(proposals, t):]
+        for s, t in studentCut.items():
+            proposals = self.studentProposals[s]
+            del proposals[bisect.bisect_left(proposals, t):]
+        return set(courseCut), set(studentCut)
+
+
+class MatchState:
+    '''
+    The changing part of a match over a MatchProblem: how far down their
+    wishlist each student has proposed, who each course is currently holding,
+    and who is still waiting to propose.
+    '''
+    def __init__(self, problem: MatchProblem, maxCoursesDictionary={}, keepHistory=False):
+        '''
+        keepHistory - record a MatchHistory, which the methods that change
+                      the match after it's been run need
+        '''
+        self.problem = problem
+        numStudents = len(problem.emails)
+        self.cursors = [0] * numStudents
+        # Each roster is a min-heap of (priority, student ID, arrival number)
+        self.rosters = [[] for _ in problem.courses]
+        self.numArrivals = 0
+        self.rejections = []
+        # Capacities and slots can be changed on a single state without
+        # changing the problem, which may be shared
+        self.capacities = list(problem.capacities)
+        self.slots = list(problem.slots)
+        self.forcedMatches = [] # (student ID, course ID)
+        self.history = MatchHistory(numStudents, len(problem.courses)) if keepHistory else None
+        # See trackQueueOrigins
+        self.queueOrigins = None
+        self.rejectionOrigins = []
+
+        # Students propose in the order match.match() uses: everyone once,
+        # then one extra entry for every extra course a student is allowed.
+        self.queue = deque(range(numStudents))
+        for email in maxCoursesDictionary:
+            for _ in range(maxCoursesDictionary[email] - 1):
+                self.queue.append(problem.studentIndex[email])
+
+    def run(self, show_steps=False):
+        '''
+        Runs proposals until nobody is left waiting.
+        '''
+        problem = self.problem
+        emails = problem.emails
+        courses = problem.courses
+        preferences = problem.preferences
+        priorities = problem.priorities
+        capacities = self.capacities
+        students = problem.students
+        cursors = self.cursors
+        rosters = self.rosters
+        queue = self.queue
+        history = self.history
+        origins = self.queueOrigins
+
+        while queue:
+            proposer = queue.popleft()
+            if origins is not None:
+                origin = origins.popleft()
+            choice = cursors[proposer]
+
+            # If this proposer has no options left, despair, and move on.
+            if choice == len(preferences[proposer]):
+                if show_steps: print("Grim news for %s:  you're out of options. %s" % (emails[proposer], " ".join(students[proposer].getWishList())))
+                self.rejections.append(proposer)
+                if origins is not None:
+                    self.rejectionOrigins.append(origin)
+                continue
+            cursors[proposer] = choice + 1
+            proposee = preferences[proposer][choice]
+
+            roster = rosters[proposee]
+            arrival = self.numArrivals
+            heapq.heappush(roster, (priorities[proposer][choice], proposer, arrival))
+            self.numArrivals += 1
+            if history is not None:
+                history.recordProposal(proposer, proposee, choice)
+            if show_steps: print("Adding", emails[proposer], "to", courses[proposee].getCourseName(),
+                                 "which now has", len(roster), "matches", end="")
+
+            if len(roster) > capacities[proposee]:
+                _, dumpee, dumpedArrival = heapq.heappop(roster)
+                if history is not None:
+                    history.recordRejection(arrival, dumpedArrival)
+                if show_steps: print(" but, bad news,", courses[proposee], "is dumping", emails[dumpee], end="")
+                queue.append(dumpee)
+                if origins is not None:
+                    origins.append((origin[0] + 1, origin[1]))
+            if show_steps: print(".")
+
+    def getRosters(self):
+        '''
+        Returns a dictionary from Course objects to lists of the emails of
+        the students matched to them, in the order they joined the roster,
+        followed by any forced matches.
+        '''
+        emails = self.problem.emails
+        rosters = {c : [emails[s] for _, s, _ in sorted(self.rosters[i], key=lambda entry: entry[2])]
+                   for i, c in enumerate(self.problem.courses)}
+        for s, c in self.forcedMatches:
+            rosters[self.problem.courses[c]].append(emails[s])
+        return rosters
+
+    def getRejections(self):
+        '''
+        Returns the emails of students who ran out of options, in the order
+        they ran out.
+        '''
+        emails = self.problem.emails
+        return [emails[s] for s in self.rejections]
+
+    def addCounters(self, counters):
+        '''
+        Adds this match's proposals, evictions (proposals that aren't on a
+        roster any more), rank lookups (one per proposal, as in the classic
+        engine, though this one looks ranks up in problem.priorities) and
+        wishlist entries dropped by cannotTake before the match to the
+        Counter counters.
+        '''
+        problem = self.problem
+        counters["proposals"] += self.numArrivals
+        counters["evictions"] += self.numArrivals - sum(len(roster) for roster in self.rosters)
+        counters["rankLookups"] += self.numArrivals
+        counters["cannotTakeSkips"] += sum(len(student.getWishList()) - len(preferences)
+                                           for student, preferences in zip(problem.students, problem.preferences))
+
+
+    def changeCapacity(self, courseName, change, show_steps=False):
+        '''
+        Adds change (which may be negative) seats to the course and updates
+        the match.
+        '''
+        c = self.problem.courseIndex[courseName]
+        self.undoCapacityChange(c, self.capacities[c] + change)
+        self.run(show_steps=show_steps)
+
+    def addStudent(self, email, numCourses=1, show_steps=False):
+        '''
+        Adds the student with this email, who may be matched to up to
+        numCourses courses, and updates the match.  They must already be in
+        the student dictionary the problem was built from.  This changes the
+        problem, so it shouldn't be shared with other states.
+        '''
+        self.addStudents([email], [numCourses], show_steps=show_steps)
+
+    def addStudents(self, emails, numCourses, show_steps=False):
+        '''
+        Same as addStudent for each of emails, with numCourses[i] courses for
+        emails[i], but only updating the match once.
+        '''
+        history = self.requireHistory()
+        ids = self.problem.addStudents(emails, numCourses)
+        for s, studentNumCourses in zip(ids, numCourses):
+            history.addStudent()
+            self.cursors.append(0)
+            self.slots.append(studentNumCourses)
+        # Nobody's order changed, but the numbers may have
+        for c, roster in enumerate(self.rosters):
+            self.rosters[c] = [(self.problem.priorities[sid][history.choices[t]], sid, t)
+                               for _, sid, t in roster]
+            heapq.heapify(self.rosters[c])
+        for s, studentNumCourses in zip(ids, numCourses):
+            self.queue.extend([s] * studentNumCourses)
+        self.run(show_steps=show_steps)
+
+    def removeStudent(self, email, show_steps=False):
+        '''
+        Takes the student with this email out of the match (e.g. because
+        they withdrew) and updates the match.
+        '''
+        s = self.problem.studentIndex[email]
+        self.slots[s] = 0
+        self.undoStudent(s)
+        self.run(show_steps=show_steps)
+
+    def forceMatch(self, email, courseName, show_steps=False):
+        '''
+        Forces the student with this email into the course, as --force does,
+        and updates the match: the course loses a seat and the student
+        loses a slot, and the course is taken off their wishlist.  This
+        changes the problem, so it shouldn't be shared with other states.
+        '''
+        problem = self.problem
+        s = problem.studentIndex[email]
+        c = problem.courseIndex[courseName]
+        self.slots[s] -= 1
+        self.undoStudent(s)
+        if c in problem.preferences[s]:
+            # They've no proposals left in the history, so nothing refers to
+            # positions in their wishlist
+            k = problem.preferences[s].index(c)
+            problem.preferences[s] = problem.preferences[s][:k] + problem.preferences[s][k + 1:]
+            problem.priorities[s] = problem.priorities[s][:k] + problem.priorities[s][k + 1:]
+        self.undoCapacityChange(c, self.capacities[c] - 1)
+        self.forcedMatches.append((s, c))
+        self.run(show_steps=show_steps)
+
+    def requireHistory(self):
+        if self.history is None:
+            raise ValueError("Changing a match needs a MatchState created with keepHistory=True")
+        return self.history
+
+    def undoCapacityChange(self, c, capacity):
+        '''
+        Sets course c's capacity, undoing whatever proposals could go
+        differently because of it; run() finishes the match.
+        '''
+        history = self.requireHistory()
+        cut = None
+        if capacity != self.capacities[c]:
+            cut = history.findCapacityCut(c, min(capacity, self.capacities[c]))
+        self.capacities[c] = capacity
+        if cut is not None:
+            self.undo({c : cut}, {})
+
+    def undoStudent(self, s):
+        '''
+        Undoes every proposal student s made, and whatever depended on
+        them; run() finishes the match.
+        '''
+        history = self.requireHistory()
+        proposals = history.studentProposals[s]
+        self.undo({}, {s : proposals[0] if proposals else self.numArrivals})
+
+    def undo(self, courseCuts, studentCuts):
+        '''
+        Rolls the match back as described in MatchHistory.undo, rebuilding
+        the rosters and cursors to match, and queues every affected student
+        (and everyone in studentCuts) once for each course they're not
+        holding.
+        '''
+        history = self.history
+        courses, students = history.undo(courseCuts, studentCuts)
+        students.update(studentCuts)
+        priorities = self.problem.priorities
+        for c in courses:
+            self.rosters[c] = [(priorities[history.proposers[t]][history.choices[t]], history.proposers[t], t)
+                               for t in history.courseProposals[c] if history.rejectedBy[t] == -1]
+            heapq.heapify(self.rosters[c])
+        self.rejections = [s for s in self.rejections if s not in students]
+        self.queue = deque(s for s in self.queue if s not in students)
+        self.queueOrigins = None
+        for s in sorted(students):
+            proposals = history.studentProposals[s]
+            self.cursors[s] = len(proposals)
+            numHeld = sum(1 for t in proposals if history.rejectedBy[t] == -1)
+            self.queue.extend([s] * (self.slots[s] - numHeld))
+
+    def trackQueueOrigins(self, positions):
+        '''
+        Makes run() record, for each student who runs out of options, the
+        (round, position) of that queue entry: positions[i] is the position
+        of the i'th entry in the starting queue, and a student dumped while
+        handling an entry of round r is queued in round r + 1 with the same
+        position.  Each entry queues at most one more, so a FIFO queue works
+        through the entries in (round, position) order: if this state is part
+        of a bigger match whose starting queue is numbered by positions,
+        sorting by origin gives the order the bigger match would have
+        rejected students in.  Only for a state that hasn't been run yet.
+        '''
+        self.queueOrigins = deque((0, position) for position in positions)
+
+
+def incrementalMatch(studentDict, courseDict, show_steps=False, maxCoursesDictionary={}):
+    '''
+    Runs the match as fastMatch does, but returns the MatchState (with its
+    history), which can then be changed with changeCapacity, addStudent,
+    removeStudent and forceMatch.  Use getRosters() and getRejections() for
+    the match.
+    '''
+    problem = MatchProblem(studentDict, courseDict, maxCoursesDictionary)
+    state = MatchState(problem, maxCoursesDictionary, keepHistory=True)
+    state.run(show_steps=show_steps)
+    return state
+
+
+def fastMatch(studentDict, courseDict, show_steps=False, maxCoursesDictionary={}, counters=None):
+    '''
+    Same inputs and outputs as match.match(): returns rosters (Course objects
+    to lists of emails) and the list of universally rejected emails.
+    '''
+    problem = MatchProblem(studentDict, courseDict, maxCoursesDictionary)
+    state = MatchState(problem, maxCoursesDictionary)
+    state.run(show_steps=show_steps)
+    if counters is not None:
+        state.addCounters(counters)
+    return state.getRosters(), state.getRejections()
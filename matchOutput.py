@@ -0,0 +1,127 @@
+'''
+Writers for the results of the match: the rosters, the rows the registrar
+imports (username, ID, course.M) and the students who didn't match.
+
+Each writer streams its lines (or rows) to an open file, so nothing bigger
+than a line is ever built, and with the big buffer openOutputFile gives,
+the whole match goes out in a few large writes.  The registrar rows and
+rejections can be saved (see saveRegistrarMatch) in one of three formats,
+picked by the file name's suffix:
+    .csv - Email, ID and Course columns, with an empty Course for each
+           slot a student didn't get
+    .jsonl - one {"email", "id", "course"} object per line, with a null
+             course for each slot a student didn't get
+    anything else - the fixed-width text printed by match.py --registrar
+'''
+import csv
+import json
+import os
+
+CSV_SUFFIX = ".csv"
+JSON_LINES_SUFFIX = ".jsonl"
+BUFFER_SIZE = 1 << 20
+EMAIL_DOMAIN = "@carleton.edu"
+
+
+def openOutputFile(fileName):
+    return open(fileName, "w", newline="", buffering=BUFFER_SIZE)
+
+def getUsername(email):
+    return email.replace(EMAIL_DOMAIN, "")
+
+def getRegistrarRows(rosters, courseDictionary, studentDictionary):
+    '''
+    Yields (email, ID, course name) for every student matched to a course,
+    course by course, with each roster in order of email.
+    '''
+    for courseName, c in courseDictionary.items():
+        for email in sorted(rosters[c]):
+            yield email, studentDictionary[email].getID(), courseName
+
+def writeRosters(outputFile, rosters, rejections, courseDictionary, studentDictionary=None):
+    '''
+    Writes each course's roster, then the rejections and totals.  If
+    studentDictionary is given, each roster is followed by the name, class
+    year and wishlist of everyone on it.
+    '''
+    write = outputFile.write
+    write("\n")
+    numMatches = 0
+    for courseName, c in courseDictionary.items():
+        roster = rosters[c]
+        numMatches += len(roster)
+        write("%s %d/%d %s\n" % (courseName, len(roster), c.getCapacity(), getUsername(" ".join(sorted(roster)))))
+        if studentDictionary is not None:
+            write("%s %d/%d\n" % (courseName, len(roster), c.getCapacity()))
+            if not roster:
+                write("\n")
+            outputFile.writelines(getUsername("%s,%s,%s\n" % (studentDictionary[email].getName(),
+                                                               studentDictionary[email].getRegistrationClassYear(),
+                                                               studentDictionary[email].getWishList()))
+                                  for email in roster)
+
+    write(":( :(  %d    %s\n" % (len(rejections), getUsername(" ".join(sorted(rejections)))))
+    write(":) :)  %d   \n" % numMatches)
+    write("total students processed %d   \n" % (numMatches + len(rejections)))
+
+def writeRejectedStudents(outputFile, rejections, studentDictionary):
+    '''
+    Writes a line for each rejection describing the student and their
+    wishlist, in email order (the order students run out of options
+    depends on how wishlists were pruned).
+    '''
+    outputFile.writelines("%r %s\n" % (studentDictionary[email], studentDictionary[email].getWishList())
+                          for email in sorted(rejections))
+
+def writeRegistrarText(outputFile, rosters, rejections, courseDictionary, studentDictionary):
+    '''
+    Writes the new capacity of each course and of its .M section, then a
+    fixed-width line per match, course by course, then the students who
+    didn't match.
+    '''
+    write = outputFile.write
+    for courseName, c in courseDictionary.items():
+        write("New capacity for %s:    %d\n" % (courseName, c.getCapacity() - len(rosters[c])))
+        write("New capacity for %s.M:  %d\n\n" % (courseName, len(rosters[c])))
+    for courseName, c in courseDictionary.items():
+        outputFile.writelines("%-25s%-18s%s.M\n" % (getUsername(email), studentDictionary[email].getID(), courseName)
+                              for email in sorted(rosters[c]))
+        write("\n")
+    write("DID NOT MATCH: %s\n" % ", ".join(sorted(rejections)))
+
+def writeRegistrarCsv(outputFile, rosters, rejections, courseDictionary, studentDictionary):
+    writer = csv.writer(outputFile)
+    writer.writerow(["Email", "ID", "Course"])
+    writer.writerows((email, idNumber, courseName + ".M")
+                     for email, idNumber, courseName in getRegistrarRows(rosters, courseDictionary,
+                                                                         studentDictionary))
+    writer.writerows((email, studentDictionary[email].getID(), "") for email in sorted(rejections))
+
+def writeRegistrarJsonLines(outputFile, rosters, rejections, courseDictionary, studentDictionary):
+    # Only the strings need encoding, so skip building a dictionary per line
+    encode = json.dumps
+    for courseName, c in courseDictionary.items():
+        encodedCourseName = encode(courseName + ".M")
+        outputFile.writelines('{"email": %s, "id": %s, "course": %s}\n'
+                              % (encode(email), encode(studentDictionary[email].getID()), encodedCourseName)
+                              for email in sorted(rosters[c]))
+    outputFile.writelines('{"email": %s, "id": %s, "course": null}\n'
+                          % (encode(email), encode(studentDictionary[email].getID()))
+                          for email in sorted(rejections))
+
+def saveRegistrarMatch(fileName, rosters, rejections, courseDictionary, studentDictionary):
+    '''
+    Writes the registrar rows and rejections to fileName, in the format
+    given by its suffix.  The file is replaced in one step, so whatever
+    picks it up never sees half of it.
+    '''
+    if fileName.endswith(CSV_SUFFIX):
+        writeRegistrarMatch = writeRegistrarCsv
+    elif fileName.endswith(JSON_LINES_SUFFIX):
+        writeRegistrarMatch = writeRegistrarJsonLines
+    else:
+        writeRegistrarMatch = writeRegistrarText
+    temporaryFileName = fileName + ".tmp"
+    with openOutputFile(temporaryFileName) as outputFile:
+        writeRegistrarMatch(outputFile, rosters, rejections, courseDictionary, studentDictionary)
+    os.replace(temporaryFileName, fileName)
@@ -0,0 +1,131 @@
+'''
+Loads the registrar and preference files using a pool of worker processes.
+
+The registrar file is split into byte ranges that end on line boundaries
+(registrar exports don't have line breaks inside fields), and each range is
+parsed, pruned to the columns we use, and regularized in a worker.  The
+preference file is parsed in another worker at the same time.  Everything
+that touches Students happens back in this process in file order, and the
+warnings a worker collects about lines it skips are reported here in their
+place among the rest, so the result (warnings included) is the same as
+loading serially.
+'''
+import csv
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import course
+import diagnostics
+import student
+
+# Aim for chunks of about this many bytes, so workers stay evenly loaded
+CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def findRegistrarChunks(registrarFileName, numChunks):
+    '''
+    Returns (fieldnames, chunks) where chunks is a list of (start, end) byte
+    offsets that together cover every line after the header, with every
+    chunk starting at the beginning of a line.
+    '''
+    with open(registrarFileName, "rb") as registrarFile:
+        header = registrarFile.readline()
+        fieldnames = next(csv.reader([header.decode("utf-8")]))
+        dataStart = registrarFile.tell()
+        fileSize = os.fstat(registrarFile.fileno()).st_size
+        chunkSize = max(1, (fileSize - dataStart) // max(1, numChunks))
+        chunks = []
+        start = dataStart
+        while start < fileSize:
+            end = start + chunkSize
+            if end >= fileSize:
+                end = fileSize
+            else:
+                registrarFile.seek(end)
+                registrarFile.readline() # move to the end of the line we landed in
+                end = registrarFile.tell()
+            chunks.append((start, end))
+            start = end
+    return fieldnames, chunks
+
+def parseRegistrarChunk(registrarFileName, fieldnames, start, end, emails=None, diagnosticsLevel=0):
+    '''
+    Parses the lines between byte offsets start and end of the registrar
+    file.  Returns (runs, diagnostics reported after the last run), where
+    runs is a list of runs of lines for the same student, each (email,
+    student information, courses, diagnostics reported before the run).
+    Student information is (ID, name, class year, class level, enrollment
+    status) and courses is a list of (regularized name, regularized name
+    without equivalents) for each course that wasn't dropped.  Runs of lines
+    with no email are returned as ("", lines as dictionaries, None,
+    diagnostics), with diagnostics collected at diagnosticsLevel.
+    '''
+    diagnostics.collectInWorker(diagnosticsLevel)
+    with open(registrarFileName, "rb") as registrarFile:
+        registrarFile.seek(start)
+        text = registrarFile.read(end - start).decode("utf-8")
+    runs = []
+    lines = csv.reader(io.StringIO(text, newline=""))
+    for email, rows in student.groupRegistrarLines(lines, fieldnames, emails):
+        if len(email) == 0:
+            runs.append((email, rows, None, diagnostics.takeMessages()))
+            continue
+        courses = [(course.regularize(courseName),
+                    course.regularize(courseName, substituteEquivalent=False))
+                   for _, _, _, _, _, courseName, statusCode in rows
+                   if statusCode is None or not student.isIgnoredStatusCode(statusCode)]
+        runs.append((email, rows[0][:5], courses, diagnostics.takeMessages()))
+    return runs, diagnostics.takeMessages()
+
+def mergeRegistrarRuns(chunk, studentDictionary, warningsLevel=1):
+    '''
+    Adds the runs returned by parseRegistrarChunk to studentDictionary, in
+    order, exactly as loadStudentsFromRegistrarData would have, reporting
+    the worker's diagnostics where they came up.
+    '''
+    runs, lastMessages = chunk
+    for email, information, courses, messages in runs:
+        diagnostics.addMessages(messages)
+        if len(email) == 0:
+            student.warnEmptyEmailLines(information)
+            continue
+        curStudent = studentDictionary.get(email)
+        if curStudent is None:
+            idNumber, name, classYear, classLevel, enrollmentStatus = information
+            curStudent = student.Student(idNumber, email, name, classYear,
+                                         classLevel, enrollmentStatus)
+            studentDictionary[email] = curStudent
+        for regCourseName, rawRegCourseName in courses:
+            curStudent.addRegularizedCourse(regCourseName, rawRegCourseName,
+                                            warningsLevel=warningsLevel)
+    diagnostics.addMessages(lastMessages)
+
+def loadStudentsInParallel(registrarFileName, preferenceFileName, courseDictionary,
+                           workers, warningsLevel=1, emails=None):
+    '''
+    Same result as loadStudentsFromRegistrarData followed (if
+    preferenceFileName isn't None) by addPreferenceDataToStudentDictionary,
+    using workers processes.  Returns (studentDictionary, number of students
+    in the preference file, or None if there's no preference file).
+    '''
+    fileSize = os.path.getsize(registrarFileName)
+    fieldnames, chunks = findRegistrarChunks(registrarFileName,
+                                             max(workers, fileSize // CHUNK_BYTES))
+    studentDictionary = {}
+    numStudents = None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        preferenceFuture = None
+        if preferenceFileName is not None:
+            preferenceFuture = pool.submit(student.readPreferenceData, preferenceFileName)
+        chunkFutures = [pool.submit(parseRegistrarChunk, registrarFileName, fieldnames,
+                                    start, end, emails, diagnostics.sink.level)
+                        for start, end in chunks]
+        for chunkFuture in chunkFutures:
+            mergeRegistrarRuns(chunkFuture.result(), studentDictionary, warningsLevel)
+        if preferenceFuture is not None:
+            preferenceFieldnames, preferenceLines = preferenceFuture.result()
+            numStudents = student.addPreferenceLinesToStudentDictionary(
+                preferenceFieldnames, preferenceLines, studentDictionary,
+                courseDictionary, warningsLevel=warningsLevel)
+    return studentDictionary, numStudents
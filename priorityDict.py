@@ -1,29 +1,86 @@
-import hashlib
-import random
-
-class PriorityDictionary:
-    '''
-    A PriorityDictionary P allows for the mapping of keys to priority values,
-    which are consistent from call to call.  That is,
-       P.getPriority(x) returns a priority for a hashable object x
-    where the same priority is returned if x's priority is re-queried.
-    
-    When debugging is on, priority is computed via md5.
-    When debugging is off, priority is assigned truly randomly.
-    '''
-    def __init__(self, debug=True, seed=None):
-        self.priorityDictionary = {}
-        if debug:
-            self.priorityCalculator = lambda x : hashlib.md5(x.encode('utf-8')).hexdigest()
-        else:
-            self.priorityCalculator = lambda _ : random.random()
-
-        if (seed):
-            random.seed(seed)
-        
-    def getPriority(self, s):
-        if s not in self.priorityDictionary:
-            self.priorityDictionary[s] = self.priorityCalculator(s)
-        return self.priorityDictionary[s]
-
-
+import csv
+import hashlib
+import random
+import sys
+from array import array
+
+# Tiebreakers are unsigned integers of this many bytes
+TIEBREAKER_BYTES = 8
+
+class PriorityDictionary:
+    '''
+    A PriorityDictionary P allows for the mapping of keys to priority values,
+    which are consistent from call to call.  That is,
+       P.getPriority(x) returns a priority for a string x
+    where the same priority is returned if x's priority is re-queried.
+    
+    When debugging is on, priority is computed via md5 (the first 8 bytes of
+    the digest, as an integer, so they sort as the hex digests would).
+    When debugging is off, priority is assigned truly randomly, from a
+    random number generator belonging to this PriorityDictionary.
+    '''
+    def __init__(self, debug=True, seed=None):
+        self.priorityDictionary = {}
+        self.debug = debug
+        self.random = random.Random(seed)
+        self.numLookups = 0 # for profiling
+
+    def calculatePriorities(self, keys):
+        '''
+        Returns an array of new priorities for keys, in order.  Random
+        priorities for all of the keys come from a single draw.
+        '''
+        if self.debug:
+            return array('Q', (int.from_bytes(hashlib.md5(x.encode('utf-8')).digest()[:TIEBREAKER_BYTES], 'big')
+                               for x in keys))
+        priorities = array('Q')
+        priorities.frombytes(self.random.randbytes(TIEBREAKER_BYTES * len(keys)))
+        if sys.byteorder == 'big':
+            priorities.byteswap() # same numbers from the same seed everywhere
+        return priorities
+        
+    def getPriority(self, s):
+        self.numLookups += 1
+        if s not in self.priorityDictionary:
+            self.assignPriorities([s])
+        return self.priorityDictionary[s]
+
+    def assignPriorities(self, keys):
+        '''
+        Fixes the priorities of all of the given keys, in the order given.
+        Keys that already have a priority keep it.
+        '''
+        newKeys = [s for s in dict.fromkeys(keys) if s not in self.priorityDictionary]
+        self.priorityDictionary.update(zip(newKeys, self.calculatePriorities(newKeys)))
+
+    def getPriorityArray(self, keys):
+        '''
+        Returns an array of the priorities of keys, in order (so indexed the
+        same way as keys), assigning priorities to any keys without them.
+        '''
+        self.assignPriorities(keys)
+        self.numLookups += len(keys)
+        return array('Q', (self.priorityDictionary[s] for s in keys))
+
+    def savePriorities(self, fileName):
+        '''
+        Writes every priority assigned so far to a CSV file, so that a rerun
+        can use the same lottery numbers (see loadPriorities).
+        '''
+        with open(fileName, 'w', newline='') as priorityFile:
+            writer = csv.writer(priorityFile)
+            writer.writerow(["Key", "Priority"])
+            for s, priority in self.priorityDictionary.items():
+                writer.writerow([s, priority])
+
+    def loadPriorities(self, fileName):
+        '''
+        Reads priorities written by savePriorities.  They replace any this
+        PriorityDictionary already has; keys not in the file get new
+        priorities as usual.
+        '''
+        with open(fileName, 'r', newline='') as priorityFile:
+            for line in csv.DictReader(priorityFile):
+                self.priorityDictionary[line["Key"]] = int(line["Priority"])
+
+
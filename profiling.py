@@ -0,0 +1,146 @@
+'''
+Profiles of a run of the match (see match.py --profile): wall time, CPU
+time and peak memory for each phase of the run, plus counts of what
+happened inside the match.
+
+Counters are never updated from inside the match's loop.  The engines
+already count proposals, and the rest are worked out from totals once the
+match is over.  Evictions are proposals that didn't end up on a roster.
+Wishlist entries skipped because of cannotTake come from the eligibility
+pruning done before the match.  Rank lookups are one per proposal, in either
+engine.  Priority evaluations and tiebreaker lookups are counted where they
+happen, which is once per student per course type; match() counts only the
+priority evaluations made during that match.
+When profiling is off, phases are empty context managers and no counters
+are kept, so a run costs the same as it did without this module.
+
+A profile is saved as JSON, or as a Prometheus textfile (for the node
+exporter's textfile collector) if the file name ends in .prom.
+'''
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+from collections import Counter
+
+try:
+    import resource
+except ImportError: # not on Windows
+    resource = None
+
+PROMETHEUS_SUFFIX = ".prom"
+PROMETHEUS_PREFIX = "match_"
+
+
+def getPeakMemoryBytes():
+    '''
+    Returns the most memory this process has ever used (its maximum resident
+    set size), in bytes, or None where that isn't available.
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Profile:
+    '''
+    Times and counters for one run.
+
+    phases - dictionary from phase name to a dictionary of wallSeconds,
+             cpuSeconds (both added up over every time the phase ran) and
+             peakMemoryBytes (the process's peak when the phase last ended),
+             in the order the phases first ran
+    counters - Counter of events (e.g. "proposals"), or None if this
+               profile is disabled, so it can be passed straight to match()
+    '''
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = {}
+        self.counters = Counter() if enabled else None
+        self.wallStart = time.perf_counter()
+        self.cpuStart = time.process_time()
+
+    def phase(self, name):
+        '''
+        Returns a context manager that records the time spent in it as the
+        phase called name.
+        '''
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.timePhase(name)
+
+    @contextlib.contextmanager
+    def timePhase(self, name):
+        wallStart = time.perf_counter()
+        cpuStart = time.process_time()
+        try:
+            yield
+        finally:
+            phase = self.phases.setdefault(name, {"wallSeconds" : 0.0, "cpuSeconds" : 0.0})
+            phase["wallSeconds"] += time.perf_counter() - wallStart
+            phase["cpuSeconds"] += time.process_time() - cpuStart
+            phase["peakMemoryBytes"] = getPeakMemoryBytes()
+
+    def count(self, **counts):
+        if self.enabled:
+            self.counters.update(counts)
+
+    def toDictionary(self):
+        return {"date" : datetime.datetime.now().isoformat(timespec="seconds"),
+                "python" : platform.python_version(),
+                "wallSeconds" : time.perf_counter() - self.wallStart,
+                "cpuSeconds" : time.process_time() - self.cpuStart,
+                "peakMemoryBytes" : getPeakMemoryBytes(),
+                "phases" : self.phases,
+                "counters" : dict(self.counters)}
+
+    def save(self, fileName):
+        '''
+        Writes the profile to fileName, as a Prometheus textfile if the name
+        ends in .prom and as JSON otherwise.  The file is replaced in one
+        step, so a collector never sees half of it.
+        '''
+        temporaryFileName = fileName + ".tmp"
+        with open(temporaryFileName, "w") as profileFile:
+            if fileName.endswith(PROMETHEUS_SUFFIX):
+                profileFile.write(self.toPrometheus())
+            else:
+                json.dump(self.toDictionary(), profileFile, indent=1)
+        os.replace(temporaryFileName, fileName)
+
+    def toPrometheus(self):
+        '''
+        Returns the profile in the Prometheus text exposition format.
+        '''
+        profile = self.toDictionary()
+        lines = []
+        def addMetric(name, help, samples):
+            lines.append("# HELP %s%s %s" % (PROMETHEUS_PREFIX, name, help))
+            lines.append("# TYPE %s%s gauge" % (PROMETHEUS_PREFIX, name))
+            for labels, value in samples:
+                if value is not None:
+                    lines.append("%s%s%s %s" % (PROMETHEUS_PREFIX, name, labels, repr(value)))
+
+        addMetric("wall_seconds", "Wall time of the whole run.", [("", profile["wallSeconds"])])
+        addMetric("cpu_seconds", "CPU time of the whole run.", [("", profile["cpuSeconds"])])
+        addMetric("peak_memory_bytes", "Maximum resident set size of the run.",
+                  [("", profile["peakMemoryBytes"])])
+        for measure, metricName, help in [
+                ("wallSeconds", "phase_wall_seconds", "Wall time spent in each phase."),
+                ("cpuSeconds", "phase_cpu_seconds", "CPU time spent in each phase."),
+                ("peakMemoryBytes", "phase_peak_memory_bytes",
+                 "Maximum resident set size at the end of each phase.")]:
+            addMetric(metricName, help, [('{phase="%s"}' % name, phase[measure])
+                                         for name, phase in profile["phases"].items()])
+        addMetric("engine_events", "Number of events of each kind in the match.",
+                  [('{event="%s"}' % name, count) for name, count in sorted(profile["counters"].items())])
+        return "\n".join(lines) + "\n"
+
+
+# For code that takes an optional profile
+DISABLED = Profile(enabled=False)
@@ -0,0 +1,279 @@
+'''
+A local SQLite store of registrar course histories, built up from one
+registrar export after another:
+    python registrarStore.py --store registrar.db --ingest data/registrarDataFall2022.csv
+    python registrarStore.py --store registrar.db --taken CS.201 --not_taken CS.202
+
+Every export has each student's whole history in it, so reading the latest
+one from scratch gets slower every year.  The store keeps one row per (ID,
+course, term), updated in place when a later export has it again and
+removed when a later export has the student but not the course, and one
+row per student with their details from the latest export that has them.
+An export that's already been ingested (same contents) is skipped.
+
+match.py --registrar_store loads students from the store instead of the
+registrar file, and only the students in the preference file (as with
+--participants_only), with one query.  Queries like "everyone who has taken
+CS.201 but not CS.202" go through the index on course names; course names
+are regularized (with equivalent courses substituted) the way
+Student.hasTaken sees them, and dropped courses don't count.
+'''
+import argparse
+import csv
+import itertools
+import sqlite3
+import time
+
+import course
+import diagnostics
+import snapshot
+import student
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS imports (
+    number INTEGER PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    content_hash TEXT NOT NULL UNIQUE,
+    num_rows INTEGER NOT NULL,
+    imported TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS students (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    name TEXT,
+    class_year TEXT,
+    class_level TEXT,
+    enrollment_status TEXT,
+    import_number INTEGER NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS students_by_email ON students (email);
+CREATE TABLE IF NOT EXISTS history (
+    id TEXT NOT NULL,
+    course TEXT NOT NULL,
+    term TEXT NOT NULL,
+    regularized_course TEXT NOT NULL,
+    status_code TEXT,
+    counts INTEGER NOT NULL,
+    import_number INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (id, course, term)
+);
+CREATE INDEX IF NOT EXISTS history_by_course ON history (regularized_course, counts);
+'''
+
+UPSERT_STUDENT = '''
+INSERT INTO students VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    email = excluded.email, name = excluded.name, class_year = excluded.class_year,
+    class_level = excluded.class_level, enrollment_status = excluded.enrollment_status,
+    import_number = excluded.import_number, position = excluded.position
+'''
+
+# A later export replaces what an earlier one said about a course, but within
+# one export the course counts if any of its lines does (as when the
+# registrar file is read directly), and keeps its first position
+UPSERT_HISTORY = '''
+INSERT INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id, course, term) DO UPDATE SET
+    regularized_course = excluded.regularized_course,
+    status_code = CASE WHEN history.import_number = excluded.import_number AND history.counts
+                       THEN history.status_code ELSE excluded.status_code END,
+    counts = CASE WHEN history.import_number = excluded.import_number
+                  THEN max(history.counts, excluded.counts) ELSE excluded.counts END,
+    position = CASE WHEN history.import_number = excluded.import_number
+                    THEN history.position ELSE excluded.position END,
+    import_number = excluded.import_number
+'''
+
+# Every export has each student's whole history, so a course a student's
+# latest export doesn't list (as when a registration is deleted) is gone
+DELETE_DROPPED_HISTORY = '''
+DELETE FROM history
+WHERE import_number != ? AND id IN (SELECT id FROM students WHERE import_number = ?)
+'''
+
+# Students come out in the order the latest export that has them lists them,
+# and their courses in the order the export lists those, as when the
+# registrar file is read directly
+SELECT_HISTORIES = '''
+SELECT students.email, students.id, students.name, students.class_year, students.class_level,
+       students.enrollment_status, history.course, history.counts
+FROM students %s
+LEFT JOIN history ON history.id = students.id
+ORDER BY students.import_number, students.position, history.import_number, history.position
+'''
+
+SELECT_TAKEN = "SELECT id FROM history WHERE regularized_course = ? AND counts"
+
+
+class RegistrarStore:
+    '''
+    A connection to the store in fileName, which is created if it doesn't
+    exist.
+    '''
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.connection = sqlite3.connect(fileName)
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def ingest(self, registrarFileName):
+        '''
+        Adds a registrar export to the store.  Returns the number of rows
+        read from it, or 0 if this export was already ingested.  Courses
+        that the export leaves out of a student's history are removed.
+        '''
+        contentHash = snapshot.hashFile(registrarFileName).hexdigest()
+        if self.connection.execute("SELECT 1 FROM imports WHERE content_hash = ?",
+                                   (contentHash,)).fetchone() is not None:
+            return 0
+
+        with open(registrarFileName, encoding="utf-8", newline="") as registrarFile, self.connection:
+            registrarReader = csv.reader(registrarFile)
+            fieldnames = next(registrarReader)
+            importNumber = self.connection.execute(
+                "INSERT INTO imports (file_name, content_hash, num_rows, imported) VALUES (?, ?, 0, ?)",
+                (registrarFileName, contentHash, time.strftime("%Y-%m-%dT%H:%M:%S"))).lastrowid
+            numRows = 0
+            for rows in batched(self.readExportRows(registrarReader, fieldnames, importNumber)):
+                studentRows, historyRows = zip(*rows)
+                self.connection.executemany(UPSERT_STUDENT, [row for row in studentRows if row is not None])
+                self.connection.executemany(UPSERT_HISTORY, historyRows)
+                numRows += len(rows)
+            self.connection.execute(DELETE_DROPPED_HISTORY, (importNumber, importNumber))
+            self.connection.execute("UPDATE imports SET num_rows = ? WHERE number = ?", (numRows, importNumber))
+        return numRows
+
+    def readExportRows(self, lines, fieldnames, importNumber):
+        '''
+        Yields a (students row or None, history row) pair for each registrar
+        line with an email; the students row is only given for the first
+        line with each ID.  Blank and short lines are skipped (see
+        student.getCompleteRows).
+        '''
+        CLASS_YEAR_HEADER = student.getClassYearHeaderBasedOnActualHeaders(fieldnames)
+        columns = [fieldnames.index(header) for header in
+                   [student.ID_HEADER, student.EMAIL_HEADER, student.NAME_HEADER, CLASS_YEAR_HEADER,
+                    student.CLASS_LEVEL_HEADER, student.ENROLLMENT_STATUS_HEADER, student.COURSE_NAME_HEADER]]
+        # Some versions of the registrar data don't have these; without a
+        # term, a course is only kept once per student
+        statusCodeColumn = fieldnames.index(student.STATUS_CODE_HEADER) \
+            if student.STATUS_CODE_HEADER in fieldnames else None
+        termColumn = fieldnames.index(student.TERM_HEADER) if student.TERM_HEADER in fieldnames else None
+        numColumns = 1 + max(columns + [column for column in [statusCodeColumn, termColumn] if column is not None])
+
+        seenIDs = set()
+        for position, line in enumerate(student.getCompleteRows(lines, numColumns)):
+            idNumber, email, name, classYear, classLevel, enrollmentStatus, courseName = [line[i] for i in columns]
+            if len(email) == 0:
+                diagnostics.report(diagnostics.EMPTY_EMAIL_LINE, None, None, dict(zip(fieldnames, line)))
+                continue
+            studentRow = None
+            if idNumber not in seenIDs:
+                seenIDs.add(idNumber)
+                studentRow = (idNumber, email, name, classYear, classLevel, enrollmentStatus,
+                              importNumber, position)
+            statusCode = line[statusCodeColumn] if statusCodeColumn is not None else None
+            counts = statusCode is None or not student.isIgnoredStatusCode(statusCode)
+            term = line[termColumn] if termColumn is not None else ""
+            yield studentRow, (idNumber, courseName, term, course.regularize(courseName), statusCode,
+                               counts, importNumber, position)
+
+    def loadStudents(self, emails=None, warningsLevel=1):
+        '''
+        Returns a dictionary mapping from email keys to Student values, like
+        student.loadStudentsFromRegistrarData.  If emails (a set) is given,
+        only those students are loaded.
+        '''
+        if emails is None:
+            query = SELECT_HISTORIES % ""
+        else:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (email TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM wanted")
+            self.connection.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", ((email,) for email in emails))
+            query = SELECT_HISTORIES % "JOIN wanted ON wanted.email = students.email"
+
+        studentDictionary = {}
+        for email, idNumber, name, classYear, classLevel, enrollmentStatus, courseName, counts \
+                in self.connection.execute(query):
+            s = studentDictionary.get(email)
+            if s is None:
+                s = student.Student(idNumber, email, name, classYear, classLevel, enrollmentStatus)
+                studentDictionary[email] = s
+            if courseName is not None and counts:
+                s.addCourse(courseName, warningsLevel=warningsLevel)
+        return studentDictionary
+
+    def findStudents(self, taken=[], notTaken=[]):
+        '''
+        Returns the emails of students who have taken every course in taken
+        and none of the courses in notTaken, in email order.  With nothing in
+        taken, that's everyone in the store who hasn't taken the courses in
+        notTaken.
+        '''
+        queries = [SELECT_TAKEN] * len(taken) if taken else ["SELECT id FROM students"]
+        query = " INTERSECT ".join(queries)
+        if notTaken:
+            query += " EXCEPT " + " EXCEPT ".join([SELECT_TAKEN] * len(notTaken))
+        parameters = [course.regularize(courseName) for courseName in list(taken) + list(notTaken)]
+        return [email for (email,) in self.connection.execute(
+            "SELECT email FROM students WHERE id IN (%s) ORDER BY email" % query, parameters)]
+
+    def getImports(self):
+        '''
+        Returns (file name, number of rows, when) for each export ingested,
+        oldest first.
+        '''
+        return self.connection.execute(
+            "SELECT file_name, num_rows, imported FROM imports ORDER BY number").fetchall()
+
+
+INSERT_BATCH_SIZE = 10000
+
+def batched(iterable, size=INSERT_BATCH_SIZE):
+    '''
+    Yields lists of up to size items from iterable.
+    '''
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build up and query a store of registrar course histories.')
+    parser.add_argument('--store', type=str, required=True,
+                        help='SQLite file to keep the course histories in (created if needed)')
+    parser.add_argument('--ingest', type=str, nargs='*', default=[],
+                        help='registrar exports to add to the store, oldest first')
+    parser.add_argument('--taken', type=str, nargs='*', default=[],
+                        help='print the emails of students who have taken all of these courses...')
+    parser.add_argument('--not_taken', type=str, nargs='*', default=[],
+                        help='...and none of these')
+    parser.add_argument('--warnings', type=int, default=0,
+                        help='display warning messages (see match.py)')
+    args = parser.parse_args()
+    diagnostics.configure(args.warnings)
+
+    store = RegistrarStore(args.store)
+    try:
+        for registrarFileName in args.ingest:
+            numRows = store.ingest(registrarFileName)
+            if numRows:
+                print("Ingested %d rows from %s" % (numRows, registrarFileName))
+            else:
+                print("Already ingested %s" % registrarFileName)
+        if args.taken or args.not_taken:
+            for email in store.findStudents(args.taken, args.not_taken):
+                print(email)
+    finally:
+        store.close()
+        diagnostics.flush()
+
+if __name__ == "__main__":
+    main()
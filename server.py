@@ -0,0 +1,347 @@
+'''
+Runs the match as a local server that loads the input files once, so that
+forced matches, course-count exceptions and tiebreaker settings can be
+tried one after another without reloading and rebuilding everything each
+time.  Start it with the loading options match.py takes, e.g.
+    python server.py --senior_class_year 2023 --upcoming_term fall --port 8050
+and then send it JSON over HTTP:
+    POST /match            run the match; the body can give "force" and
+                           "num_courses_exception" (lists, formatted as for
+                           match.py), "seed", "deterministic", "engine" and
+                           "warnings"
+    GET /roster/CS.251     the roster of a course in the last match
+    GET /student/EMAIL     what a student got in the last match, and why
+                           they didn't get each course they'd rather have
+    GET /status            what's loaded, and the settings of the last match
+
+Running a match changes the loaded data in place: forced matches change
+course capacities and take students out of the match, and exceptions take
+courses off wishlists.  Those parts are saved when the server starts (see
+LoadedState) and put back after every match, so nothing carries over from
+one request to the next.  Requests are handled one at a time, and the
+server only listens on localhost unless told otherwise.
+'''
+import argparse
+import json
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import unquote
+
+import course
+import diagnostics
+import eligibility
+import match
+import priorityDict
+import student
+
+DEFAULT_PORT = 8050
+MATCH_SETTINGS = ["force", "num_courses_exception", "seed", "deterministic", "engine", "warnings"]
+
+
+class RequestError(Exception):
+    '''
+    A request the server can't answer; status is the HTTP status to send.
+    '''
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LoadedState:
+    '''
+    The parts of the loaded courses and students that running a match
+    changes: each course's capacity, and whether each student is in the
+    match and what's on their wishlist.
+    '''
+    def __init__(self, courseDictionary, studentDictionary):
+        self.capacities = {courseName : c.getCapacity() for courseName, c in courseDictionary.items()}
+        self.students = {email : (s.submittedPreferences(), s.getWishList())
+                         for email, s in studentDictionary.items()}
+
+    def restore(self, courseDictionary, studentDictionary):
+        for courseName, capacity in self.capacities.items():
+            courseDictionary[courseName].capacity = capacity
+        for email, (hasPreferences, wishlist) in self.students.items():
+            s = studentDictionary[email]
+            if hasPreferences:
+                s.markEligibleForMatch()
+            else:
+                s.markIneligibleForMatch()
+            s.coursesDesiredDescendingPreferences = wishlist.copy()
+
+
+class MatchResult:
+    '''
+    One run of the match: the settings it was run with, the rosters (keys =
+    Course objects, values = lists of emails, including forced matches), the
+    rejections, the forced matches (emails to lists of course names) and
+    the warnings reported.
+    '''
+    def __init__(self, settings, rosters, rejections, forcedMatchDictionary, warnings):
+        self.settings = settings
+        self.rosters = rosters
+        self.rejections = rejections
+        self.forcedMatchDictionary = forcedMatchDictionary
+        self.warnings = warnings
+        self.matches = {}
+        for c, roster in rosters.items():
+            for email in roster:
+                self.matches.setdefault(email, []).append(c.getCourseName())
+
+
+class MatchServer:
+    '''
+    The loaded input files, and the last match run on them.
+    '''
+    def __init__(self, courseDictionary, studentDictionary, numStudents):
+        self.courseDictionary = courseDictionary
+        self.studentDictionary = studentDictionary
+        self.numStudents = numStudents
+        self.loadedState = LoadedState(courseDictionary, studentDictionary)
+        self.eligibilityMatrix = eligibility.EligibilityMatrix(courseDictionary)
+        # md5 tiebreakers don't depend on the order they're drawn in, so one
+        # can be kept (along with the priority ranks built on it) for every run
+        self.deterministicTiebreaker = priorityDict.PriorityDictionary(debug=True)
+        self.lastResult = None
+
+    def getTiebreaker(self, deterministic, seed):
+        if deterministic:
+            return self.deterministicTiebreaker
+        return priorityDict.PriorityDictionary(debug=False, seed=seed)
+
+    def runMatch(self, settings):
+        '''
+        Runs the match with the given settings (a dictionary with any of the
+        keys in MATCH_SETTINGS), as match.py would with the same options,
+        keeps the result for later requests and returns a summary of it.
+        '''
+        unknownSettings = set(settings) - set(MATCH_SETTINGS)
+        if unknownSettings:
+            raise RequestError(400, "Unknown settings: " + ", ".join(sorted(unknownSettings)))
+        forcedMatches = self.checkPairs(settings.get("force", []), "force")
+        numCoursesExceptions = self.checkPairs(settings.get("num_courses_exception", []),
+                                               "num_courses_exception")
+        try:
+            maxCoursesDictionary = match.parseMaxCoursesExceptionString(numCoursesExceptions)
+        except ValueError:
+            raise RequestError(400, "num_courses_exception must be formatted 'email:num matches'")
+        engine = settings.get("engine", "classic")
+        if engine not in ["classic", "fast"]:
+            raise RequestError(400, "Unknown match engine: " + str(engine))
+        # JSON true and false would pass for 1 and 0 as ints, so bools are checked by type
+        seed = settings.get("seed")
+        if seed is not None and type(seed) is not int:
+            raise RequestError(400, "seed must be an integer")
+        deterministic = settings.get("deterministic", False)
+        if type(deterministic) is not bool:
+            raise RequestError(400, "deterministic must be true or false")
+        warningsLevel = settings.get("warnings", 0)
+        if type(warningsLevel) is not int or warningsLevel not in [0, 1]:
+            raise RequestError(400, "warnings must be 0 or 1")
+
+        startTime = time.perf_counter()
+        tiebreaker = self.getTiebreaker(deterministic, seed)
+        for c in self.courseDictionary.values():
+            c.tiebreaker = tiebreaker
+        defaultSink = diagnostics.sink
+        diagnostics.sink = diagnostics.DiagnosticsSink(warningsLevel, flushSize=None)
+        try:
+            match.prepareForForcedMatches(forcedMatches, self.courseDictionary, self.studentDictionary)
+            forcedMatchDictionary = match.parseForcedMatchExceptionString(forcedMatches)
+            match.applyNumberOfCoursesExceptionWithForcedCourses(forcedMatchDictionary, maxCoursesDictionary,
+                                                                 self.studentDictionary)
+            rosters, rejections = match.match(self.studentDictionary, self.courseDictionary,
+                                              maxCoursesDictionary=maxCoursesDictionary, engine=engine)
+            match.applyForcedMatches(forcedMatches, self.courseDictionary, self.studentDictionary, rosters)
+            warnings = [message for code, email, courseName, message in diagnostics.takeMessages()]
+        finally:
+            diagnostics.sink = defaultSink
+            self.loadedState.restore(self.courseDictionary, self.studentDictionary)
+
+        self.lastResult = MatchResult(settings, rosters, rejections, forcedMatchDictionary,
+                                      list(dict.fromkeys(warnings)))
+        return {"seconds" : time.perf_counter() - startTime,
+                "matches" : sum(len(roster) for roster in rosters.values()),
+                "courses" : {c.getCourseName() : [len(roster), c.getCapacity()] for c, roster in rosters.items()},
+                "rejections" : rejections,
+                "warnings" : self.lastResult.warnings}
+
+    def checkPairs(self, pairs, settingName):
+        '''
+        Returns pairs, a list of 'email:value' strings, after checking that
+        every email is a student who submitted preferences and (for forced
+        matches) every course is in the match.
+        '''
+        if not isinstance(pairs, list) or not all(isinstance(pair, str) and ":" in pair for pair in pairs):
+            raise RequestError(400, settingName + " must be a list of 'email:value' strings")
+        for pair in pairs:
+            email, value = pair.split(":")[:2]
+            if email not in self.studentDictionary:
+                raise RequestError(400, "Unknown student in " + settingName + ": " + email)
+            if not self.studentDictionary[email].submittedPreferences():
+                raise RequestError(400, "Student in " + settingName + " isn't in the match: " + email)
+            if settingName == "force" and course.regularize(value) not in self.courseDictionary:
+                raise RequestError(400, "Unknown course in " + settingName + ": " + value)
+        return pairs
+
+    def getLastResult(self):
+        if self.lastResult is None:
+            raise RequestError(409, "No match has been run yet")
+        return self.lastResult
+
+    def getRoster(self, courseName):
+        result = self.getLastResult()
+        c = self.courseDictionary.get(course.regularize(courseName))
+        if c is None:
+            raise RequestError(404, "Unknown course: " + courseName)
+        return {"course" : c.getCourseName(),
+                "capacity" : c.getCapacity(),
+                "students" : sorted(result.rosters[c]),
+                "forced" : sorted(email for email in result.rosters[c]
+                                  if c.getCourseName() in result.forcedMatchDictionary.get(email, []))}
+
+    def explainStudent(self, email):
+        '''
+        Returns what the student got in the last match and, for each course
+        on their wishlist that they'd rather have (every course, if they
+        have an empty slot), why they didn't get it.
+        '''
+        result = self.getLastResult()
+        s = self.studentDictionary.get(email)
+        if s is None:
+            raise RequestError(404, "Unknown student: " + email)
+        forced = result.forcedMatchDictionary.get(email, [])
+        matched = result.matches.get(email, [])
+        wishlist = s.getWishList()
+        positions = [wishlist.index(courseName) for courseName in matched
+                     if courseName in wishlist and courseName not in forced]
+        numEmptySlots = result.rejections.count(email)
+        end = len(wishlist) if numEmptySlots or not positions else max(positions)
+
+        reasons = {}
+        for courseName in wishlist[:end]:
+            if courseName in matched:
+                continue
+            c = self.courseDictionary[courseName]
+            if not self.eligibilityMatrix.canTake(s, courseName):
+                reasons[courseName] = "can't take it: " + self.eligibilityMatrix.describe(s, courseName)
+                continue
+            roster = result.rosters[c]
+            ranks = [c.rank(self.studentDictionary[other]) for other in roster
+                     if courseName not in result.forcedMatchDictionary.get(other, [])]
+            if len(roster) < c.getCapacity():
+                reasons[courseName] = "has a free seat"
+            elif not ranks:
+                reasons[courseName] = "every seat was forced"
+            elif c.rank(s) < min(ranks):
+                reasons[courseName] = "full of students with higher priority"
+            else:
+                reasons[courseName] = "full, but holds a student with lower priority"
+        return {"email" : email,
+                "submittedPreferences" : self.loadedState.students[email][0],
+                "wishlist" : wishlist,
+                "matches" : matched,
+                "forced" : forced,
+                "emptySlots" : numEmptySlots,
+                "notMatched" : reasons}
+
+    def getStatus(self):
+        return {"students" : len(self.studentDictionary),
+                "participants" : sum(hasPreferences for hasPreferences, _ in self.loadedState.students.values()),
+                "studentsInPreferenceFile" : self.numStudents,
+                "courses" : len(self.courseDictionary),
+                "lastMatch" : None if self.lastResult is None else self.lastResult.settings}
+
+
+class MatchRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Answers the requests described at the top of this file; the MatchServer
+    is the HTTP server's matchServer.
+    '''
+    def do_GET(self):
+        matchServer = self.server.matchServer
+        path = unquote(self.path).strip("/").split("/")
+        if path == ["status"]:
+            self.respond(matchServer.getStatus)
+        elif len(path) == 2 and path[0] == "roster":
+            self.respond(matchServer.getRoster, path[1])
+        elif len(path) == 2 and path[0] == "student":
+            self.respond(matchServer.explainStudent, path[1])
+        else:
+            self.sendJson(404, {"error" : "Unknown request: " + self.path})
+
+    def do_POST(self):
+        if unquote(self.path).strip("/") != "match":
+            self.sendJson(404, {"error" : "Unknown request: " + self.path})
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            settings = json.loads(body) if body.strip() else {}
+        except ValueError:
+            self.sendJson(400, {"error" : "The body must be a JSON object of settings"})
+            return
+        if not isinstance(settings, dict):
+            self.sendJson(400, {"error" : "The body must be a JSON object of settings"})
+            return
+        self.respond(self.server.matchServer.runMatch, settings)
+
+    def respond(self, method, *args):
+        try:
+            self.sendJson(200, method(*args))
+        except RequestError as error:
+            self.sendJson(error.status, {"error" : str(error)})
+        except Exception as error:
+            # Anything else is a bug, but the client still gets an answer
+            traceback.print_exc()
+            self.sendJson(500, {"error" : "Internal error: " + repr(error)})
+
+    def sendJson(self, status, contents):
+        body = json.dumps(contents).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run The Match as a local server (see server.py).')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='port to listen on')
+    parser.add_argument('--host', type=str, default="127.0.0.1",
+                        help='address to listen on; only this machine can connect by default')
+    match.addInputArguments(parser)
+    parser.add_argument('--warnings', type=int, default=0,
+                        help='display warning messages about loading the input files (see match.py)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to use for loading the input files')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every request')
+    args = parser.parse_args()
+    diagnostics.configure(args.warnings)
+
+    student.Student.setGeneralCalendarInfo(
+        student.getNumericYearFromText(args.senior_class_year),
+        args.upcoming_term)
+    courseDictionary, studentDictionary, numStudents = match.loadMatchInputs(
+        args, priorityDict.PriorityDictionary(debug=True), warningsLevel=args.warnings, workers=args.workers)
+    diagnostics.flush()
+
+    httpServer = HTTPServer((args.host, args.port), MatchRequestHandler)
+    httpServer.matchServer = MatchServer(courseDictionary, studentDictionary, numStudents)
+    httpServer.verbose = args.verbose
+    print("Serving the match on http://%s:%d" % (args.host, args.port))
+    try:
+        httpServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpServer.server_close()
+
+if __name__ == "__main__":
+    main()
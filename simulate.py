@@ -0,0 +1,191 @@
+'''
+Monte Carlo estimates of how likely each student is to get each course:
+runs the match many times with independent random tiebreakers and counts
+the outcomes.
+
+Everything about a course's priority except the tiebreaker is fixed, so
+each course type ranks the students once (see
+Course.priorityBeforeTiebreaker), and a draw only needs a fresh tiebreaker
+per student: priority = (rank << TIEBREAKER_BITS) | tiebreaker.  Each draw
+gets its own random PriorityDictionary, seeded from the simulation seed and
+the draw number, so the results don't depend on how draws are split among
+worker processes.
+'''
+import copy
+import csv
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import matchEngine
+import priorityDict
+
+TIEBREAKER_BITS = 8 * priorityDict.TIEBREAKER_BYTES
+
+# Set up by simulate before any workers are forked, so they inherit it
+sharedLottery = None
+
+
+class Lottery:
+    '''
+    The parts of the match that are the same in every draw.
+    '''
+    def __init__(self, studentDictionary, courseDictionary, maxCoursesDictionary={},
+                 forcedMatches={}):
+        '''
+        forcedMatches - dictionary from emails to lists of course names the
+                        student is forced into (already taken out of the
+                        match as match.prepareForForcedMatches does)
+        '''
+        self.problem = matchEngine.MatchProblem(studentDictionary, courseDictionary,
+                                                maxCoursesDictionary)
+        self.maxCoursesDictionary = maxCoursesDictionary
+        self.forcedMatches = forcedMatches
+        problem = self.problem
+
+        # Rank the students in the match for each type of course, ignoring tiebreakers
+        baseRanks = {}
+        for c in problem.courses:
+            if type(c) not in baseRanks:
+                keys = [c.priorityBeforeTiebreaker(s) for s in problem.students]
+                rankOfKey = {key : rank for rank, key in enumerate(sorted(set(keys)))}
+                baseRanks[type(c)] = [rankOfKey[key] << TIEBREAKER_BITS for key in keys]
+        self.basePriorities = [[baseRanks[type(problem.courses[c])][s] for c in problem.preferences[s]]
+                               for s in range(len(problem.emails))]
+
+    def runDraw(self, seed, draw):
+        '''
+        Runs the match with the tiebreakers for the given draw, returning the
+        finished MatchState.
+        '''
+        tiebreakers = getDrawTiebreaker(seed, draw).calculatePriorities(self.problem.emails)
+        drawProblem = copy.copy(self.problem)
+        drawProblem.priorities = [[base | tiebreaker for base in basePriorities]
+                                  for basePriorities, tiebreaker in zip(self.basePriorities, tiebreakers)]
+        state = matchEngine.MatchState(drawProblem, self.maxCoursesDictionary)
+        state.run()
+        return state
+
+
+def getDrawTiebreaker(seed, draw):
+    '''
+    Returns the random PriorityDictionary used for the given draw.
+    '''
+    return priorityDict.PriorityDictionary(debug=False, seed="%d:%d" % (seed, draw))
+
+
+class SimulationResults:
+    '''
+    Counts of outcomes over some number of draws.
+
+    matches[(s, c)] - number of draws in which student s got course c
+    unmatched[s] - number of draws in which student s was left with an
+                   unfilled slot
+    filled[c] - Counter of how many students course c got in each draw
+    turnedAway[c] - Counter of how many proposals course c rejected in each draw
+    rejections - Counter of the number of rejected students in each draw
+    '''
+    def __init__(self, numCourses):
+        self.numDraws = 0
+        self.matches = Counter()
+        self.unmatched = Counter()
+        self.filled = [Counter() for _ in range(numCourses)]
+        self.turnedAway = [Counter() for _ in range(numCourses)]
+        self.rejections = Counter()
+
+    def addDraw(self, state: matchEngine.MatchState):
+        problem = state.problem
+        self.numDraws += 1
+        proposals = [0] * len(problem.courses)
+        for s, cursor in enumerate(state.cursors):
+            for c in problem.preferences[s][:cursor]:
+                proposals[c] += 1
+        for c, roster in enumerate(state.rosters):
+            for _, s, _ in roster:
+                self.matches[(s, c)] += 1
+            self.filled[c][len(roster)] += 1
+            self.turnedAway[c][proposals[c] - len(roster)] += 1
+        rejected = set(state.rejections)
+        self.unmatched.update(rejected)
+        self.rejections[len(rejected)] += 1
+
+    def merge(self, other):
+        self.numDraws += other.numDraws
+        self.matches.update(other.matches)
+        self.unmatched.update(other.unmatched)
+        for c in range(len(self.filled)):
+            self.filled[c].update(other.filled[c])
+            self.turnedAway[c].update(other.turnedAway[c])
+        self.rejections.update(other.rejections)
+
+
+def runDraws(seed, draws):
+    '''
+    Runs the given draws of the shared Lottery and returns their
+    SimulationResults.
+    '''
+    results = SimulationResults(len(sharedLottery.problem.courses))
+    for draw in draws:
+        results.addDraw(sharedLottery.runDraw(seed, draw))
+    return results
+
+def simulate(lottery: Lottery, numDraws, seed, workers=1):
+    '''
+    Runs numDraws draws of the lottery using workers processes and returns
+    the combined SimulationResults.
+    '''
+    global sharedLottery
+    sharedLottery = lottery
+    # Workers need to inherit the lottery rather than have it pickled
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return runDraws(seed, range(numDraws))
+
+    results = SimulationResults(len(lottery.problem.courses))
+    chunks = [range(start, numDraws, workers) for start in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("fork")) as pool:
+        for chunkResults in pool.map(runDraws, [seed] * len(chunks), chunks):
+            results.merge(chunkResults)
+    return results
+
+def writeProbabilities(lottery: Lottery, results: SimulationResults, fileName):
+    '''
+    Writes a row per student with the fraction of draws in which they got
+    each course, and in which they were left unmatched.  Forced matches
+    count as always happening.
+    '''
+    problem = lottery.problem
+    courseNames = [c.getCourseName() for c in problem.courses]
+    with open(fileName, 'w', newline="") as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(["Email"] + courseNames + ["Unmatched"])
+        for s, email in enumerate(problem.emails):
+            forced = lottery.forcedMatches.get(email, [])
+            writer.writerow([email]
+                            + [1.0 if courseNames[c] in forced else results.matches[(s, c)] / results.numDraws
+                               for c in range(len(courseNames))]
+                            + [results.unmatched[s] / results.numDraws])
+        for email, forced in lottery.forcedMatches.items():
+            if email not in problem.studentIndex:
+                writer.writerow([email] + [1.0 if courseName in forced else 0.0 for courseName in courseNames]
+                                + [0.0])
+
+def writeDistributions(lottery: Lottery, results: SimulationResults, fileName):
+    '''
+    Writes how often each course ended up with each number of students
+    (including forced matches) and turned away each number of proposals,
+    and how often each number of students was rejected from the match.
+    '''
+    problem = lottery.problem
+    numForced = Counter(courseName for forced in lottery.forcedMatches.values() for courseName in forced)
+    with open(fileName, 'w', newline="") as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(["Course", "Measure", "Value", "Draws"])
+        for c, courseObject in enumerate(problem.courses):
+            courseName = courseObject.getCourseName()
+            for filled, count in sorted(results.filled[c].items()):
+                writer.writerow([courseName, "filled", filled + numForced[courseName], count])
+            for turnedAway, count in sorted(results.turnedAway[c].items()):
+                writer.writerow([courseName, "turned away", turnedAway, count])
+        for rejections, count in sorted(results.rejections.items()):
+            writer.writerow(["", "rejected students", rejections, count])
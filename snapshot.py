@@ -0,0 +1,139 @@
+'''
+A cache of loaded course and student dictionaries, so that reruns of the
+match against the same input files don't have to parse and regularize them
+again.
+
+Snapshots are pickled to a file named by a hash of everything loading
+depends on: the contents of the input files, the settings that change how
+they're read (senior class year, upcoming term, which students are loaded),
+and the source of the modules that do the loading.  Changing any of those
+gives a different key, so a stale snapshot is never used; it's just left
+behind until the cache is cleared.
+'''
+import hashlib
+import os
+import pickle
+import tempfile
+
+import course
+import student
+
+DEFAULT_CACHE_DIRECTORY = ".match_cache"
+SNAPSHOT_SUFFIX = ".snapshot"
+# Bump if the layout of what's stored changes in a way the module hashes
+# below wouldn't notice
+SNAPSHOT_FORMAT_VERSION = 1
+# Modules whose code decides what a loaded Course or Student looks like
+LOADER_MODULES = [course, student]
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hashFile(fileName, digest=None):
+    '''
+    Adds the contents of fileName to digest (a new sha256 if not given) and
+    returns it.
+    '''
+    if digest is None:
+        digest = hashlib.sha256()
+    with open(fileName, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest
+
+def getSnapshotKey(fileNames, settings):
+    '''
+    Returns the hex digest identifying a snapshot of data loaded from
+    fileNames (in order) with the given settings (a list of values with
+    stable reprs).
+    '''
+    digest = hashlib.sha256(("snapshot format %d\n" % SNAPSHOT_FORMAT_VERSION).encode("utf-8"))
+    for module in LOADER_MODULES:
+        hashFile(module.__file__, digest)
+    for fileName in fileNames:
+        # Hash each file separately so bytes can't shift from one to the next
+        digest.update(hashFile(fileName).digest())
+    digest.update(repr(settings).encode("utf-8"))
+    return digest.hexdigest()
+
+def getSnapshotFileName(cacheDirectory, key):
+    return os.path.join(cacheDirectory, key + SNAPSHOT_SUFFIX)
+
+def saveSnapshot(cacheDirectory, key, courseDictionary, studentDictionary, numStudents):
+    '''
+    Stores courseDictionary, studentDictionary and numStudents under key.
+    Tiebreakers and priority ranks aren't stored, since they belong to a run
+    rather than to the input files.
+    '''
+    os.makedirs(cacheDirectory, exist_ok=True)
+    detached = {}
+    for courseName, c in courseDictionary.items():
+        detached[courseName] = (c.tiebreaker, c.priorityRanks)
+        c.tiebreaker = None
+        c.priorityRanks = None
+    try:
+        contents = {"courseNames" : list(course.COURSE_IDS.names),
+                    "courses" : courseDictionary,
+                    "students" : studentDictionary,
+                    "numStudents" : numStudents}
+        # Write to a temporary file first so a reader never sees half a snapshot
+        fd, tempFileName = tempfile.mkstemp(dir=cacheDirectory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(contents, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tempFileName, getSnapshotFileName(cacheDirectory, key))
+        except BaseException:
+            os.remove(tempFileName)
+            raise
+    finally:
+        for courseName, (tiebreaker, priorityRanks) in detached.items():
+            courseDictionary[courseName].tiebreaker = tiebreaker
+            courseDictionary[courseName].priorityRanks = priorityRanks
+
+def adoptCourseIds(courseNames):
+    '''
+    Makes course.COURSE_IDS give the same bits to courseNames (in order) as
+    the table a snapshot was saved with, so the students' course history
+    masks mean the same thing.  Returns False if that's impossible because
+    this process has already given some of those bits to other courses.
+    '''
+    table = course.COURSE_IDS
+    numShared = min(len(courseNames), len(table.names))
+    if table.names[:numShared] != courseNames[:numShared]:
+        return False
+    for courseName in courseNames[numShared:]:
+        table.getMask(courseName)
+    return True
+
+def loadSnapshot(cacheDirectory, key, tiebreaker):
+    '''
+    Returns (courseDictionary, studentDictionary, numStudents) from the
+    snapshot stored under key, with every course using tiebreaker, or None if
+    there's no usable snapshot.
+    '''
+    try:
+        with open(getSnapshotFileName(cacheDirectory, key), "rb") as f:
+            contents = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None # Unreadable; it'll be overwritten by a fresh one
+    if not adoptCourseIds(contents["courseNames"]):
+        return None
+    courseDictionary = contents["courses"]
+    for c in courseDictionary.values():
+        c.tiebreaker = tiebreaker
+    return courseDictionary, contents["students"], contents["numStudents"]
+
+def clearSnapshots(cacheDirectory):
+    '''
+    Deletes every snapshot in cacheDirectory.  Returns how many were deleted.
+    '''
+    if not os.path.isdir(cacheDirectory):
+        return 0
+    numDeleted = 0
+    for fileName in os.listdir(cacheDirectory):
+        if fileName.endswith(SNAPSHOT_SUFFIX):
+            os.remove(os.path.join(cacheDirectory, fileName))
+            numDeleted += 1
+    return numDeleted
@@ -1,7 +1,10 @@
-import warnings
 import csv
 import course
+import diagnostics
+import eligibility
 import re
+import itertools
+import operator
 from enum import IntEnum
 from typing import Optional
 
@@ -15,6 +18,7 @@ CLASS_LEVEL_HEADER = "Class Level"
 ENROLLMENT_STATUS_HEADER = "Enrollment Status Confidential"
 COURSE_NAME_HEADER = "Course Name"
 STATUS_CODE_HEADER = "Current Status Code"
+TERM_HEADER = "Term"
 
 IGNORE_CODES = ["W","D","X"] # Registar code for dropped courses (w/ or w/o transcript annotation or withdrawal)
 
@@ -41,6 +45,14 @@ class ClassYear(IntEnum):
         return self.name
 
 class Student:
+    # Registrar exports can have hundreds of thousands of students, so skip the
+    # per-instance __dict__ and keep course histories as bitmasks over
+    # course.COURSE_IDS rather than as sets of strings.
+    __slots__ = ["idNumber", "emailAddress", "name", "classYear", "classLevel",
+                 "enrollmentStatus", "registrationYear", "focus", "historyVersion",
+                 "coursesTakenMask", "rawCoursesTakenMask", "numCoreCoursesTaken",
+                 "numElectivesTaken", "coursesDesiredDescendingPreferences",
+                 "hasPreferences", "historyViews"]
 
     @classmethod
     def setGeneralCalendarInfo(cls, seniorClassYear: int,
@@ -64,21 +76,35 @@ class Student:
         self.registrationYear = self.getRegistrationClassYearFromLevelAndStatus()
 
         self.focus = False
-        self.coursesTaken = set()
-        self.rawCoursesTaken = set()
+        self.historyVersion = 0 # bumped whenever coursesTaken changes
+        self.coursesTakenMask = 0
+        self.rawCoursesTakenMask = 0
+        self.numCoreCoursesTaken = 0
+        self.numElectivesTaken = 0
         self.coursesDesiredDescendingPreferences = []
         self.hasPreferences = False
+        self.historyViews = None # CourseHistoryViews, built when first needed
         
     def addCourse(self, courseName, warningsLevel=1):
-        
-        regCourseName = course.regularize(courseName)
-        if regCourseName in self.coursesTaken and warningsLevel == 1:
-            warnings.warn(regCourseName + " appears twice for " + self.emailAddress)
+        self.addRegularizedCourse(course.regularize(courseName),
+                                  course.regularize(courseName, substituteEquivalent=False),
+                                  warningsLevel=warningsLevel)
+
+    def addRegularizedCourse(self, regCourseName, rawRegCourseName, warningsLevel=1):
+        '''
+        Same as addCourse, for a course name that's already been regularized
+        both with (regCourseName) and without (rawRegCourseName) substituting
+        equivalent courses.
+        '''
+        courseMask = course.COURSE_IDS.getMask(regCourseName)
+        if self.coursesTakenMask & courseMask and warningsLevel == 1:
+            diagnostics.report(diagnostics.DUPLICATE_COURSE, self.emailAddress, regCourseName)
             
-        self.coursesTaken.add(regCourseName)
-        self.rawCoursesTaken.add(course.regularize(courseName, substituteEquivalent=False))
+        self.rawCoursesTakenMask |= course.COURSE_IDS.getMask(rawRegCourseName)
+        self.setCoursesTakenMask(self.coursesTakenMask | courseMask)
             
-    def addPreferenceInformation(self, line, courseNameToHeader, courseDictionary):
+    def addPreferenceInformation(self, line, courseNameToHeader, courseDictionary,
+                                 eligibilityMatrix=None):
         '''
         Adds preferences information from the Google Form to this Student. All
         courses that the student ranked will be added to their preferences. A
@@ -91,28 +117,43 @@ class Student:
         courseNameToHeader - dictionary mapping from course names to the key
             in the line dictionary representing the preference for that course
         courseDictionary - dictionary mapping from course names to Course objects
+        eligibilityMatrix - EligibilityMatrix over courseDictionary, to share
+            between students (one is made if not given)
         '''
         preferences = readCoursePreferencesWithNone(line, courseNameToHeader)#readCoursePreferences(line, courseNameToHeader)
+        self.addPreferences(preferences, courseDictionary, eligibilityMatrix)
+
+    def addPreferences(self, preferences, courseDictionary, eligibilityMatrix=None):
+        '''
+        Same as addPreferenceInformation, for the list of course names the
+        student ranked, most preferred first, already read from their line
+        of the form (see PreferenceFormPlan.readCoursePreferences).
+        '''
+        if eligibilityMatrix is None:
+            eligibilityMatrix = eligibility.EligibilityMatrix(courseDictionary)
         self.hasPreferences = True
         self.coursesDesiredDescendingPreferences = []
 
         coursesSkipped = False
-        firstCannotTakeErrorMessage = None
+        firstCannotTakeCourse = None
         for courseName in preferences:
-            if not courseDictionary[courseName].cannotTake(self) and coursesSkipped:
-                warnings.warn(self.emailAddress + " has some ineligible courses " + \
-                        "with higher priority than eligible courses " + \
-                        "(adding anyway); wishlist: " + str(preferences))
-                warnings.warn(self.emailAddress + " error message " + str(firstCannotTakeErrorMessage))
-            elif courseDictionary[courseName].cannotTake(self):
+            canTake = eligibilityMatrix.canTake(self, courseName)
+            if canTake and coursesSkipped:
+                diagnostics.report(diagnostics.INELIGIBLE_ABOVE_ELIGIBLE, self.emailAddress, None,
+                                   preferences)
+                if diagnostics.enabled():
+                    diagnostics.report(diagnostics.INELIGIBLE_ABOVE_ELIGIBLE_REASON, self.emailAddress,
+                                       firstCannotTakeCourse,
+                                       str(eligibilityMatrix.describe(self, firstCannotTakeCourse)))
+            elif not canTake:
                 # Course they've already taken or are missing prereq for - if we only have those at the end, okay
                 coursesSkipped = True
-                firstCannotTakeErrorMessage = courseName + " "  + courseDictionary[courseName].cannotTake(self)
+                firstCannotTakeCourse = courseName
             self.coursesDesiredDescendingPreferences.append(courseName)
             
         # do they have no (remaining) preferences?
         if len(self.coursesDesiredDescendingPreferences) == 0:
-            warnings.warn(self.emailAddress + " has no preferences.")
+            diagnostics.report(diagnostics.NO_PREFERENCES, self.emailAddress)
     
     def addSelfReportedCoursesTaken(self, reportedCoursesTaken, warningsLevel=1):
         '''
@@ -122,25 +163,35 @@ class Student:
         '''
         reportedCoursesTaken = set([course.regularize(courseName) 
                                 for courseName in reportedCoursesTaken])
-        registrarCoreTaken = set([courseName 
-                                  for courseName in self.coursesTaken 
-                                  if course.isCore(courseName)])
+        registrarCoreTaken = set(course.COURSE_IDS.getCourseNames(
+            self.coursesTakenMask & course.COURSE_IDS.coreMask))
         extraReported = reportedCoursesTaken.difference(registrarCoreTaken)
         extraRegistrar = registrarCoreTaken.difference(reportedCoursesTaken)
         
         if len(extraReported) != 0 and warningsLevel == 1:
-            warnings.warn(self.emailAddress + " reported courses not " + \
-                    " in registrar data: " + str(extraReported))
+            diagnostics.report(diagnostics.REPORTED_NOT_IN_REGISTRAR, self.emailAddress, None,
+                               extraReported)
             #warnings.warn("self: " + str(reportedCoursesTaken) + \
             #        " and reg: " + str(registrarCoreTaken))
         
         if len(extraRegistrar) != 0 and warningsLevel == 1:
-            warnings.warn(self.emailAddress + " did not report courses in " + \
-                            " registrar data: " + str(extraRegistrar))
+            diagnostics.report(diagnostics.REGISTRAR_NOT_REPORTED, self.emailAddress, None,
+                               extraRegistrar)
             #warnings.warn("self: " + str(reportedCoursesTaken) + \
             #        " and reg: " + str(registrarCoreTaken))
         
-        self.coursesTaken = self.coursesTaken.union(reportedCoursesTaken)
+        self.setCoursesTakenMask(self.coursesTakenMask
+                                 | course.COURSE_IDS.getMaskForCourses(reportedCoursesTaken))
+
+    def setCoursesTakenMask(self, coursesTakenMask):
+        '''
+        Replaces this student's (regularized) course history, a bitmask over
+        course.COURSE_IDS, keeping the core and elective counts up to date.
+        '''
+        self.coursesTakenMask = coursesTakenMask
+        self.numCoreCoursesTaken = bin(coursesTakenMask & course.COURSE_IDS.coreMask).count("1")
+        self.numElectivesTaken = bin(coursesTakenMask & course.COURSE_IDS.electiveMask).count("1")
+        self.historyVersion += 1
     
     def removePreference(self, courseName):
         '''
@@ -181,20 +232,80 @@ class Student:
         '''
         return self.idNumber
     
+    def getHistoryVersion(self):
+        '''
+        Returns a number that changes whenever this student's course history
+        does, so that anything computed from the history can tell it's stale.
+        '''
+        return self.historyVersion
+
+    def getHistoryViews(self):
+        '''
+        Returns the CourseHistoryViews for this student's current course
+        history, starting over if the history has changed.
+        '''
+        views = self.historyViews
+        if views is None or views.version != self.historyVersion:
+            views = CourseHistoryViews(self.historyVersion)
+            self.historyViews = views
+        return views
+
     def getCoursesTaken(self):
-        return sorted(self.coursesTaken)
+        views = self.getHistoryViews()
+        if views.coursesTaken is None:
+            views.coursesTaken = getSortedCourseNames(self.coursesTakenMask)
+        return views.coursesTaken
 
     def getRawCoursesTaken(self):
-        return sorted(self.rawCoursesTaken)
+        views = self.getHistoryViews()
+        if views.rawCoursesTaken is None:
+            views.rawCoursesTaken = getSortedCourseNames(self.rawCoursesTakenMask)
+        return views.rawCoursesTaken
         
     def getCoreCoursesTaken(self):
-        return sorted([c for c in self.getCoursesTaken()
-                                if course.isCore(c)])
-                                
+        views = self.getHistoryViews()
+        if views.coreCoursesTaken is None:
+            views.coreCoursesTaken = getSortedCourseNames(self.coursesTakenMask & course.COURSE_IDS.coreMask)
+        return views.coreCoursesTaken
 
     def getElectivesTaken(self):
-        return sorted([c for c in self.getCoursesTaken()
-                                if course.isElective(c)])
+        views = self.getHistoryViews()
+        if views.electivesTaken is None:
+            views.electivesTaken = getSortedCourseNames(self.coursesTakenMask & course.COURSE_IDS.electiveMask)
+        return views.electivesTaken
+
+    def hasTaken(self, regCourseName):
+        '''
+        Returns True if the (regularized) course is in this student's history,
+        counting equivalent courses.
+        '''
+        return self.coursesTakenMask & course.COURSE_IDS.getKnownMask(regCourseName) != 0
+
+    def hasTakenRaw(self, regCourseName):
+        '''
+        Returns True if the course is in this student's history, without
+        substituting equivalent courses.
+        '''
+        return self.rawCoursesTakenMask & course.COURSE_IDS.getKnownMask(regCourseName) != 0
+
+    def getNumCoreCoursesTaken(self):
+        return self.numCoreCoursesTaken
+
+    def getNumElectivesTaken(self):
+        return self.numElectivesTaken
+
+    def getCoursesTakenMask(self):
+        '''
+        Returns the (regularized) courses taken as a bitmask over course.COURSE_IDS.
+        '''
+        return self.coursesTakenMask
+
+    def getRawCoursesTakenMask(self):
+        '''
+        Returns the courses taken, without substituting equivalent courses,
+        as a bitmask over course.COURSE_IDS.
+        '''
+        return self.rawCoursesTakenMask
         
     def preferred(self, course1, course2):
         '''
@@ -309,14 +420,12 @@ class Student:
 
             classYear = self.classYear
             if self.classYear < Student.seniorClassYear:
-                warnings.warn(self.emailAddress + " has graduation year before " +
-                              "current senior class.")
+                diagnostics.report(diagnostics.GRADUATION_YEAR_TOO_EARLY, self.emailAddress)
                 classYear = Student.seniorClassYear
 
             yearsBehindSeniors = classYear - Student.seniorClassYear
             if yearsBehindSeniors > 3:
-                warnings.warn(self.emailAddress + " has graduation year further " +
-                              "in the future than any first year student")
+                diagnostics.report(diagnostics.GRADUATION_YEAR_TOO_LATE, self.emailAddress)
                 yearsBehindSeniors = 3
 
             # registrationClassYear should range from 0 to 3, with 3 being a
@@ -333,6 +442,26 @@ class Student:
 
             return ClassYear(registrationClassYear)
 
+class CourseHistoryViews:
+    '''
+    Sorted tuples of a student's courses, for the getters that are called
+    over and over during a match.  Each is filled in the first time it's
+    asked for.  Tied to the history version they were built from, so that
+    Student can tell when they're stale.
+    '''
+    __slots__ = ["version", "coursesTaken", "rawCoursesTaken", "coreCoursesTaken",
+                 "electivesTaken"]
+
+    def __init__(self, version):
+        self.version = version
+        self.coursesTaken = None
+        self.rawCoursesTaken = None
+        self.coreCoursesTaken = None
+        self.electivesTaken = None
+
+def getSortedCourseNames(mask):
+    return tuple(sorted(course.COURSE_IDS.getCourseNames(mask)))
+
 def preferenceHeaderParse(s):
     '''Turn a string of the form "Preferences [CS202: Math of CS]" into "CS202";
        otherwise return the string, unchanged.'''
@@ -342,7 +471,7 @@ def preferenceHeaderParse(s):
     elif len(allCourseNumbers) == 0:
         return s
     else:
-        warnings.warn("Your header " + s + " contains more than one course.")
+        diagnostics.report(diagnostics.MULTIPLE_COURSES_IN_HEADER, None, None, s)
         return ""
 
 def getClassYearHeaderBasedOnActualHeaders(fieldnames):        
@@ -363,33 +492,103 @@ def getClassYearHeaderBasedOnActualHeaders(fieldnames):
     return classYearHeader
     
     
-def loadStudentsFromRegistrarData(registrarFileName, warningsLevel=1):
+def getCompleteRows(rows, numColumns):
+    '''
+    Yields the rows (lists of column values) that have at least numColumns
+    values, i.e. every column up to the last one we read.  Columns after that
+    can be missing, as csv.DictReader allowed.  Blank rows are skipped, as
+    csv.DictReader skips them, and rows cut short of a column we read are
+    skipped with a warning.
+    '''
+    for row in rows:
+        if len(row) >= numColumns:
+            yield row
+        elif row:
+            diagnostics.report(diagnostics.SHORT_LINE, None, None, numColumns, row)
+
+def streamRegistrarData(registrarFileName, emails=None):
+    '''
+    Streams the registrar file as runs of consecutive rows for the same
+    student, yielding (email, rows) for each run; see groupRegistrarLines.
+    '''
+    with open(registrarFileName, encoding="utf-8", newline="") as registrarFile:
+        registrarReader = csv.reader(registrarFile)
+        fieldnames = next(registrarReader)
+        yield from groupRegistrarLines(registrarReader, fieldnames, emails)
+
+def groupRegistrarLines(lines, fieldnames, emails=None):
+    '''
+    Groups registrar lines (lists of column values, in the order given by
+    fieldnames) into runs of consecutive lines for the same student, yielding
+    (email, rows) for each run.  Only the columns we use are kept: each row is
+    a tuple (ID, name, class year, class level, enrollment status, course
+    name, status code), with status code None if the file doesn't have that
+    column.  If emails is given, runs for students not in it are skipped
+    without being kept.  A student whose lines aren't contiguous gets more
+    than one run.  Lines with no email come through as a run with email ""
+    whose rows are the full lines as dictionaries, for warning about.  Blank
+    and short lines are skipped (see getCompleteRows).
     '''
-    Returns a dictionary mapping from email keys to Student values
+    CLASS_YEAR_HEADER = getClassYearHeaderBasedOnActualHeaders(fieldnames)
+    columns = [fieldnames.index(header) for header in
+               [ID_HEADER, NAME_HEADER, CLASS_YEAR_HEADER, CLASS_LEVEL_HEADER,
+                ENROLLMENT_STATUS_HEADER, COURSE_NAME_HEADER]]
+    # Some versions of the registrar data don't include a status code header
+    if STATUS_CODE_HEADER in fieldnames:
+        columns.append(fieldnames.index(STATUS_CODE_HEADER))
+    emailColumn = fieldnames.index(EMAIL_HEADER)
+
+    lines = getCompleteRows(lines, max(columns + [emailColumn]) + 1)
+    for email, run in itertools.groupby(lines, key=operator.itemgetter(emailColumn)):
+        if len(email) == 0:
+            yield email, [dict(zip(fieldnames, line)) for line in run]
+            continue
+        if emails is not None and email not in emails:
+            continue
+        rows = [tuple(line[i] for i in columns) for line in run]
+        if len(columns) == 6:
+            rows = [row + (None,) for row in rows]
+        yield email, rows
+
+def loadStudentsFromRegistrarData(registrarFileName, warningsLevel=1, emails=None):
+    '''
+    Returns a dictionary mapping from email keys to Student values.  If emails
+    (a set) is given, only those students are loaded; everyone else in the file
+    is streamed past without being kept.
     '''
 
     studentDictionary = {}
-    with open(registrarFileName, encoding="utf-8") as registrarFile:
-        registrarReader = csv.DictReader(registrarFile)
-        CLASS_YEAR_HEADER = getClassYearHeaderBasedOnActualHeaders(registrarReader.fieldnames)
-        
-        for line in registrarReader:
-            email = line[EMAIL_HEADER]
-            if len(email) == 0:
-                warnings.warn("Line has length zero email - skipping: %s" % str(line))
-                continue
-
-            if email not in studentDictionary:
-                student = Student(line[ID_HEADER], line[EMAIL_HEADER], line[NAME_HEADER], line[CLASS_YEAR_HEADER],
-                                  line[CLASS_LEVEL_HEADER], line[ENROLLMENT_STATUS_HEADER])
-                studentDictionary[email] = student
-            student = studentDictionary[email]
-            # Some versions of the registrar data don't include a status code header
-            if (STATUS_CODE_HEADER not in line) or (not isIgnoredStatusCode(line[STATUS_CODE_HEADER])):
-                student.addCourse(line[COURSE_NAME_HEADER], warningsLevel=warningsLevel)
+    for email, rows in streamRegistrarData(registrarFileName, emails):
+        if len(email) == 0:
+            warnEmptyEmailLines(rows)
+            continue
+        student = studentDictionary.get(email)
+        if student is None:
+            idNumber, name, classYear, classLevel, enrollmentStatus, _, _ = rows[0]
+            student = Student(idNumber, email, name, classYear, classLevel, enrollmentStatus)
+            studentDictionary[email] = student
+        for _, _, _, _, _, courseName, statusCode in rows:
+            if statusCode is None or not isIgnoredStatusCode(statusCode):
+                student.addCourse(courseName, warningsLevel=warningsLevel)
         
     return studentDictionary
 
+def warnEmptyEmailLines(lines):
+    for line in lines:
+        diagnostics.report(diagnostics.EMPTY_EMAIL_LINE, None, None, line)
+
+def readPreferenceEmails(preferenceFileName):
+    '''
+    Returns the set of emails of students who submitted the preference form,
+    reading only that column.
+    '''
+    with open(preferenceFileName, encoding="utf-8", newline="") as preferenceFile:
+        preferenceReader = csv.reader(preferenceFile)
+        fieldnames = next(preferenceReader)
+        plan = PreferenceFormPlan(fieldnames)
+        # The same rows as the loader keeps; warnings about short rows are left to it
+        return {line[plan.emailColumn] for line in preferenceReader if len(line) >= plan.numColumns}
+
 def writeUniqueEmails(studentDict, outfile):
     '''
     Write out the emails of all students who should be notified about the match. These are students
@@ -401,7 +600,7 @@ def writeUniqueEmails(studentDict, outfile):
             if len(csCourses) > 0:
                 writer.write(s + "\n")
             else:
-                warnings.warn("Skipping printing email due to no CS taken: " + s)
+                diagnostics.report(diagnostics.NO_CS_TAKEN, s)
 
 
 def readCoursePreferences(line, courseNameToHeader):
@@ -419,11 +618,7 @@ def readCoursePreferences(line, courseNameToHeader):
         value = line[header].strip()
         if value and value.isdigit():
             currentPreferences[int(value) - 1] = courseName
-    for i in range(1,len(currentPreferences)-1):
-        if currentPreferences[:i] == [None] * i \
-           and None not in currentPreferences[i:]:
-            warnings.warn("%s may have inverted preferences: prefs=%s"
-                          % (line[PR_EMAIL_HEADER], str(currentPreferences)))
+    warnForInvertedPreferences(line[PR_EMAIL_HEADER], currentPreferences)
     currentPreferences = [c for c in currentPreferences if c]
     return currentPreferences
 
@@ -444,11 +639,7 @@ def readCoursePreferencesWithNone(line, courseNameToHeader):
     
             
     # Check for posible preference inversion
-    for i in range(1,len(currentPreferences)-1):
-        if currentPreferences[:i] == [None] * i \
-           and None not in currentPreferences[i:]:
-            warnings.warn("%s may have inverted preferences: prefs=%s"
-                          % (line[PR_EMAIL_HEADER], str(currentPreferences)))
+    warnForInvertedPreferences(line[PR_EMAIL_HEADER], currentPreferences)
     
     # Strip off anything below the NO_COURSE_CHOICE
     noChoiceKey = [key for key in line if NO_COURSE_CHOICE in key][0]
@@ -458,6 +649,81 @@ def readCoursePreferencesWithNone(line, courseNameToHeader):
     currentPreferences = [c for c in currentPreferences if c]
     return currentPreferences
 
+def warnForInvertedPreferences(email, currentPreferences):
+    '''
+    Warns if currentPreferences (course names indexed by rank, with None
+    for ranks nobody was given) has a run of unused ranks at the top and
+    none below: that usually means the student ranked in the wrong
+    direction.  Only the length of the leading run matters, so this is one
+    pass rather than comparing every prefix and suffix.
+    '''
+    numLeadingNones = 0
+    for courseName in currentPreferences:
+        if courseName is not None:
+            break
+        numLeadingNones += 1
+    if 1 <= numLeadingNones <= len(currentPreferences) - 2 \
+       and None not in itertools.islice(currentPreferences, numLeadingNones, None):
+        diagnostics.report(diagnostics.INVERTED_PREFERENCES, email, None, currentPreferences)
+
+class PreferenceFormPlan:
+    '''
+    Where everything we read from the preference form is in each of its
+    rows, worked out once from the header row, so that rows can be read as
+    plain lists of column values.  Headers that appear more than once are
+    read from their last column, as csv.DictReader would.
+    '''
+    def __init__(self, fieldnames):
+        self.fieldnames = fieldnames
+        columns = {header : i for i, header in enumerate(fieldnames)}
+        self.emailColumn = columns[PR_EMAIL_HEADER]
+        self.idColumn = columns[PR_ID_HEADER]
+        self.nameColumn = columns[PR_NAME_HEADER]
+        self.classYearColumn = columns[PR_CLASS_YEAR_HEADER]
+        coursesTakenHeader = getCoursesTakenHeader(columns)
+        self.coursesTakenColumn = None if coursesTakenHeader is None else columns[coursesTakenHeader]
+        noChoiceHeaders = [header for header in columns if NO_COURSE_CHOICE in header]
+        self.noChoiceColumn = columns[noChoiceHeaders[0]] if noChoiceHeaders else None
+
+        self.courseNameToHeader = {}
+        for header in columns:
+            courseName = preferenceHeaderParse(header)
+            if courseName != header:
+                self.courseNameToHeader[courseName] = header
+        self.courseNames = list(self.courseNameToHeader)
+        self.getCourseValues = operator.itemgetter(
+            *[columns[header] for header in self.courseNameToHeader.values()], self.emailColumn)
+        # Rows need values up to the last column read from them
+        self.numColumns = 1 + max([self.emailColumn, self.idColumn, self.nameColumn, self.classYearColumn]
+                                  + [columns[header] for header in self.courseNameToHeader.values()]
+                                  + [column for column in [self.coursesTakenColumn, self.noChoiceColumn]
+                                     if column is not None])
+
+    def getLine(self, row):
+        '''
+        Returns the row as a dictionary keyed by header, for warnings.
+        '''
+        return dict(zip(self.fieldnames, row))
+
+    def readCoursePreferences(self, row):
+        '''
+        Same as readCoursePreferencesWithNone, for a row of column values.
+        '''
+        if self.noChoiceColumn is None:
+            raise Exception("No \"" + NO_COURSE_CHOICE + "\" column in preference data")
+        currentPreferences = [None] * (len(self.courseNames) + 1)
+        # The email is fetched along with the rankings, as the last value
+        values = self.getCourseValues(row)
+        # Most courses go unranked, so skip the empty values without looking at them
+        for courseName, value in itertools.compress(zip(self.courseNames, values), values):
+            value = value.strip()
+            if value.isdigit():
+                currentPreferences[int(value) - 1] = courseName
+        warnForInvertedPreferences(values[-1], currentPreferences)
+
+        valueNoCourseChoice = int(row[self.noChoiceColumn].strip())
+        return [c for c in currentPreferences[:valueNoCourseChoice] if c]
+
 def addPreferenceDataToStudentDictionary(
         preferenceFileName, studentDictionary, courseDictionary,
         warningsLevel=1):
@@ -466,54 +732,85 @@ def addPreferenceDataToStudentDictionary(
     preference lists read from preferenceFileName
     Returns the number of students who we read in preferences for.
     '''
+    with open(preferenceFileName, encoding="utf-8", newline="") as preferenceFile:
+        preferenceReader = csv.reader(preferenceFile)
+        return addPreferenceLinesToStudentDictionary(
+            next(preferenceReader, None), preferenceReader, studentDictionary,
+            courseDictionary, warningsLevel=warningsLevel)
+
+def readPreferenceData(preferenceFileName):
+    '''
+    Reads the whole preference file, returning (fieldnames, lines) with each
+    line a list of column values; see addPreferenceLinesToStudentDictionary.
+    '''
+    with open(preferenceFileName, encoding="utf-8", newline="") as preferenceFile:
+        preferenceReader = csv.reader(preferenceFile)
+        return next(preferenceReader, None), list(preferenceReader)
+
+def addPreferenceLinesToStudentDictionary(
+        fieldnames, lines, studentDictionary, courseDictionary,
+        warningsLevel=1):
+    '''
+    Same as addPreferenceDataToStudentDictionary, for preference file lines
+    that have already been read: fieldnames is the header row and lines is an
+    iterable of lists of column values in the same order.  Blank lines and
+    lines cut short are skipped (see getCompleteRows).
+    '''
     numStudents  = 0
-    with open(preferenceFileName, encoding="utf-8") as preferenceFile:
-        preferenceReader = csv.DictReader(preferenceFile)
-        fieldnames = preferenceReader.fieldnames
-        assert fieldnames is not None, "Fieldnames is None, something went wrong in reading data."
-        courseNameToHeader = {preferenceHeaderParse(header) : header
-                              for header in fieldnames
-                              if header != preferenceHeaderParse(header)}
-
-        for line in preferenceReader:
-            numStudents += 1
-            email = line[PR_EMAIL_HEADER]
-            idNum = line[PR_ID_HEADER]
-            name = line[PR_NAME_HEADER]
-            selfReportedCourses = []
-            coursesTakenHeader = getCoursesTakenHeader(line);
-            if coursesTakenHeader is not None:
-                selfReportedCourses = line[coursesTakenHeader].split(",")
-            else:
-                warnings.warn("No header present that matched courses taken" + str(line))
-
-
-            curStudent = studentDictionary.get(email)
-            if email not in studentDictionary:
-                curStudent = Student(idNum, email, name,
-                                     line[PR_CLASS_YEAR_HEADER])
-                studentDictionary[email] = curStudent
-                warnings.warn(email + " submitted preference information but not in registrar data;" + \
-                                 " adding with the year they gave:" + line[PR_CLASS_YEAR_HEADER])
-
-            if curStudent.getID() != idNum and warningsLevel == 1:
-                warnings.warn(email + " reported a different ID than registrar:" + str(curStudent.getID()) + " vs " + str(idNum))
-
-            if (curStudent.getRegistrationClassYear()
-                != getRegistrationYearFromNumericYear(
-                    getNumericYearFromText(line[PR_CLASS_YEAR_HEADER]))):
-                warnings.warn(email + ": Class year from registrar " + str(curStudent.getRegistrationClassYear()) + \
-                  " didn't match preferences form year " + str(getNumericYearFromText(line[PR_CLASS_YEAR_HEADER])) + \
-                  "; using year from registrar.")
-                
-            curStudent.addSelfReportedCoursesTaken(selfReportedCourses, warningsLevel=warningsLevel)
-            curStudent.addPreferenceInformation(line, courseNameToHeader, courseDictionary)
+    eligibilityMatrix = eligibility.EligibilityMatrix(courseDictionary)
+    assert fieldnames is not None, "Fieldnames is None, something went wrong in reading data."
+    plan = PreferenceFormPlan(fieldnames)
+
+    for line in getCompleteRows(lines, plan.numColumns):
+        numStudents += 1
+        addPreferenceLine(plan, line, studentDictionary, courseDictionary, eligibilityMatrix,
+                          warningsLevel=warningsLevel)
     return numStudents
 
+def addPreferenceLine(plan, line, studentDictionary, courseDictionary, eligibilityMatrix,
+                      warningsLevel=1):
+    '''
+    Adds one line of the preference file (a list of column values, laid out
+    as described by plan, a PreferenceFormPlan) to studentDictionary, adding
+    the student if they aren't in it.  Returns their email.
+    '''
+    email = line[plan.emailColumn]
+    idNum = line[plan.idColumn]
+    name = line[plan.nameColumn]
+    classYear = line[plan.classYearColumn]
+    selfReportedCourses = []
+    if plan.coursesTakenColumn is not None:
+        selfReportedCourses = line[plan.coursesTakenColumn].split(",")
+    else:
+        diagnostics.report(diagnostics.NO_COURSES_TAKEN_HEADER, None, None, plan.getLine(line))
+
+
+    curStudent = studentDictionary.get(email)
+    if email not in studentDictionary:
+        curStudent = Student(idNum, email, name, classYear)
+        studentDictionary[email] = curStudent
+        diagnostics.report(diagnostics.NOT_IN_REGISTRAR, email, None, classYear)
+
+    if curStudent.getID() != idNum and warningsLevel == 1:
+        diagnostics.report(diagnostics.DIFFERENT_ID, email, None, curStudent.getID(), idNum)
+
+    if (curStudent.getRegistrationClassYear()
+        != getRegistrationYearFromNumericYear(
+            getNumericYearFromText(classYear))):
+        diagnostics.report(diagnostics.CLASS_YEAR_MISMATCH, email, None,
+                           curStudent.getRegistrationClassYear(),
+                           getNumericYearFromText(classYear))
+        
+    curStudent.addSelfReportedCoursesTaken(selfReportedCourses, warningsLevel=warningsLevel)
+    curStudent.addPreferences(plan.readCoursePreferences(line), courseDictionary,
+                              eligibilityMatrix)
+    return email
+
 def getCoursesTakenHeader(line):
     '''
     Returns the header for the question about courses taken, or None
-    if not present.
+    if not present.  line can be anything keyed by (or listing) the
+    headers; PreferenceFormPlan looks this up once, from the header row.
     '''
     fullTextOptions = [PR_CORE_TAKEN_HEADER, PR_CORE_TAKEN_HEADER_ALT]
     for fullTextOption in fullTextOptions:
@@ -549,7 +846,7 @@ def getNumericYearFromText(classYear) -> int:
     try:
         return int(classYear)
     except:
-        warnings.warn("Couldn't interpret " + classYear + " as an int.")
+        diagnostics.report(diagnostics.UNREADABLE_CLASS_YEAR, None, None, classYear)
         return 0
 
 def getRegistrationYearFromNumericYear(numericYear:int ) -> Optional[ClassYear]:
@@ -560,5 +857,5 @@ def getRegistrationYearFromNumericYear(numericYear:int ) -> Optional[ClassYear]:
     try:
         return ClassYear(3 - (numericYear - Student.seniorClassYear))
     except:
-        warnings.warn("Couldn't interpret " + str(numericYear) + " as a class year.")
+        diagnostics.report(diagnostics.UNKNOWN_CLASS_YEAR, None, None, numericYear)
         return None
@@ -4,6 +4,32 @@ import match
 import priorityDict
 import course
 import filenames
+import eligibility
+import snapshot
+import matchEngine
+import matchOutput
+import components
+import parallelLoad
+import sweep
+import simulate
+import benchmarks
+import synthetic
+import verify
+import registrarStore
+import server
+import watch
+import os
+import profiling
+import diagnostics
+import tempfile
+import hashlib
+import json
+import io
+import csv
+import contextlib
+import random
+import tracemalloc
+from collections import Counter
 
 def testRelativeClassYears():
     student.Student.setGeneralCalendarInfo(2023, "spring")
@@ -136,3 +162,880 @@ def testCorrectMatches():
         if key.getCourseName() == 'CS.251':
             assert "c@carleton.edu" in rosters[key]
 
+
+def testFastEngineMatchesClassic():
+    '''The integer-indexed engine should produce exactly the classic match.'''
+    results = []
+    for engine in ["classic", "fast"]:
+        tiebreaker = priorityDict.PriorityDictionary(debug=True)
+        courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+        student.Student.setGeneralCalendarInfo(2023, "spring")
+        studentDictionary = student.loadStudentsFromRegistrarData(
+            filenames.registrarFileName)
+        student.addPreferenceDataToStudentDictionary(
+            filenames.preferenceFileName, studentDictionary, courseDictionary,
+            warningsLevel=0)
+        rosters, rejections = match.match(studentDictionary, courseDictionary,
+                                          maxCoursesDictionary={"a@carleton.edu" : 2},
+                                          engine=engine)
+        results.append(({c.getCourseName() : rosters[c] for c in rosters}, rejections))
+    assert results[0] == results[1]
+
+def testEligibilityMatrixAgreesWithCannotTake():
+    tiebreaker = priorityDict.PriorityDictionary(debug=True)
+    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+    student.Student.setGeneralCalendarInfo(2023, "spring")
+    studentDictionary = student.loadStudentsFromRegistrarData(
+        filenames.registrarFileName)
+    courseDictionary["CS.252"].studentsWithWaivers.append("c@carleton.edu")
+    eligibilityMatrix = eligibility.EligibilityMatrix(courseDictionary)
+    for s in studentDictionary.values():
+        for courseName, c in courseDictionary.items():
+            assert eligibilityMatrix.canTake(s, courseName) == (not c.cannotTake(s))
+            assert eligibilityMatrix.describe(s, courseName) == c.cannotTake(s)
+            if not c.cannotTake(s):
+                assert eligibilityMatrix.getReason(s, courseName) == 0
+            elif "already taken" in c.cannotTake(s):
+                assert eligibilityMatrix.getReason(s, courseName) & eligibility.ALREADY_TAKEN
+
+def testRegularize():
+    assert course.regularize("CS 201") == "CS.201"
+    assert course.regularize("Math 236") == "CS.202"
+    assert course.regularize("Math 236", substituteEquivalent=False) == "MATH.236"
+    assert course.regularize(" cs111AP ") == "CS.111"
+    assert course.regularize("CS201 or CS202") == "CS.201"
+    assert course.regularize("CS") == ".CS"
+    hits = course.getRegularizeCacheInfo().hits
+    course.regularize("CS 201")
+    assert course.getRegularizeCacheInfo().hits == hits + 1
+
+def testSnapshotRoundTrip():
+    tiebreaker = priorityDict.PriorityDictionary(debug=True)
+    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+    student.Student.setGeneralCalendarInfo(2023, "spring")
+    studentDictionary = student.loadStudentsFromRegistrarData(
+        filenames.registrarFileName)
+    numStudents = student.addPreferenceDataToStudentDictionary(
+        filenames.preferenceFileName, studentDictionary, courseDictionary,
+        warningsLevel=0)
+    key = snapshot.getSnapshotKey([filenames.coursesFileName, filenames.registrarFileName,
+                                   filenames.preferenceFileName], ["2023", "spring"])
+    with tempfile.TemporaryDirectory() as cacheDirectory:
+        assert snapshot.loadSnapshot(cacheDirectory, key, tiebreaker) is None
+        snapshot.saveSnapshot(cacheDirectory, key, courseDictionary, studentDictionary, numStudents)
+        assert courseDictionary["CS.251"].tiebreaker is tiebreaker
+        loadedCourses, loadedStudents, loadedNumStudents = snapshot.loadSnapshot(
+            cacheDirectory, key, tiebreaker)
+        assert snapshot.clearSnapshots(cacheDirectory) == 1
+    assert loadedNumStudents == numStudents
+    assert loadedCourses["CS.251"].tiebreaker is tiebreaker
+    for email, s in studentDictionary.items():
+        assert loadedStudents[email].getCoursesTaken() == s.getCoursesTaken()
+        assert loadedStudents[email].getWishList() == s.getWishList()
+
+def testIncrementalMatchMatchesRerun():
+    '''Changing a match should give the same match as running it again.'''
+    def loadData():
+        tiebreaker = priorityDict.PriorityDictionary(debug=True)
+        courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+        student.Student.setGeneralCalendarInfo(2023, "spring")
+        studentDictionary = student.loadStudentsFromRegistrarData(
+            filenames.registrarFileName)
+        student.addPreferenceDataToStudentDictionary(
+            filenames.preferenceFileName, studentDictionary, courseDictionary,
+            warningsLevel=0)
+        return courseDictionary, studentDictionary
+    def asSets(rosters, rejections):
+        return {c.getCourseName() : set(rosters[c]) for c in rosters}, sorted(rejections)
+
+    courseDictionary, studentDictionary = loadData()
+    state = matchEngine.incrementalMatch(studentDictionary, courseDictionary)
+    state.changeCapacity("CS.251", -1)
+    state.removeStudent("c@carleton.edu")
+    state.forceMatch("a@carleton.edu", "CS.252")
+
+    courseDictionary, studentDictionary = loadData()
+    courseDictionary["CS.251"].decrementCapacity()
+    studentDictionary["c@carleton.edu"].markIneligibleForMatch()
+    match.prepareForForcedMatches(["a@carleton.edu:CS.252"], courseDictionary, studentDictionary)
+    rosters, rejections = match.match(studentDictionary, courseDictionary)
+    match.applyForcedMatches(["a@carleton.edu:CS.252"], courseDictionary, studentDictionary, rosters)
+    assert asSets(state.getRosters(), state.getRejections()) == asSets(rosters, rejections)
+
+def testSweepMatchesFullRuns():
+    tiebreaker = priorityDict.PriorityDictionary(debug=True)
+    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+    student.Student.setGeneralCalendarInfo(2023, "spring")
+    studentDictionary = student.loadStudentsFromRegistrarData(
+        filenames.registrarFileName)
+    student.addPreferenceDataToStudentDictionary(
+        filenames.preferenceFileName, studentDictionary, courseDictionary,
+        warningsLevel=0)
+    scenarios = sweep.parseGrid(["CS 251=0,1", "CS.252=0,1"], courseDictionary)
+    assert [name for name, _ in scenarios] == ["CS.251=0 CS.252=0", "CS.251=0 CS.252=1",
+                                              "CS.251=1 CS.252=0", "CS.251=1 CS.252=1"]
+
+    # A bigger term, where changing capacities moves students around
+    with tempfile.TemporaryDirectory() as directory:
+        coursesFileName, registrarFileName, preferenceFileName = synthetic.writeTerm(
+            directory + "/term", numStudents=300, numCourses=12, seatRatio=0.7, seed=4)
+        courseDictionary = course.loadCourses(coursesFileName, priorityDict.PriorityDictionary(debug=True))
+        student.Student.setGeneralCalendarInfo(2023, "fall")
+        studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+        student.addPreferenceDataToStudentDictionary(preferenceFileName, studentDictionary, courseDictionary,
+                                                     warningsLevel=0)
+    capacity = courseDictionary["CS.251"].getCapacity()
+    scenarios = sweep.parseGrid(["CS.251=0,%d" % capacity, "CS.252=%d,%d" % (capacity // 2, 2 * capacity)],
+                                courseDictionary)
+    sweepProblem = sweep.SweepProblem(studentDictionary, courseDictionary)
+    results = sweep.runSweep(sweepProblem, scenarios)
+    for (_, capacities), (_, summary) in zip(scenarios, results):
+        # Rerun the scenario on its own to see the sweep's rosters
+        sweep.runScenarios([("", sweepProblem.getCapacities(capacities))])
+        for courseName, capacity in capacities.items():
+            courseDictionary[courseName].capacity = capacity
+        rosters, rejections = match.match(studentDictionary, courseDictionary)
+        assert {c.getCourseName() : sorted(roster) for c, roster in sweep.workerState.getRosters().items()} \
+            == {c.getCourseName() : sorted(roster) for c, roster in rosters.items()}
+        assert sorted(sweep.workerState.getRejections()) == sorted(rejections)
+        numMatches, numRejections, choicesReceived, rejected = summary
+        assert numMatches == sum(len(roster) for roster in rosters.values())
+        assert numRejections == len(rejections)
+        assert choicesReceived == Counter((studentDictionary[email].getRegistrationClassYear(),
+                                           studentDictionary[email].getWishList().index(c.getCourseName()) + 1)
+                                          for c, roster in rosters.items() for email in roster)
+        assert rejected == Counter(studentDictionary[email].getRegistrationClassYear() for email in rejections)
+
+def testSimulationDrawMatchesMatchWithSameTiebreakers():
+    def loadData(tiebreaker):
+        courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+        student.Student.setGeneralCalendarInfo(2023, "spring")
+        studentDictionary = student.loadStudentsFromRegistrarData(
+            filenames.registrarFileName)
+        student.addPreferenceDataToStudentDictionary(
+            filenames.preferenceFileName, studentDictionary, courseDictionary,
+            warningsLevel=0)
+        return courseDictionary, studentDictionary
+
+    courseDictionary, studentDictionary = loadData(priorityDict.PriorityDictionary(debug=True))
+    lottery = simulate.Lottery(studentDictionary, courseDictionary)
+    for draw in range(5):
+        state = lottery.runDraw(7, draw)
+        tiebreaker = simulate.getDrawTiebreaker(7, draw)
+        tiebreaker.assignPriorities(lottery.problem.emails)
+        drawCourses, drawStudents = loadData(tiebreaker)
+        rosters, rejections = match.match(drawStudents, drawCourses)
+        assert {c.getCourseName() : set(rosters[c]) for c in rosters} == \
+               {c.getCourseName() : set(roster) for c, roster in state.getRosters().items()}
+        assert sorted(rejections) == sorted(state.getRejections())
+
+    results = simulate.simulate(lottery, 20, 7, workers=2)
+    assert results.numDraws == 20
+    assert sum(results.rejections.values()) == 20
+
+def testPriorityDictionaryBatchesAndPersists():
+    emails = ["a@carleton.edu", "b@carleton.edu", "c@carleton.edu"]
+    first = priorityDict.PriorityDictionary(debug=False, seed=5)
+    first.assignPriorities(emails)
+    # Another dictionary in between doesn't change what a seed gives
+    priorityDict.PriorityDictionary(debug=False, seed=6).assignPriorities(emails)
+    second = priorityDict.PriorityDictionary(debug=False, seed=5)
+    assert list(second.getPriorityArray(emails)) == [first.getPriority(e) for e in emails]
+
+    deterministic = priorityDict.PriorityDictionary(debug=True)
+    assert sorted(emails, key=deterministic.getPriority) == \
+           sorted(emails, key=lambda e: hashlib.md5(e.encode('utf-8')).hexdigest())
+
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = directory + "/lottery.csv"
+        first.savePriorities(fileName)
+        reloaded = priorityDict.PriorityDictionary(debug=False)
+        reloaded.loadPriorities(fileName)
+    assert [reloaded.getPriority(e) for e in emails] == [first.getPriority(e) for e in emails]
+
+def testBenchmarkRegressions():
+    def result(seconds, peakMemoryBytes):
+        return dict(benchmark="match.match (fast)", students=1000, courses=10, wishlistLength=3,
+                    seconds=seconds, peakMemoryBytes=peakMemoryBytes)
+    baseline = {"results" : [result(1.0, 1000)]}
+    assert benchmarks.findRegressions([result(1.2, 1100)], baseline, 0.25, 0.01) == []
+    assert len(benchmarks.findRegressions([result(1.3, 1100)], baseline, 0.25, 0.01)) == 1
+    assert len(benchmarks.findRegressions([result(1.3, 2000)], baseline, 0.25, 0.01)) == 2
+    assert benchmarks.findRegressions([result(1.3, None)], baseline, 0.25, 2.0) == []
+
+def testSyntheticTermLoadsAndMatches():
+    '''A synthetic term should be reproducible and usable by the match.'''
+    settings = dict(numStudents=300, numCourses=20, prerequisiteDepth=3, seed=7)
+    with tempfile.TemporaryDirectory() as directory:
+        coursesFileName, registrarFileName, preferenceFileName = synthetic.writeTerm(directory + "/a", **settings)
+        with open(preferenceFileName, "rb") as preferenceFile:
+            preferences = preferenceFile.read()
+        synthetic.writeTerm(directory + "/b", **settings)
+        with open(directory + "/b/preferences.csv", "rb") as preferenceFile:
+            assert preferenceFile.read() == preferences
+
+        tiebreaker = priorityDict.PriorityDictionary(debug=True)
+        courseDictionary = course.loadCourses(coursesFileName, tiebreaker)
+        student.Student.setGeneralCalendarInfo(2023, "fall")
+        studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+        numStudents = student.addPreferenceDataToStudentDictionary(
+            preferenceFileName, studentDictionary, courseDictionary, warningsLevel=0)
+    assert len(courseDictionary) == 20
+    assert len(studentDictionary) == 300
+    assert 0 < numStudents < 300
+    assert courseDictionary["CS.251"].getCapacity() == round(0.8 * 300 * 0.8 / 20)
+    rosters, rejections = match.match(studentDictionary, courseDictionary)
+    assert sum(len(roster) for roster in rosters.values()) > 0
+
+    # Course numbers on the form have three digits, so there's a limit
+    term = synthetic.SyntheticTerm(numStudents=10, numCourses=synthetic.MAX_COURSES)
+    assert all(student.preferenceHeaderParse("[%s: Course]" % courseName.replace(".", "")) == courseName
+               for courseName in term.courseNames)
+    try:
+        synthetic.SyntheticTerm(numStudents=10, numCourses=synthetic.MAX_COURSES + 1)
+        assert False, "a term with more courses than three-digit numbers allow should fail"
+    except ValueError:
+        pass
+
+def testProfileCountersAgreeBetweenEngines():
+    '''Both engines make the same proposals, so they should count the same
+    events, and each match should only count its own.'''
+    counters = {}
+    for engine in ["classic", "fast", "fast"]:
+        tiebreaker = priorityDict.PriorityDictionary(debug=True)
+        courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+        student.Student.setGeneralCalendarInfo(2023, "spring")
+        studentDictionary = student.loadStudentsFromRegistrarData(
+            filenames.registrarFileName)
+        student.addPreferenceDataToStudentDictionary(
+            filenames.preferenceFileName, studentDictionary, courseDictionary,
+            warningsLevel=0)
+        profile = profiling.Profile()
+        with profile.phase("match"):
+            rosters, _ = match.match(studentDictionary, courseDictionary, engine=engine,
+                                     counters=profile.counters)
+        if engine in counters:
+            assert profile.counters == counters[engine]
+        counters[engine] = profile.counters
+    assert counters["classic"] == counters["fast"]
+    assert counters["fast"]["rankLookups"] == counters["fast"]["proposals"]
+    # Once per student per course type
+    assert counters["fast"]["priorityEvaluations"] \
+        == len(studentDictionary) * len({type(c) for c in courseDictionary.values()})
+    assert counters["fast"]["proposals"] - counters["fast"]["evictions"] \
+        == sum(len(roster) for roster in rosters.values())
+
+    with tempfile.TemporaryDirectory() as directory:
+        profile.save(directory + "/profile.json")
+        profile.save(directory + "/profile.prom")
+        with open(directory + "/profile.prom") as profileFile:
+            prometheus = profileFile.read()
+    assert 'match_engine_events{event="proposals"} %d' % counters["fast"]["proposals"] in prometheus
+    assert 'match_phase_wall_seconds{phase="match"}' in prometheus
+    assert profiling.DISABLED.counters is None
+
+def testDiagnosticsAreDeduplicatedAndWrittenAsJson():
+    def loadData():
+        tiebreaker = priorityDict.PriorityDictionary(debug=True)
+        courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+        student.Student.setGeneralCalendarInfo(2023, "spring")
+        studentDictionary = student.loadStudentsFromRegistrarData(
+            filenames.registrarFileName)
+        student.addPreferenceDataToStudentDictionary(
+            filenames.preferenceFileName, studentDictionary, courseDictionary)
+        match.match(studentDictionary, courseDictionary)
+
+    defaultSink = diagnostics.sink
+    try:
+        loadData()
+        assert diagnostics.sink.buffer == []
+        with tempfile.TemporaryDirectory() as directory:
+            diagnostics.sink = diagnostics.DiagnosticsSink(1, directory + "/warnings.jsonl")
+            loadData()
+            assert len(diagnostics.sink.buffer) > 0
+            loadData()
+            diagnostics.flush()
+            with open(directory + "/warnings.jsonl") as diagnosticsFile:
+                records = [json.loads(line) for line in diagnosticsFile]
+    finally:
+        diagnostics.sink = defaultSink
+    messages = [record["message"] for record in records]
+    assert len(messages) == len(set(messages))
+    dropped = [record for record in records if record["code"] == diagnostics.INELIGIBLE_CHOICE_DROPPED]
+    assert len(dropped) > 0
+    assert all(record["email"] in record["message"] and record["course"] in record["message"]
+               for record in dropped)
+
+    # Messages are about the student as they were when reported, even if
+    # their history changes before the messages are written
+    tiebreaker = priorityDict.PriorityDictionary(debug=True)
+    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+    studentDictionary = student.loadStudentsFromRegistrarData(filenames.registrarFileName, warningsLevel=0)
+    student.addPreferenceDataToStudentDictionary(filenames.preferenceFileName, studentDictionary,
+                                                 courseDictionary, warningsLevel=0)
+    eligibilityMatrix = eligibility.EligibilityMatrix(courseDictionary)
+    emails = [email for email, s in studentDictionary.items() if s.submittedPreferences()]
+    reasons = {(email, courseName) : str(eligibilityMatrix.describe(studentDictionary[email], courseName))
+               for email in emails for courseName in studentDictionary[email].getWishList()
+               if not eligibilityMatrix.canTake(studentDictionary[email], courseName)}
+    try:
+        diagnostics.sink = diagnostics.DiagnosticsSink(1, flushSize=None)
+        eligibility.getEligibleWishLists(studentDictionary, emails, eligibilityMatrix)
+        for email in emails:
+            studentDictionary[email].setCoursesTakenMask(0)
+        messages = diagnostics.takeMessages()
+    finally:
+        diagnostics.sink = defaultSink
+    dropped = [(email, courseName, message) for code, email, courseName, message in messages
+               if code == diagnostics.INELIGIBLE_CHOICE_DROPPED]
+    assert len(dropped) == len(reasons)
+    assert all(" but " + reasons[(email, courseName)] + " so " in message for email, courseName, message in dropped)
+    assert any(str(eligibilityMatrix.describe(studentDictionary[email], courseName)) != reasons[(email, courseName)]
+               for email, courseName, _ in dropped)
+
+def testComponentMatchMatchesMatch():
+    '''Matching the independent parts of a term separately should give
+    exactly the match (and rejection order) of the whole term.'''
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        coursesFileName, registrarFileName, preferenceFileName = synthetic.writeTerm(
+            directory, numStudents=400, numCourses=30, wishlistLength=1, seatRatio=0.3, seed=3)
+        for workers in [1, 3]:
+            tiebreaker = priorityDict.PriorityDictionary(debug=False, seed=5)
+            courseDictionary = course.loadCourses(coursesFileName, tiebreaker)
+            student.Student.setGeneralCalendarInfo(2023, "fall")
+            studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+            student.addPreferenceDataToStudentDictionary(
+                preferenceFileName, studentDictionary, courseDictionary, warningsLevel=0)
+            participants = [email for email in studentDictionary
+                            if studentDictionary[email].submittedPreferences()]
+            maxCoursesDictionary = {participants[5] : 3, participants[17] : 2}
+            rosters, rejections = match.match(studentDictionary, courseDictionary,
+                                              maxCoursesDictionary=maxCoursesDictionary, workers=workers)
+            results.append(({c.getCourseName() : rosters[c] for c in rosters}, rejections,
+                            tiebreaker.priorityDictionary))
+    assert len(components.findComponents(studentDictionary, participants, list(courseDictionary))) > 3
+    assert len(results[0][1]) > 0
+    assert results[0] == results[1]
+
+def testRegistrarOutputFormatsAgree():
+    '''The registrar data should say the same thing in every format, and the
+    text file should be exactly what --registrar prints.'''
+    tiebreaker = priorityDict.PriorityDictionary(debug=True)
+    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+    student.Student.setGeneralCalendarInfo(2023, "spring")
+    studentDictionary = student.loadStudentsFromRegistrarData(
+        filenames.registrarFileName)
+    student.addPreferenceDataToStudentDictionary(
+        filenames.preferenceFileName, studentDictionary, courseDictionary,
+        warningsLevel=0)
+    rosters, rejections = match.match(studentDictionary, courseDictionary)
+    printed = io.StringIO()
+    with contextlib.redirect_stdout(printed):
+        match.printRegistrarMatch(rosters, rejections, courseDictionary, studentDictionary)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for suffix in [".txt", ".csv", ".jsonl"]:
+            matchOutput.saveRegistrarMatch(directory + "/registrar" + suffix, rosters, rejections,
+                                           courseDictionary, studentDictionary)
+        with open(directory + "/registrar.txt") as textFile:
+            assert textFile.read() == printed.getvalue()
+        with open(directory + "/registrar.csv", newline="") as csvFile:
+            csvRows = [(row["Email"], row["ID"], row["Course"]) for row in csv.DictReader(csvFile)]
+        with open(directory + "/registrar.jsonl") as jsonFile:
+            jsonRows = [(row["email"], row["id"], row["course"] or "") for row in map(json.loads, jsonFile)]
+    expected = sorted([(email, studentDictionary[email].getID(), c.getCourseName() + ".M")
+                       for c in rosters for email in rosters[c]]
+                      + [(email, studentDictionary[email].getID(), "") for email in rejections])
+    assert sorted(csvRows) == sorted(jsonRows) == expected
+    assert len(expected) > 0
+
+def testVerifyMatchFindsProblems():
+    '''Matches on random terms should pass verification, and breaking one
+    should be caught.'''
+    with tempfile.TemporaryDirectory() as directory:
+        for seed in range(3):
+            coursesFileName, registrarFileName, preferenceFileName = synthetic.writeTerm(
+                directory + "/%d" % seed, numStudents=300, numCourses=20, seatRatio=0.6, seed=seed)
+            tiebreaker = priorityDict.PriorityDictionary(debug=False, seed=seed)
+            courseDictionary = course.loadCourses(coursesFileName, tiebreaker)
+            student.Student.setGeneralCalendarInfo(2023, "fall")
+            studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+            student.addPreferenceDataToStudentDictionary(
+                preferenceFileName, studentDictionary, courseDictionary, warningsLevel=0)
+            participants = [email for email in studentDictionary
+                            if studentDictionary[email].submittedPreferences()]
+            rosters, rejections = match.match(studentDictionary, courseDictionary,
+                                              maxCoursesDictionary={participants[0] : 2})
+            verification = verify.verifyMatch(studentDictionary, courseDictionary, rosters, rejections)
+            assert verification.isValid() and verification.isStable(), verification.getSummary()
+
+    # Take someone out of a full course: they'd now rather have its free seat
+    fullCourse = next(c for c in rosters if len(rosters[c]) == c.getCapacity() > 0)
+    email = rosters[fullCourse].pop()
+    verification = verify.verifyMatch(studentDictionary, courseDictionary, rosters, rejections + [email])
+    assert (email, fullCourse.getCourseName()) in verification.blockingPairs
+    assert verification.isValid()
+
+    # Put them in a course they didn't ask for, over its capacity
+    otherCourse = next(c for c in rosters if c.getCourseName() not in studentDictionary[email].getWishList())
+    otherCourse.capacity = len(rosters[otherCourse])
+    rosters[otherCourse].append(email)
+    verification = verify.verifyMatch(studentDictionary, courseDictionary, rosters, rejections)
+    assert verification.ineligibleMatches == [(email, otherCourse.getCourseName())]
+    assert [courseName for courseName, _, _ in verification.overCapacity] == [otherCourse.getCourseName()]
+    # ...unless it was forced
+    verification = verify.verifyMatch(studentDictionary, courseDictionary, rosters, rejections,
+                                      {email : [otherCourse.getCourseName()]})
+    assert verification.ineligibleMatches == []
+
+def testCourseHistoryViewsFollowChanges():
+    '''The cached course histories must change whenever the history does.'''
+    s = student.Student("1", "a@carleton.edu", "A", "2025")
+    s.addCourse("CS.111")
+    s.addCourse("CS.399")
+    assert s.getCoursesTaken() == ("CS.111", "CS.399")
+    assert s.getCoreCoursesTaken() == ("CS.111",)
+    assert s.getCoreCoursesTaken() is s.getCoreCoursesTaken()
+    assert s.hasTaken("CS.111") and not s.hasTaken("CS.201")
+    s.addCourse("CS.201P")
+    s.addCourse("CS.321")
+    assert s.getCoursesTaken() == ("CS.111", "CS.201", "CS.321", "CS.399")
+    assert s.getRawCoursesTaken() == ("CS.111", "CS.201P", "CS.321", "CS.399")
+    assert s.hasTaken("CS.201") and not s.hasTakenRaw("CS.201")
+    assert s.getElectivesTaken() == ("CS.321",)
+    s.addSelfReportedCoursesTaken(["CS.202"], warningsLevel=0)
+    assert s.getCoreCoursesTaken() == ("CS.111", "CS.201", "CS.202")
+    assert s.getNumCoreCoursesTaken() == 3
+
+def testPreferenceFormPlanMatchesLineReader():
+    '''Reading rows through the column plan should give the same preferences
+    and warnings as reading them as dictionaries.'''
+    courseHeaders = ["Rank [CS%d: Course]" % number for number in range(300, 308)]
+    fieldnames = [student.PR_EMAIL_HEADER, student.PR_ID_HEADER, student.PR_NAME_HEADER,
+                  student.PR_CLASS_YEAR_HEADER, student.PR_CORE_TAKEN_HEADER] + courseHeaders \
+                 + ["Rank " + student.NO_COURSE_CHOICE]
+    plan = student.PreferenceFormPlan(fieldnames)
+    courseNameToHeader = {student.preferenceHeaderParse(header) : header for header in courseHeaders}
+    assert plan.courseNameToHeader == courseNameToHeader
+    assert plan.coursesTakenColumn == 4
+
+    generator = random.Random(0)
+    rows = []
+    for i in range(300):
+        ranks = [str(rank) for rank in range(1, len(courseHeaders) + 2)]
+        generator.shuffle(ranks)
+        # Leave some ranks out, sometimes all of the top ones
+        numMissing = generator.randrange(len(ranks))
+        if generator.random() < 0.3:
+            ranks = sorted(ranks, key=int)[numMissing:]
+        else:
+            ranks = ranks[numMissing:]
+        noChoice = ranks.pop() if ranks else str(len(courseHeaders) + 1)
+        values = ranks + [""] * (len(courseHeaders) - len(ranks))
+        generator.shuffle(values)
+        rows.append(["s%d@carleton.edu" % i, str(i), "S", "2025", ""]
+                    + [" %s " % value if value and generator.random() < 0.2 else value for value in values]
+                    + [noChoice])
+
+    defaultSink = diagnostics.sink
+    try:
+        diagnostics.sink = diagnostics.DiagnosticsSink(1, flushSize=None)
+        planned = [plan.readCoursePreferences(row) for row in rows]
+        plannedMessages = diagnostics.sink.takeMessages()
+        expected = [student.readCoursePreferencesWithNone(dict(zip(fieldnames, row)), courseNameToHeader)
+                    for row in rows]
+        expectedMessages = diagnostics.sink.takeMessages()
+    finally:
+        diagnostics.sink = defaultSink
+    assert planned == expected
+    assert plannedMessages == expectedMessages
+    assert any(code == diagnostics.INVERTED_PREFERENCES for code, _, _, _ in plannedMessages)
+
+def testServerMatchesColdRuns():
+    '''Matches run one after another by the server should each match a run
+    on freshly loaded data, so nothing leaks from one request to the next.'''
+    with tempfile.TemporaryDirectory() as directory:
+        coursesFileName, registrarFileName, preferenceFileName = synthetic.writeTerm(
+            directory + "/term", numStudents=300, numCourses=20, seatRatio=0.6, seed=4)
+        def loadTerm():
+            courseDictionary = course.loadCourses(coursesFileName, priorityDict.PriorityDictionary())
+            student.Student.setGeneralCalendarInfo(2023, "fall")
+            studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+            numStudents = student.addPreferenceDataToStudentDictionary(
+                preferenceFileName, studentDictionary, courseDictionary, warningsLevel=0)
+            return courseDictionary, studentDictionary, numStudents
+
+        matchServer = server.MatchServer(*loadTerm())
+        participants = [email for email in matchServer.studentDictionary
+                        if matchServer.studentDictionary[email].submittedPreferences()]
+        forcedCourse = list(matchServer.courseDictionary)[3]
+        allSettings = [{"deterministic" : True},
+                       {"force" : [participants[0] + ":" + forcedCourse, participants[1] + ":" + forcedCourse],
+                        "num_courses_exception" : [participants[0] + ":2", participants[2] + ":3"],
+                        "seed" : 5},
+                       {"seed" : 5, "engine" : "fast"},
+                       {"seed" : 0, "warnings" : 1},
+                       {"deterministic" : True}]
+        for settings in allSettings:
+            summary = matchServer.runMatch(settings)
+
+            courseDictionary, studentDictionary, _ = loadTerm()
+            tiebreaker = priorityDict.PriorityDictionary(debug=settings.get("deterministic", False),
+                                                         seed=settings.get("seed"))
+            for c in courseDictionary.values():
+                c.tiebreaker = tiebreaker
+            force = settings.get("force", [])
+            match.prepareForForcedMatches(force, courseDictionary, studentDictionary)
+            forcedMatchDictionary = match.parseForcedMatchExceptionString(force)
+            maxCoursesDictionary = match.parseMaxCoursesExceptionString(settings.get("num_courses_exception", []))
+            match.applyNumberOfCoursesExceptionWithForcedCourses(forcedMatchDictionary, maxCoursesDictionary,
+                                                                 studentDictionary)
+            rosters, rejections = match.match(studentDictionary, courseDictionary,
+                                              maxCoursesDictionary=maxCoursesDictionary)
+            match.applyForcedMatches(force, courseDictionary, studentDictionary, rosters)
+
+            assert summary["rejections"] == rejections
+            for c, roster in rosters.items():
+                assert matchServer.getRoster(c.getCourseName())["students"] == sorted(roster)
+                assert summary["courses"][c.getCourseName()] == [len(roster), c.getCapacity()]
+
+    explanation = matchServer.explainStudent(rejections[0])
+    assert explanation["emptySlots"] > 0
+    assert set(explanation["notMatched"]) == set(explanation["wishlist"]) - set(explanation["matches"])
+    try:
+        matchServer.runMatch({"force" : ["nobody@carleton.edu:" + forcedCourse]})
+        assert False, "forcing an unknown student should fail"
+    except server.RequestError as error:
+        assert error.status == 400
+    nonParticipant = next(email for email, s in matchServer.studentDictionary.items()
+                          if not s.submittedPreferences())
+    for settings in [{"num_courses_exception" : [nonParticipant + ":2"]},
+                     {"force" : [nonParticipant + ":" + forcedCourse]},
+                     {"seed" : "5"}, {"seed" : True}, {"seed" : 1.5}, {"deterministic" : "false"},
+                     {"deterministic" : 1}, {"warnings" : 2}, {"warnings" : True}]:
+        try:
+            matchServer.runMatch(settings)
+            assert False, "bad settings should fail: " + str(settings)
+        except server.RequestError as error:
+            assert error.status == 400
+
+    # Errors that aren't the request's fault still get an answer
+    handler = server.MatchRequestHandler.__new__(server.MatchRequestHandler)
+    responses = []
+    handler.sendJson = lambda status, contents: responses.append((status, contents))
+    with contextlib.redirect_stderr(io.StringIO()):
+        handler.respond(matchServer.getRoster, None)
+    assert len(responses) == 1 and responses[0][0] == 500
+
+def testWatchedPreferencesMatchBatchRun():
+    '''Reading the preference file a few rows at a time as it grows should
+    end with the match of the whole file.'''
+    with tempfile.TemporaryDirectory() as directory:
+        coursesFileName, registrarFileName, preferenceFileName = synthetic.writeTerm(
+            directory + "/term", numStudents=300, numCourses=20, seatRatio=0.6, seed=6)
+        with open(preferenceFileName, newline="") as preferenceFile:
+            lines = preferenceFile.read().splitlines(keepends=True)
+        # Someone submits again, with their top two choices swapped
+        header = next(csv.reader([lines[0]]))
+        resubmission = next(csv.reader([lines[5]]))
+        rankColumns = [i for i, value in enumerate(resubmission)
+                       if "[CS" in header[i] and value.strip()]
+        first, second = rankColumns[:2]
+        resubmission[first], resubmission[second] = resubmission[second], resubmission[first]
+        resubmissionLine = io.StringIO()
+        csv.writer(resubmissionLine).writerow(resubmission)
+        lines.append(resubmissionLine.getvalue())
+
+        watchedFileName = directory + "/watched.csv"
+        student.Student.setGeneralCalendarInfo(2023, "fall")
+        courseDictionary = course.loadCourses(coursesFileName, priorityDict.PriorityDictionary(debug=True))
+        with open(watchedFileName, "w", newline="") as watchedFile:
+            watchedFile.write("".join(lines[:120]) + lines[120][:10])
+        watcher = watch.PreferenceWatcher(registrarFileName, watchedFileName, courseDictionary,
+                                          {"student3@carleton.edu" : 2})
+        assert watcher.check() == 119
+        with open(watchedFileName, "w", newline="") as watchedFile:
+            watchedFile.write("".join(lines))
+        assert watcher.check() == len(lines) - 120
+        summary = watcher.getSummary()
+        # Replacing the registrar file starts everything over
+        with open(registrarFileName, "a"):
+            os.utime(registrarFileName, ns=(0, 0))
+        assert watcher.check() == len(lines) - 1
+        assert watcher.getSummary()["courses"] == summary["courses"]
+
+        courseDictionary = course.loadCourses(coursesFileName, priorityDict.PriorityDictionary(debug=True))
+        studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+        student.addPreferenceDataToStudentDictionary(watchedFileName, studentDictionary, courseDictionary,
+                                                     warningsLevel=0)
+        rosters, rejections = match.match(studentDictionary, courseDictionary,
+                                          maxCoursesDictionary={"student3@carleton.edu" : 2})
+    watchedRosters = watcher.state.getRosters()
+    assert {c.getCourseName() : sorted(roster) for c, roster in watchedRosters.items()} \
+        == {c.getCourseName() : sorted(roster) for c, roster in rosters.items()}
+    assert sorted(watcher.state.getRejections()) == sorted(rejections)
+    assert summary["matched"] == sum(len(roster) for roster in rosters.values())
+    assert summary["participants"] == len(lines) - 2
+
+def testRegistrarStoreLoadsLikeRegistrarFile():
+    '''Students loaded from the store should have the histories they'd have
+    if the latest registrar export were read directly.'''
+    with tempfile.TemporaryDirectory() as directory:
+        _, registrarFileName, preferenceFileName = synthetic.writeTerm(
+            directory + "/term", numStudents=300, numCourses=20, seed=5)
+        # The next term's export has everything again, plus a new course
+        with open(registrarFileName, newline="") as registrarFile:
+            lines = registrarFile.read().splitlines(keepends=True)
+        laterFileName = directory + "/later.csv"
+        with open(laterFileName, "w", newline="") as laterFile:
+            laterFile.write("".join(lines) + lines[1].replace("CS.111AP", "CS.202").replace("21/FA", "22/FA"))
+
+        student.Student.setGeneralCalendarInfo(2023, "fall")
+        emails = student.readPreferenceEmails(preferenceFileName)
+        store = registrarStore.RegistrarStore(directory + "/registrar.db")
+        try:
+            assert store.ingest(registrarFileName) == len(lines) - 1
+            assert store.ingest(registrarFileName) == 0
+            assert store.ingest(laterFileName) == len(lines)
+            storedDictionary = store.loadStudents(emails, warningsLevel=0)
+            everyone = store.loadStudents(warningsLevel=0)
+            foundEmails = store.findStudents(["CS.201"], ["CS.202"])
+            assert len(store.getImports()) == 2
+        finally:
+            store.close()
+        studentDictionary = student.loadStudentsFromRegistrarData(laterFileName, warningsLevel=0, emails=emails)
+        allStudents = student.loadStudentsFromRegistrarData(laterFileName, warningsLevel=0)
+    assert list(storedDictionary) == list(studentDictionary)
+    for email, s in studentDictionary.items():
+        stored = storedDictionary[email]
+        assert (stored.getID(), stored.getName(), stored.getRegistrationClassYear()) \
+            == (s.getID(), s.getName(), s.getRegistrationClassYear())
+        assert stored.getCoursesTaken() == s.getCoursesTaken()
+        assert stored.getRawCoursesTaken() == s.getRawCoursesTaken()
+    assert list(everyone) == list(allStudents)
+    assert allStudents["student0@carleton.edu"].hasTaken("CS.202")
+    assert foundEmails == sorted(email for email, s in allStudents.items()
+                                 if s.hasTaken("CS.201") and not s.hasTaken("CS.202"))
+
+def testRegistrarStoreDropsCoursesLeftOut():
+    '''A course that a later export leaves out of a student's history (as
+    when a registration is deleted) should be gone from the store too, and
+    blank and short lines in an export shouldn't stop it being ingested.'''
+    with tempfile.TemporaryDirectory() as directory:
+        _, registrarFileName, _ = synthetic.writeTerm(directory + "/term", numStudents=50, numCourses=10, seed=5)
+        with open(registrarFileName, newline="") as registrarFile:
+            lines = registrarFile.read().splitlines(keepends=True)
+        # Student 0's second course is left out of the later export
+        fieldnames, droppedLine = csv.reader(lines[:1] + lines[2:3])
+        email, droppedCourse = [droppedLine[fieldnames.index(header)]
+                                for header in [student.EMAIL_HEADER, student.COURSE_NAME_HEADER]]
+        laterLines = lines[:2] + lines[3:]
+        laterFileName = directory + "/later.csv"
+        with open(laterFileName, "w", newline="") as laterFile:
+            laterFile.write("".join(laterLines[:2]) + "\n" + "100000,Student 0\n" + "".join(laterLines[2:]) + "\n")
+
+        student.Student.setGeneralCalendarInfo(2023, "fall")
+        store = registrarStore.RegistrarStore(directory + "/registrar.db")
+        defaultSink = diagnostics.sink
+        try:
+            diagnostics.sink = diagnostics.DiagnosticsSink(1, flushSize=None)
+            store.ingest(registrarFileName)
+            assert droppedCourse in store.loadStudents(warningsLevel=0)[email].getRawCoursesTaken()
+            assert store.ingest(laterFileName) == len(laterLines) - 1
+            codes = [code for code, _, _, _ in diagnostics.takeMessages()]
+            storedDictionary = store.loadStudents(warningsLevel=0)
+        finally:
+            diagnostics.sink = defaultSink
+            store.close()
+        studentDictionary = student.loadStudentsFromRegistrarData(laterFileName, warningsLevel=0)
+    assert codes == [diagnostics.SHORT_LINE]
+    assert droppedCourse not in storedDictionary[email].getRawCoursesTaken()
+    assert list(storedDictionary) == list(studentDictionary)
+    assert all(storedDictionary[email].getRawCoursesTaken() == s.getRawCoursesTaken()
+               for email, s in studentDictionary.items())
+
+def testLoadedStudentsStayCompact():
+    '''Students keep their histories as bitmasks in slots, so a loaded
+    student should take well under the ~1.2KB a dictionary-based Student
+    with sets of course names took.'''
+    with tempfile.TemporaryDirectory() as directory:
+        _, registrarFileName, _ = synthetic.writeTerm(directory + "/term", numStudents=2000, numCourses=20, seed=3)
+        student.Student.setGeneralCalendarInfo(2023, "fall")
+        student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+        tracemalloc.start()
+        try:
+            studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+            bytesPerStudent = tracemalloc.get_traced_memory()[0] / len(studentDictionary)
+        finally:
+            tracemalloc.stop()
+    s = studentDictionary["student0@carleton.edu"]
+    assert not hasattr(s, "__dict__")
+    assert s.getNumCoreCoursesTaken() == len(s.getCoreCoursesTaken())
+    assert s.getNumElectivesTaken() == len(s.getElectivesTaken())
+    assert bytesPerStudent < 800
+
+def testBlankAndShortRegistrarRowsAreSkipped():
+    '''Blank rows (which csv.DictReader skipped) and rows cut short shouldn't
+    stop the registrar or preference emails from loading.'''
+    with open(filenames.registrarFileName, newline="") as registrarFile:
+        lines = registrarFile.read().splitlines(keepends=True)
+    with open(filenames.preferenceFileName, newline="") as preferenceFile:
+        preferenceLines = preferenceFile.read().splitlines(keepends=True)
+    student.Student.setGeneralCalendarInfo(2023, "spring")
+    expected = student.loadStudentsFromRegistrarData(filenames.registrarFileName, warningsLevel=0)
+    defaultSink = diagnostics.sink
+    try:
+        diagnostics.sink = diagnostics.DiagnosticsSink(1, flushSize=None)
+        with tempfile.TemporaryDirectory() as directory:
+            registrarFileName = directory + "/registrar.csv"
+            with open(registrarFileName, "w", newline="") as registrarFile:
+                registrarFile.write("".join(lines[:3]) + "\n" + "22222,B\n" + "".join(lines[3:]) + "\n")
+            preferenceFileName = directory + "/preferences.csv"
+            with open(preferenceFileName, "w", newline="") as preferenceFile:
+                preferenceFile.write("".join(preferenceLines) + "\n" + "x@carleton.edu\n")
+            studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+            emails = student.readPreferenceEmails(preferenceFileName)
+        codes = [code for code, _, _, _ in diagnostics.takeMessages()]
+    finally:
+        diagnostics.sink = defaultSink
+    assert list(studentDictionary) == list(expected)
+    assert all(studentDictionary[email].getCoursesTaken() == s.getCoursesTaken()
+               for email, s in expected.items())
+    assert emails == student.readPreferenceEmails(filenames.preferenceFileName)
+    assert codes == [diagnostics.SHORT_LINE]
+
+def testRowsMissingUnusedColumnsLoad():
+    '''Rows that stop before columns we don't read (as csv.DictReader
+    allowed) should load as if those columns were there.'''
+    with open(filenames.registrarFileName, newline="") as registrarFile:
+        lines = list(csv.reader(registrarFile))
+    with open(filenames.preferenceFileName, newline="") as preferenceFile:
+        preferenceLines = preferenceFile.read().splitlines(keepends=True)
+    # Every other registrar row without its title and term
+    titleColumn = lines[0].index("Title")
+    assert titleColumn >= len(lines[0]) - 2 and student.STATUS_CODE_HEADER not in lines[0]
+    shortened = lines[:1] + [line[:titleColumn] if i % 2 else line for i, line in enumerate(lines[1:])]
+    # and, for the store (which reads the term), a header with a column no row has
+    withNotes = [lines[0] + ["Notes"]] + lines[1:]
+    student.Student.setGeneralCalendarInfo(2023, "spring")
+    tiebreaker = priorityDict.PriorityDictionary(debug=True)
+    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+    expected = student.loadStudentsFromRegistrarData(filenames.registrarFileName, warningsLevel=0)
+    student.addPreferenceDataToStudentDictionary(filenames.preferenceFileName, expected, courseDictionary,
+                                                 warningsLevel=0)
+    defaultSink = diagnostics.sink
+    try:
+        diagnostics.sink = diagnostics.DiagnosticsSink(1, flushSize=None)
+        with tempfile.TemporaryDirectory() as directory:
+            registrarFileName = directory + "/registrar.csv"
+            with open(registrarFileName, "w", newline="") as registrarFile:
+                csv.writer(registrarFile).writerows(shortened)
+            # A preference form with a column no row has a value for
+            preferenceFileName = directory + "/preferences.csv"
+            with open(preferenceFileName, "w", newline="") as preferenceFile:
+                preferenceFile.write(preferenceLines[0].rstrip("\r\n") + ",Notes\r\n"
+                                     + "".join(preferenceLines[1:]))
+            studentDictionary = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+            numStudents = student.addPreferenceDataToStudentDictionary(
+                preferenceFileName, studentDictionary, courseDictionary, warningsLevel=0)
+            emails = student.readPreferenceEmails(preferenceFileName)
+            with open(registrarFileName, "w", newline="") as registrarFile:
+                csv.writer(registrarFile).writerows(withNotes)
+            store = registrarStore.RegistrarStore(directory + "/registrar.db")
+            try:
+                store.ingest(registrarFileName)
+                storedDictionary = store.loadStudents(warningsLevel=0)
+            finally:
+                store.close()
+        codes = [code for code, _, _, _ in diagnostics.takeMessages()]
+    finally:
+        diagnostics.sink = defaultSink
+    assert diagnostics.SHORT_LINE not in codes
+    assert numStudents == len(preferenceLines) - 1
+    assert emails == student.readPreferenceEmails(filenames.preferenceFileName)
+    assert list(studentDictionary) == list(expected)
+    assert all(studentDictionary[email].getRawCoursesTaken() == s.getRawCoursesTaken()
+               and studentDictionary[email].getWishList() == s.getWishList()
+               for email, s in expected.items())
+    assert list(storedDictionary) == list(expected)
+    assert all(storedDictionary[email].getRawCoursesTaken() == s.getRawCoursesTaken()
+               for email, s in expected.items())
+
+def testParallelLoadWarnsLikeSerialLoad():
+    '''Warnings about registrar lines that workers skip should come out
+    of a parallel load, in the same order as from a serial load.'''
+    with tempfile.TemporaryDirectory() as directory:
+        coursesFileName, registrarFileName, preferenceFileName = synthetic.writeTerm(
+            directory + "/term", numStudents=300, numCourses=20, seed=6)
+        with open(registrarFileName, newline="") as registrarFile:
+            lines = registrarFile.read().splitlines(keepends=True)
+        # Short, blank and emailless lines spread across the chunks
+        positions = range(len(lines) - 1, 1, -(len(lines) // 7))
+        for i in positions:
+            values = lines[i].split(",")
+            values[2] = ""
+            lines[i:i] = ["%d,Student %d\r\n" % (i, i), "\r\n", ",".join(values)]
+        with open(registrarFileName, "w", newline="") as registrarFile:
+            registrarFile.write("".join(lines) + "\r\n" + "1,Student 1\r\n")
+
+        courseDictionary = course.loadCourses(coursesFileName, priorityDict.PriorityDictionary())
+        student.Student.setGeneralCalendarInfo(2023, "fall")
+        defaultSink = diagnostics.sink
+        chunkBytes = parallelLoad.CHUNK_BYTES
+        try:
+            diagnostics.sink = diagnostics.DiagnosticsSink(1, flushSize=None)
+            expected = student.loadStudentsFromRegistrarData(registrarFileName, warningsLevel=0)
+            numExpected = student.addPreferenceDataToStudentDictionary(
+                preferenceFileName, expected, courseDictionary, warningsLevel=0)
+            expectedMessages = diagnostics.takeMessages()
+            parallelLoad.CHUNK_BYTES = os.path.getsize(registrarFileName) // 5
+            studentDictionary, numStudents = parallelLoad.loadStudentsInParallel(
+                registrarFileName, preferenceFileName, courseDictionary, 2, warningsLevel=0)
+            messages = diagnostics.takeMessages()
+        finally:
+            diagnostics.sink = defaultSink
+            parallelLoad.CHUNK_BYTES = chunkBytes
+    assert numStudents == numExpected
+    assert list(studentDictionary) == list(expected)
+    assert all(studentDictionary[email].getRawCoursesTaken() == s.getRawCoursesTaken()
+               for email, s in expected.items())
+    assert messages == expectedMessages
+    codes = [code for code, _, _, _ in messages]
+    assert codes.count(diagnostics.SHORT_LINE) == len(positions) + 1 and diagnostics.EMPTY_EMAIL_LINE in codes
+
+def testBlankAndShortPreferenceRowsAreSkipped():
+    '''A trailing blank line or a row cut short in the preference file shouldn't
+    stop the rest of the preferences from loading.'''
+    with open(filenames.preferenceFileName, newline="") as preferenceFile:
+        lines = preferenceFile.read().splitlines(keepends=True)
+    student.Student.setGeneralCalendarInfo(2023, "spring")
+    tiebreaker = priorityDict.PriorityDictionary(debug=True)
+    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+
+    def loadPreferences(preferenceFileName, readFirst):
+        studentDictionary = student.loadStudentsFromRegistrarData(filenames.registrarFileName, warningsLevel=0)
+        if readFirst:
+            fieldnames, preferenceLines = student.readPreferenceData(preferenceFileName)
+            numStudents = student.addPreferenceLinesToStudentDictionary(
+                fieldnames, preferenceLines, studentDictionary, courseDictionary, warningsLevel=0)
+        else:
+            numStudents = student.addPreferenceDataToStudentDictionary(
+                preferenceFileName, studentDictionary, courseDictionary, warningsLevel=0)
+        return numStudents, {email : s.getWishList() for email, s in studentDictionary.items()}
+
+    expected = loadPreferences(filenames.preferenceFileName, False)
+    defaultSink = diagnostics.sink
+    try:
+        diagnostics.sink = diagnostics.DiagnosticsSink(1, flushSize=None)
+        with tempfile.TemporaryDirectory() as directory:
+            preferenceFileName = directory + "/preferences.csv"
+            with open(preferenceFileName, "w", newline="") as preferenceFile:
+                preferenceFile.write("".join(lines[:2]) + "\n" + "x@carleton.edu,1\n" + "".join(lines[2:]) + "\n")
+            diagnostics.takeMessages()
+            for readFirst in [False, True]:
+                assert loadPreferences(preferenceFileName, readFirst) == expected
+                codes = [code for code, _, _, _ in diagnostics.takeMessages()]
+                assert codes.count(diagnostics.SHORT_LINE) == 1
+    finally:
+        diagnostics.sink = defaultSink
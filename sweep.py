@@ -0,0 +1,248 @@
+'''
+Capacity what-if sweeps: runs the match once for each of a list of course
+capacity scenarios and prints a short summary of each (how many matches and
+rejections there were, and which choice students got, by class year).
+
+Scenarios come from a grid of capacities to try for some courses, e.g.
+    python sweep.py --senior_class_year 2023 --upcoming_term fall \
+                    --grid CS.251=34,40 CS.257=30,34
+or from a CSV file with a column per course (and optionally a Scenario
+column naming each row); blank cells keep the capacity in the courses file.
+
+The input files are loaded once.  Each worker process is forked with the
+shared read-only match data and keeps a single match that it adjusts from
+one scenario to the next (see MatchState.undoCapacityChange), rather than
+rerunning it from scratch.  Forced matches aren't supported.
+'''
+import argparse
+import csv
+import itertools
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import course
+import diagnostics
+import match
+import matchEngine
+import priorityDict
+import student
+
+# Set up by runSweep before any workers are forked, so they inherit them
+sharedProblem = None
+workerState = None
+
+
+class SweepProblem:
+    '''
+    What every scenario shares: the MatchProblem, and for each student,
+    their class year and the position (1 = first choice) of each course on
+    their wishlist.
+    '''
+    def __init__(self, studentDictionary, courseDictionary, maxCoursesDictionary={}):
+        self.maxCoursesDictionary = maxCoursesDictionary
+        self.problem = matchEngine.MatchProblem(studentDictionary, courseDictionary,
+                                                maxCoursesDictionary)
+        courseIndex = self.problem.courseIndex
+        self.classYears = [s.getRegistrationClassYear() for s in self.problem.students]
+        self.wishlistPositions = [{courseIndex[c] : position + 1
+                                   for position, c in enumerate(s.getWishList()) if c in courseIndex}
+                                  for s in self.problem.students]
+
+    def getCapacities(self, capacityChanges):
+        '''
+        Returns the list of capacities (by course ID) with the changes in
+        capacityChanges (course name -> capacity) made.
+        '''
+        capacities = list(self.problem.capacities)
+        for courseName, capacity in capacityChanges.items():
+            capacities[self.problem.courseIndex[courseName]] = capacity
+        return capacities
+
+
+def parseGrid(gridStrings, courseDictionary):
+    '''
+    Input: gridStrings: list of strings of the form coursename=capacity,capacity,...
+    Return: list of (scenario name, {course name : capacity}) for every
+            combination of the capacities given
+    '''
+    courseNames = []
+    capacityOptions = []
+    for gridString in gridStrings:
+        courseName = course.regularize(gridString.split('=')[0])
+        if courseName not in courseDictionary:
+            raise ValueError("Can't sweep the capacity of " + courseName + ", which isn't in the match")
+        courseNames.append(courseName)
+        capacityOptions.append([int(capacity) for capacity in gridString.split('=')[1].split(',')])
+    scenarios = []
+    for capacities in itertools.product(*capacityOptions):
+        scenarios.append((" ".join("%s=%d" % pair for pair in zip(courseNames, capacities))
+                          or "capacities from the courses file",
+                          dict(zip(courseNames, capacities))))
+    return scenarios
+
+def readScenarios(fileName, courseDictionary):
+    '''
+    Reads scenarios from a CSV file with a column of capacities for each
+    course to change and optionally a Scenario column of names.
+    Return: list of (scenario name, {course name : capacity})
+    '''
+    scenarios = []
+    with open(fileName, 'r', encoding="utf-8", newline="") as scenarioFile:
+        for lineNumber, line in enumerate(csv.DictReader(scenarioFile), start=1):
+            name = line.pop("Scenario", None) or "scenario %d" % lineNumber
+            capacityChanges = {}
+            for header, capacity in line.items():
+                if capacity is None or len(capacity.strip()) == 0:
+                    continue
+                courseName = course.regularize(header)
+                if courseName not in courseDictionary:
+                    raise ValueError("Can't sweep the capacity of " + courseName + ", which isn't in the match")
+                capacityChanges[courseName] = int(capacity)
+            scenarios.append((name, capacityChanges))
+    return scenarios
+
+def summarizeMatch(state: matchEngine.MatchState):
+    '''
+    Returns (number of matches, number of rejections, Counter of
+    (class year, wishlist position) for each match, Counter of class years
+    of rejections).
+    '''
+    classYears = sharedProblem.classYears
+    wishlistPositions = sharedProblem.wishlistPositions
+    choicesReceived = Counter()
+    numMatches = 0
+    for c, roster in enumerate(state.rosters):
+        numMatches += len(roster)
+        for _, s, _ in roster:
+            choicesReceived[(classYears[s], wishlistPositions[s][c])] += 1
+    rejected = Counter(classYears[s] for s in state.rejections)
+    return numMatches, len(state.rejections), choicesReceived, rejected
+
+def runScenarios(scenarios):
+    '''
+    Runs each of scenarios, a list of (scenario name, list of capacities by
+    course ID), on this process's match, returning a list of (scenario name,
+    summary from summarizeMatch).
+    '''
+    global workerState
+    if workerState is None:
+        workerState = matchEngine.MatchState(sharedProblem.problem,
+                                             sharedProblem.maxCoursesDictionary,
+                                             keepHistory=True)
+        workerState.run()
+    results = []
+    for name, capacities in scenarios:
+        for c, capacity in enumerate(capacities):
+            workerState.undoCapacityChange(c, capacity)
+        workerState.run()
+        results.append((name, summarizeMatch(workerState)))
+    return results
+
+def runSweep(sweepProblem: SweepProblem, scenarios, workers=1):
+    '''
+    Runs every scenario (scenario name, {course name : capacity}) using
+    workers processes, and returns a list of (scenario name, summary from
+    summarizeMatch) in the same order.
+    '''
+    global sharedProblem, workerState
+    sharedProblem = sweepProblem
+    workerState = None
+    capacityScenarios = [(name, sweepProblem.getCapacities(capacityChanges))
+                         for name, capacityChanges in scenarios]
+    # Workers need to inherit the match data rather than have it pickled
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return runScenarios(capacityScenarios)
+
+    # Neighbouring scenarios tend to differ in fewer courses, so give each
+    # worker a contiguous run of them
+    chunkSize = -(-len(capacityScenarios) // workers)
+    chunks = [capacityScenarios[i:i + chunkSize] for i in range(0, len(capacityScenarios), chunkSize)]
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("fork")) as pool:
+        return [result for chunk in pool.map(runScenarios, chunks) for result in chunk]
+
+def getMaxWishlistPosition(results):
+    return max([position for _, (_, _, choicesReceived, _) in results
+                for _, position in choicesReceived] + [1])
+
+def printSweep(results):
+    '''
+    Prints a table for each scenario of the number of students in each class
+    year who got their first, second, ... choice, or were rejected.
+    '''
+    maxPosition = getMaxWishlistPosition(results)
+    for name, (numMatches, numRejections, choicesReceived, rejected) in results:
+        print("Scenario:", name)
+        print("  matches:", numMatches, " rejections:", numRejections)
+        print("  %-10s" % "choice", " ".join("%5d" % position for position in range(1, maxPosition + 1)),
+              " rejected")
+        for classYear in student.ClassYear:
+            print("  %-10s" % classYear,
+                  " ".join("%5d" % choicesReceived[(classYear, position)]
+                           for position in range(1, maxPosition + 1)),
+                  "%9d" % rejected[classYear])
+        print()
+
+def writeSweepCsv(results, fileName):
+    '''
+    Writes one row per scenario and class year: matches and rejections,
+    then the number who got each choice.
+    '''
+    maxPosition = getMaxWishlistPosition(results)
+    with open(fileName, 'w', newline="") as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(["Scenario", "Class Year", "Matches", "Rejections"]
+                        + ["Choice %d" % position for position in range(1, maxPosition + 1)])
+        for name, (_, _, choicesReceived, rejected) in results:
+            for classYear in student.ClassYear:
+                choices = [choicesReceived[(classYear, position)] for position in range(1, maxPosition + 1)]
+                writer.writerow([name, classYear, sum(choices), rejected[classYear]] + choices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run The Match for many course capacity scenarios.')
+    parser.add_argument('--grid', type=str, nargs='*', default=[],
+                        help="capacities to try for a course; format: 'coursename=capacity,capacity,...'; \
+                              every combination is run")
+    parser.add_argument('--scenarios', type=str, default=None,
+                        help='CSV file with a column of capacities per course (and optionally a Scenario column)')
+    parser.add_argument('--csv', type=str, default=None,
+                        help='also write the results to this CSV file')
+    match.addInputArguments(parser)
+    parser.add_argument('--num_courses_exception', type=str, nargs='*', default=[],
+                        help="exceptions where student is allowed multiple matches; format: 'email:num matches'")
+    parser.add_argument('--deterministic', action='store_true',
+                        help='use nonrandom [reproducible] tiebreaker based on MD5 hash of student email address')
+    parser.add_argument('--seed', type=int,
+                        help='use reproducible random tiebreakers seeded by value given (deterministic takes priority)')
+    parser.add_argument('--warnings', type=int, default=0,
+                        help='display warning messages (see match.py)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to use for loading and for running scenarios')
+    args = parser.parse_args()
+    diagnostics.configure(args.warnings)
+
+    tiebreaker = priorityDict.PriorityDictionary(debug=args.deterministic, seed=args.seed)
+    student.Student.setGeneralCalendarInfo(
+        student.getNumericYearFromText(args.senior_class_year),
+        args.upcoming_term)
+    courseDictionary, studentDictionary, _ = match.loadMatchInputs(
+        args, tiebreaker, warningsLevel=args.warnings, workers=args.workers)
+
+    try:
+        scenarios = parseGrid(args.grid, courseDictionary)
+        if args.scenarios is not None:
+            scenarios = (scenarios if args.grid else []) + readScenarios(args.scenarios, courseDictionary)
+    except ValueError as error:
+        parser.error(str(error))
+
+    maxCoursesDictionary = match.parseMaxCoursesExceptionString(args.num_courses_exception)
+    sweepProblem = SweepProblem(studentDictionary, courseDictionary, maxCoursesDictionary)
+    results = runSweep(sweepProblem, scenarios, workers=args.workers)
+    printSweep(results)
+    if args.csv is not None:
+        writeSweepCsv(results, args.csv)
+
+if __name__ == "__main__":
+    main()
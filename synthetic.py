@@ -0,0 +1,361 @@
+'''
+Writes synthetic courses, registrar and preference files, in the formats
+match.py reads (see filenames.py), for a term of any size:
+    python synthetic.py OUTPUT_DIRECTORY --students 100000 --courses 200
+
+Everything is random but reproducible from --seed.  The shape of the term
+can be set: the mix of class years, how deep prerequisite chains among the
+electives go, how skewed course popularity is (wishlists favour popular
+courses, with weights falling off as 1/rank**skew), how many students fill
+in the form, and how long their wishlists are.  Students' course histories
+respect the prerequisites, and some courses get OR-PREREQS or prerequisite
+waivers.
+
+Students are written one at a time to both the registrar and preference
+files, so memory use doesn't grow with the number of students.
+'''
+import argparse
+import bisect
+import csv
+import itertools
+import os
+import random
+
+import course
+import student
+
+MATCH_CORE_COURSES = ["CS.202", "CS.208", "CS.251", "CS.252", "CS.254", "CS.257"]
+CORE_PREREQUISITES = {"CS.202" : "CS.111", "CS.208" : "CS.201", "CS.251" : "CS.201",
+                      "CS.252" : "CS.201,CS.202", "CS.254" : "CS.201,CS.202", "CS.257" : "CS.201"}
+FIRST_ELECTIVE_NUMBER = 300
+# Course numbers on the preference form have three digits
+ELECTIVE_NUMBERS = [number for number in range(FIRST_ELECTIVE_NUMBER, 1000)
+                    if "CS.%d" % number not in course.IGNORE_COURSES]
+MAX_COURSES = len(MATCH_CORE_COURSES) + len(ELECTIVE_NUMBERS)
+# Courses students have taken but that aren't in the match
+INTRO_COURSES = ["CS.111", "CS.201"]
+# Raw names the registrar sometimes uses instead of the regularized ones
+REGISTRAR_ALIASES = {"CS.202" : "MATH.236", "CS.111" : "CS.111AP"}
+# Courses listed in the courses-taken question on the form
+FORM_COURSES_TAKEN = INTRO_COURSES + MATCH_CORE_COURSES
+
+ENROLLMENT_STATUSES = ["F", "O", "L", "R", "X"]
+ENROLLMENT_STATUS_WEIGHTS = [0.85, 0.08, 0.04, 0.02, 0.01]
+TERMS = ["FA", "WI", "SP"]
+PREFERENCE_QUESTION = ("Rank the options below from most preferred (#1) to least preferred (#%d), "
+                       "following the instructions above. YOU MAY NEED TO SCROLL THE FORM "
+                       "HORIZONTALLY to see the highest columns. ")
+
+
+class SyntheticTerm:
+    '''
+    The settings for a synthetic term, and the courses in it.
+
+    numStudents - number of students in the registrar file
+    numCourses - number of courses in the match (the six core courses first,
+                 then electives), at most MAX_COURSES
+    classYearMix - relative numbers of first years, sophomores, juniors and
+                   seniors, by the class year they register as
+    seniorClassYear, upcomingTerm - as given to match.py
+    prerequisiteDepth - electives form chains of prerequisites this long
+    popularitySkew - how much more popular the most popular courses are
+                     (0 means every course is equally popular)
+    participation - fraction of students who fill in the preference form
+    wishlistLength - number of courses each student ranks (if there are that many)
+    noCourseRate - fraction of students who put "no CS course" above some of
+                   the courses they rank
+    ineligibleRate - chance that a student ranks a course they've taken or
+                     lack the prerequisites for
+    seatRatio - total seats in the match per student who fills in the form
+    orPrerequisiteRate, waiverRate - fraction of electives with OR-PREREQS,
+                                     and of courses with a prerequisite waiver
+    '''
+    def __init__(self, numStudents=1000, numCourses=30, classYearMix=(1, 1, 1, 1),
+                 prerequisiteDepth=2, popularitySkew=1.0, participation=0.8,
+                 wishlistLength=6, noCourseRate=0.1, ineligibleRate=0.05, seatRatio=0.8,
+                 orPrerequisiteRate=0.15, waiverRate=0.1, seniorClassYear=2023,
+                 upcomingTerm="fall", seed=0):
+        self.numStudents = numStudents
+        self.classYearMix = classYearMix
+        self.participation = participation
+        self.wishlistLength = wishlistLength
+        self.noCourseRate = noCourseRate
+        self.ineligibleRate = ineligibleRate
+        self.seniorClassYear = seniorClassYear
+        self.upcomingTerm = upcomingTerm
+        self.random = random.Random(seed)
+
+        if numCourses > MAX_COURSES:
+            raise ValueError("Can't make a term with %d courses: course numbers only go up to CS.999, "
+                             "which allows %d" % (numCourses, MAX_COURSES))
+        self.courseNames = (MATCH_CORE_COURSES
+                            + ["CS.%d" % number for number in ELECTIVE_NUMBERS])[:numCourses]
+
+        # Electives are spread over prerequisiteDepth + 1 levels; the first
+        # level needs CS.201, and each later one needs something from the
+        # level before
+        self.prerequisites = {}
+        self.orPrerequisites = set()
+        levels = [[] for _ in range(prerequisiteDepth + 1)]
+        for i, courseName in enumerate(self.courseNames):
+            if courseName in CORE_PREREQUISITES:
+                self.prerequisites[courseName] = CORE_PREREQUISITES[courseName].split(",")
+                continue
+            level = i % len(levels)
+            if level == 0 or len(levels[level - 1]) == 0:
+                level = 0
+                if self.random.random() < orPrerequisiteRate:
+                    self.prerequisites[courseName] = self.random.sample(MATCH_CORE_COURSES, 2)
+                    self.orPrerequisites.add(courseName)
+                else:
+                    self.prerequisites[courseName] = ["CS.201"]
+            else:
+                self.prerequisites[courseName] = [self.random.choice(levels[level - 1])]
+            levels[level].append(courseName)
+        self.waivers = {courseName : self.getEmail(self.random.randrange(numStudents))
+                        for courseName in self.courseNames if numStudents > 0 and self.random.random() < waiverRate}
+
+        numParticipants = numStudents * participation
+        self.capacity = max(1, round(seatRatio * numParticipants / max(1, numCourses)))
+
+        # Course popularity: a random order of courses with Zipf-like weights
+        self.popularCourses = self.random.sample(self.courseNames, len(self.courseNames))
+        self.popularity = {courseName : 1 / (rank + 1) ** popularitySkew
+                           for rank, courseName in enumerate(self.popularCourses)}
+        self.popularityRank = {courseName : rank for rank, courseName in enumerate(self.popularCourses)}
+        self.cumulativePopularity = list(itertools.accumulate(self.popularity[c] for c in self.popularCourses))
+        # Courses that have each course as a prerequisite, for finding the
+        # courses a student can take without checking every course
+        self.dependents = {}
+        for courseName in self.courseNames:
+            for prerequisite in self.prerequisites[courseName]:
+                self.dependents.setdefault(prerequisite, []).append(courseName)
+        self.introEligibleCourses = {}
+
+    def getEmail(self, s):
+        return "student%d@carleton.edu" % s
+
+    def sampleCourses(self, numCourses, candidates=None):
+        '''
+        Returns up to numCourses different courses from candidates (by default
+        every course, and otherwise a list in order of popularity), more
+        popular ones more likely.
+        '''
+        if candidates is None:
+            candidates = self.popularCourses
+            cumulativePopularity = self.cumulativePopularity
+        else:
+            cumulativePopularity = list(itertools.accumulate(self.popularity[c] for c in candidates))
+        if len(candidates) <= numCourses:
+            return self.random.sample(candidates, len(candidates))
+        chosen = {}
+        total = cumulativePopularity[-1]
+        for _ in range(20 * numCourses):
+            if len(chosen) == numCourses:
+                break
+            index = bisect.bisect(cumulativePopularity, self.random.random() * total)
+            chosen[candidates[min(index, len(candidates) - 1)]] = None
+        # Very skewed popularity could take forever to reach the unpopular courses
+        for courseName in candidates:
+            if len(chosen) == numCourses:
+                break
+            chosen[courseName] = None
+        return list(chosen)
+
+    def getEligibleCourses(self, taken):
+        '''
+        Returns the courses that a student who has taken the courses in taken
+        hasn't taken and has the prerequisites for, in order of popularity.
+        '''
+        # Most of these depend only on which intro courses were taken, so
+        # those are worked out once; other courses only add their dependents
+        introTaken = frozenset(c for c in INTRO_COURSES if c in taken)
+        if introTaken not in self.introEligibleCourses:
+            self.introEligibleCourses[introTaken] = self.findEligibleCourses(introTaken, introTaken)
+        eligible = [c for c in self.introEligibleCourses[introTaken] if c not in taken]
+        extra = self.findEligibleCourses([c for c in taken if c not in introTaken], taken)
+        if extra:
+            eligible = sorted(set(eligible).union(extra), key=self.popularityRank.get)
+        return eligible
+
+    def findEligibleCourses(self, prerequisites, taken):
+        '''
+        Returns the courses that have one of prerequisites as a prerequisite
+        and that a student who has taken the courses in taken can take, in
+        order of popularity.
+        '''
+        candidates = {c for prerequisite in prerequisites for c in self.dependents.get(prerequisite, [])}
+        return sorted((c for c in candidates if c not in taken and self.canTake(c, taken)),
+                      key=self.popularityRank.get)
+
+    def canTake(self, courseName, taken):
+        prerequisites = self.prerequisites[courseName]
+        if courseName in self.orPrerequisites:
+            return any(c in taken for c in prerequisites)
+        return all(c in taken for c in prerequisites)
+
+    def writeCourses(self, coursesFileName):
+        with open(coursesFileName, "w", newline="") as coursesFile:
+            writer = csv.writer(coursesFile)
+            writer.writerow([course.CF_COURSE_NAME_HEADER, course.CF_CAPACITY_HEADER,
+                             course.CF_COURSE_TYPE_HEADER, course.CF_PREREQUISITES_HEADER,
+                             course.CF_STUDENTS_WITH_PREREQ_WAIVER_HEADER])
+            for courseName in self.courseNames:
+                prerequisites = ",".join(self.prerequisites[courseName])
+                if courseName in self.orPrerequisites:
+                    prerequisites = "OR-PREREQS," + prerequisites
+                writer.writerow([courseName, self.capacity,
+                                 course.CF_CORE_COURSE_TYPE if course.isCore(courseName)
+                                 else course.CF_ELECTIVE_COURSE_TYPE,
+                                 prerequisites, self.waivers.get(courseName, "")])
+
+    def getClassYearAndLevel(self, yearIndex):
+        '''
+        Returns the graduation year and registrar class level (e.g. "SO05")
+        of a student who registers for the upcoming term as class year
+        yearIndex (0 = first year), if they're enrolled as usual.
+        '''
+        classYear = self.seniorClassYear + 3 - yearIndex
+        if self.upcomingTerm == "fall":
+            # Data is pulled in the spring, so everyone but first years is
+            # finishing the class year before
+            termNumber = max(1, 3 * yearIndex)
+        else:
+            termNumber = 3 * yearIndex + TERMS.index(self.upcomingTerm[:2].upper())
+        return str(classYear), "%s%02d" % (["FR", "SO", "JR", "SR"][(termNumber - 1) // 3], termNumber)
+
+    def getCourseHistory(self, yearIndex):
+        '''
+        Returns a list of courses taken by a student who has been here for
+        yearIndex years, in the order taken, respecting prerequisites.
+        '''
+        history = ["CS.111"]
+        if self.random.random() < 0.5 + 0.15 * yearIndex:
+            history.append("CS.201")
+        taken = set(history)
+        for courseName in self.sampleCourses(2 * yearIndex):
+            if self.canTake(courseName, taken):
+                history.append(courseName)
+                taken.add(courseName)
+        return history
+
+    def getPreferenceHeaders(self):
+        question = PREFERENCE_QUESTION % (len(self.courseNames) + 1)
+        return ([student.PR_EMAIL_HEADER, student.PR_NAME_HEADER, student.PR_ID_HEADER,
+                 student.PR_CLASS_YEAR_HEADER]
+                + [question + "[CS%s: Course %s]" % (courseName[3:], courseName[3:])
+                   for courseName in self.courseNames]
+                + [question + student.NO_COURSE_CHOICE, student.PR_CORE_TAKEN_HEADER])
+
+    def writeStudents(self, registrarFileName, preferenceFileName):
+        '''
+        Writes every student's registrar rows and, if they fill in the form,
+        their preference row.
+        '''
+        columnOfCourse = {courseName : i for i, courseName in enumerate(self.courseNames)}
+        with open(registrarFileName, "w", newline="") as registrarFile, \
+             open(preferenceFileName, "w", newline="") as preferenceFile:
+            registrarWriter = csv.writer(registrarFile)
+            registrarWriter.writerow([student.ID_HEADER, student.NAME_HEADER, student.EMAIL_HEADER,
+                                      "Class Yr", student.CLASS_LEVEL_HEADER,
+                                      student.ENROLLMENT_STATUS_HEADER, student.COURSE_NAME_HEADER,
+                                      "Title", "Term", student.STATUS_CODE_HEADER])
+            preferenceWriter = csv.writer(preferenceFile)
+            preferenceWriter.writerow(["Timestamp"] + self.getPreferenceHeaders())
+
+            for s in range(self.numStudents):
+                idNumber = str(100000 + s)
+                email = self.getEmail(s)
+                name = "Student %d" % s
+                yearIndex = self.random.choices(range(4), weights=self.classYearMix)[0]
+                classYear, classLevel = self.getClassYearAndLevel(yearIndex)
+                status = self.random.choices(ENROLLMENT_STATUSES, weights=ENROLLMENT_STATUS_WEIGHTS)[0]
+
+                history = self.getCourseHistory(yearIndex)
+                for term, courseName in enumerate(history):
+                    statusCode = "W" if self.random.random() < 0.03 else ""
+                    if courseName in REGISTRAR_ALIASES and self.random.random() < 0.2:
+                        courseName = REGISTRAR_ALIASES[courseName]
+                    registrarWriter.writerow([idNumber, name, email, classYear, classLevel, status,
+                                              courseName, "Course " + courseName,
+                                              "%02d/%s" % (int(classYear) % 100 - 4 + term // 3, TERMS[term % 3]),
+                                              statusCode])
+
+                if self.random.random() >= self.participation:
+                    continue
+                ranks = [""] * (len(self.courseNames) + 1)
+                taken = set(history)
+                wishlist = self.sampleCourses(self.wishlistLength, self.getEligibleCourses(taken))
+                for position in range(len(wishlist)):
+                    if self.random.random() < self.ineligibleRate:
+                        wishlist[position:position] = [courseName for courseName in self.sampleCourses(1)
+                                                       if courseName not in wishlist]
+                wishlist = wishlist[:self.wishlistLength]
+                for rank, courseName in enumerate(wishlist):
+                    ranks[columnOfCourse[courseName]] = str(rank + 1)
+                noCourseRank = len(wishlist) + 1
+                if len(wishlist) > 1 and self.random.random() < self.noCourseRate:
+                    noCourseRank = self.random.randint(2, len(wishlist))
+                    for courseName in wishlist[noCourseRank - 1:]:
+                        ranks[columnOfCourse[courseName]] = str(int(ranks[columnOfCourse[courseName]]) + 1)
+                ranks[-1] = str(noCourseRank)
+                coursesTaken = ", ".join(courseName.replace(".", "") for courseName in history
+                                         if courseName in FORM_COURSES_TAKEN)
+                preferenceWriter.writerow(["5/4/2022 20:%02d:%02d" % (s // 60 % 60, s % 60),
+                                           email, name, idNumber, classYear] + ranks + [coursesTaken])
+
+def writeTerm(directory, **settings):
+    '''
+    Writes courses.csv, registrar.csv and preferences.csv for a
+    SyntheticTerm(**settings) to directory, returning the three file names
+    in that order.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    term = SyntheticTerm(**settings)
+    fileNames = (os.path.join(directory, "courses.csv"),
+                 os.path.join(directory, "registrar.csv"),
+                 os.path.join(directory, "preferences.csv"))
+    term.writeCourses(fileNames[0])
+    term.writeStudents(fileNames[1], fileNames[2])
+    return fileNames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic input files for The Match.')
+    parser.add_argument('directory', type=str,
+                        help='directory to write courses.csv, registrar.csv and preferences.csv to')
+    parser.add_argument('--students', type=int, default=1000,
+                        help='number of students in the registrar file')
+    parser.add_argument('--courses', type=int, default=30,
+                        help='number of courses in the match (at most %d)' % MAX_COURSES)
+    parser.add_argument('--class_year_mix', type=float, nargs=4, default=[1, 1, 1, 1],
+                        metavar=('FROSH', 'SOPHOMORE', 'JUNIOR', 'SENIOR'),
+                        help='relative numbers of students in each class year')
+    parser.add_argument('--prerequisite_depth', type=int, default=2,
+                        help='length of the prerequisite chains among electives')
+    parser.add_argument('--popularity_skew', type=float, default=1.0,
+                        help='Zipf exponent for course popularity; 0 makes every course equally popular')
+    parser.add_argument('--participation', type=float, default=0.8,
+                        help='fraction of students who fill in the preference form')
+    parser.add_argument('--wishlist_length', type=int, default=6,
+                        help='number of courses each student ranks')
+    parser.add_argument('--seat_ratio', type=float, default=0.8,
+                        help='total seats per student who fills in the form')
+    parser.add_argument('--senior_class_year', type=int, default=2023,
+                        help='graduation year of the senior class')
+    parser.add_argument('--upcoming_term', type=str, choices=['fall', 'winter', 'spring'], default='fall',
+                        help='term that students are registering for')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the random number generator')
+    args = parser.parse_args()
+    for fileName in writeTerm(args.directory, numStudents=args.students, numCourses=args.courses,
+                              classYearMix=args.class_year_mix,
+                              prerequisiteDepth=args.prerequisite_depth,
+                              popularitySkew=args.popularity_skew, participation=args.participation,
+                              wishlistLength=args.wishlist_length, seatRatio=args.seat_ratio,
+                              seniorClassYear=args.senior_class_year,
+                              upcomingTerm=args.upcoming_term, seed=args.seed):
+        print(fileName)
+
+if __name__ == "__main__":
+    main()
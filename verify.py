@@ -0,0 +1,127 @@
+'''
+Checks a finished match: that no course is over capacity, that nobody is
+in a course they can't take or didn't ask for, and that the match is
+stable, i.e. that there's no blocking pair.  A student and a course block
+the match if the student can take the course and would rather have it than
+one of their matches (or an empty slot), and the course has a free seat or
+holds someone it likes less than the student.
+
+Nothing is compared pair by pair.  Each course's cutoff is the lowest
+integer rank (see course.PriorityRanks) on its roster, or nothing if it has
+a free seat.  Each student's wishlist is then walked down to their least
+preferred match (or to the end, if they have an empty slot), comparing
+their rank with the cutoff of each course on the way.  That takes time
+linear in the total length of the rosters and wishlists.
+
+Forced matches (--force) are decisions rather than results of the match:
+they take up seats, but they're never checked for eligibility, a course
+can't drop its forced students for anyone, and a student can't give one up
+for a course they'd rather have.
+'''
+import itertools
+
+import course
+import diagnostics
+import eligibility
+
+
+class MatchVerification:
+    '''
+    What was wrong with a match.
+
+    overCapacity - list of (course name, roster size, capacity)
+    ineligibleMatches - list of (email, course name) for students who were
+                        matched to a course they can't take, or that isn't
+                        on their wishlist
+    blockingPairs - list of (email, course name)
+    '''
+    def __init__(self):
+        self.overCapacity = []
+        self.ineligibleMatches = []
+        self.blockingPairs = []
+
+    def isValid(self):
+        return not self.overCapacity and not self.ineligibleMatches
+
+    def isStable(self):
+        return not self.blockingPairs
+
+    def getSummary(self):
+        return "%d courses over capacity, %d ineligible matches, %d blocking pairs" % (
+            len(self.overCapacity), len(self.ineligibleMatches), len(self.blockingPairs))
+
+
+def verifyMatch(studentDictionary, courseDictionary, rosters, rejections, forcedMatchDictionary={}):
+    '''
+    Checks the match given by rosters (keys=Course objects, values=lists of
+    student emails) and rejections (a list of emails, one for each slot a
+    student didn't get filled), and returns a MatchVerification.
+    forcedMatchDictionary (emails to lists of course names, as from
+    match.parseForcedMatchExceptionString) gives the forced matches, which
+    may already be on the rosters.
+    '''
+    verification = MatchVerification()
+    eligibilityMatrix = eligibility.EligibilityMatrix(courseDictionary)
+    course.assignPriorityRanks(courseDictionary, studentDictionary)
+    forced = {(email, courseName) for email, courseNames in forcedMatchDictionary.items()
+              for courseName in courseNames}
+    # Where each course is on each student's wishlist, so a match is looked up rather than searched for
+    wishlistPositions = {email : {courseName : i for i, courseName in enumerate(s.getWishList())}
+                         for email, s in studentDictionary.items()}
+
+    # Who holds what, and each course's cutoff (None if it has a free seat)
+    matches = {}
+    cutoffs = {}
+    for courseName, c in courseDictionary.items():
+        roster = rosters[c]
+        if len(roster) > c.getCapacity():
+            verification.overCapacity.append((courseName, len(roster), c.getCapacity()))
+        ranks = []
+        for email in roster:
+            matches.setdefault(email, set()).add(courseName)
+            if (email, courseName) in forced:
+                continue
+            s = studentDictionary[email]
+            if not eligibilityMatrix.canTake(s, courseName) or courseName not in wishlistPositions[email]:
+                verification.ineligibleMatches.append((email, courseName))
+            ranks.append(c.rank(s))
+        if len(roster) < c.getCapacity():
+            cutoffs[courseName] = None
+        elif ranks:
+            cutoffs[courseName] = min(ranks)
+        else:
+            cutoffs[courseName] = float("inf") # every seat is forced
+
+    hasEmptySlot = set(rejections)
+    for email, s in studentDictionary.items():
+        held = matches.get(email, set())
+        matched = [courseName for courseName in held if (email, courseName) not in forced]
+        if email not in hasEmptySlot and not matched:
+            continue
+        wishlist = wishlistPositions[email]
+        # Only courses before their least preferred match could be better,
+        # and a match they didn't ask for is worse than anything they did
+        positions = [wishlist[courseName] for courseName in matched if courseName in wishlist]
+        if email in hasEmptySlot or len(positions) < len(matched):
+            end = len(wishlist)
+        else:
+            end = max(positions)
+        for courseName in itertools.islice(wishlist, end):
+            if courseName in held or not eligibilityMatrix.canTake(s, courseName):
+                continue
+            cutoff = cutoffs[courseName]
+            if cutoff is None or courseDictionary[courseName].rank(s) > cutoff:
+                verification.blockingPairs.append((email, courseName))
+    return verification
+
+def reportVerification(verification: MatchVerification):
+    '''
+    Reports everything wrong with the match as warnings.
+    '''
+    diagnostics.report(diagnostics.SECTION, None, None, "problems found verifying the match?")
+    for courseName, size, capacity in verification.overCapacity:
+        diagnostics.report(diagnostics.OVER_CAPACITY, None, courseName, size, capacity)
+    for email, courseName in verification.ineligibleMatches:
+        diagnostics.report(diagnostics.INELIGIBLE_MATCH, email, courseName)
+    for email, courseName in verification.blockingPairs:
+        diagnostics.report(diagnostics.BLOCKING_PAIR, email, courseName)
@@ -0,0 +1,244 @@
+'''
+Follows the preference form's export while the form is open, keeping a
+provisional match up to date as responses come in, and every so often
+saves a summary of how full each course is and how many students want it.
+    python watch.py --senior_class_year 2023 --upcoming_term fall \
+                    --output provisional.json --interval 30
+
+The preference file is only ever appended to, so each check reads just the
+rows added since the last one (stopping before a row that's only partly
+written) and adds those students to the match with MatchState.addStudents,
+which only reruns the part of the match they change.  A student who
+submits the form again is taken out of the match and added back with their
+new answers.  If the registrar file is replaced, or the preference file
+gets shorter (e.g. it was exported again from scratch), everything is
+loaded and matched again.
+
+The match is provisional: tiebreakers aren't drawn in the order match.py
+draws them, so unless they're --deterministic, it won't be exactly the
+match match.py gives at the end.  Forced matches aren't supported.
+
+The summary is JSON: when it was made, how many students are in the match,
+matched and rejected, and for each course, its capacity, how many seats are
+filled, how many students have proposed to it, how many have it as their
+first choice (among the courses they can take), and its oversubscription
+(proposals per seat).
+'''
+import argparse
+import csv
+import io
+import json
+import os
+import time
+
+import course
+import diagnostics
+import eligibility
+import filenames
+import match
+import matchEngine
+import priorityDict
+import student
+
+DEFAULT_INTERVAL = 30 # seconds between checks
+DEFAULT_OUTPUT = "provisional_match.json"
+
+
+def getFileStamp(fileName):
+    '''
+    Returns something that changes whenever fileName is replaced or
+    rewritten, or None if it doesn't exist.
+    '''
+    try:
+        status = os.stat(fileName)
+    except FileNotFoundError:
+        return None
+    return (status.st_ino, status.st_mtime_ns, status.st_size)
+
+def splitCompleteRecords(text):
+    '''
+    Returns how many characters at the start of text are whole CSV records,
+    i.e. up to the last line break that isn't inside a quoted field.
+    '''
+    end = 0
+    inQuotes = False
+    position = 0
+    for line in text.splitlines(keepends=True):
+        position += len(line)
+        # Doubled quotes inside a field flip this twice, so only real
+        # opening and closing quotes count
+        if line.count('"') % 2 == 1:
+            inQuotes = not inQuotes
+        if not inQuotes and line.endswith(("\n", "\r")):
+            end = position
+    return end
+
+
+class PreferenceWatcher:
+    '''
+    The registrar data, the preference form rows read so far and the
+    provisional match they give.
+    '''
+    def __init__(self, registrarFileName, preferenceFileName, courseDictionary,
+                 maxCoursesDictionary={}, warningsLevel=0):
+        self.registrarFileName = registrarFileName
+        self.preferenceFileName = preferenceFileName
+        self.courseDictionary = courseDictionary
+        self.maxCoursesDictionary = maxCoursesDictionary
+        self.warningsLevel = warningsLevel
+        self.reload()
+
+    def reload(self):
+        '''
+        Loads the registrar file and starts the match over, with nobody in
+        it; the whole preference file is read again at the next check.
+        '''
+        self.registrarStamp = getFileStamp(self.registrarFileName)
+        self.studentDictionary = student.loadStudentsFromRegistrarData(
+            self.registrarFileName, warningsLevel=self.warningsLevel)
+        for s in self.studentDictionary.values():
+            s.markIneligibleForMatch()
+        self.eligibilityMatrix = eligibility.EligibilityMatrix(self.courseDictionary)
+        self.plan = None
+        self.offset = 0
+        self.numRows = 0
+        self.state = matchEngine.incrementalMatch(self.studentDictionary, self.courseDictionary)
+
+    def readNewRows(self):
+        '''
+        Returns the rows (lists of column values) added to the preference
+        file since the last call, leaving any partly written row for next
+        time.  Blank rows and rows cut short are skipped.
+        '''
+        with open(self.preferenceFileName, "rb") as preferenceFile:
+            preferenceFile.seek(self.offset)
+            data = preferenceFile.read()
+        # Whole lines first, so a character that's only partly written isn't decoded
+        text = data[:data.rfind(b"\n") + 1].decode("utf-8")
+        text = text[:splitCompleteRecords(text)]
+        self.offset += len(text.encode("utf-8"))
+        rows = [row for row in csv.reader(io.StringIO(text, newline="")) if row]
+        if self.plan is None and rows:
+            self.plan = student.PreferenceFormPlan(rows[0])
+            rows = rows[1:]
+        if self.plan is None:
+            return rows
+        return list(student.getCompleteRows(rows, self.plan.numColumns))
+
+    def check(self):
+        '''
+        Brings the match up to date with the input files.  Returns the
+        number of preference rows added.
+        '''
+        preferenceStamp = getFileStamp(self.preferenceFileName)
+        if getFileStamp(self.registrarFileName) != self.registrarStamp \
+           or (preferenceStamp is not None and preferenceStamp[2] < self.offset):
+            self.reload()
+        if preferenceStamp is None:
+            return 0
+
+        rows = self.readNewRows()
+        emails = {} # in order of each student's latest row
+        for row in rows:
+            email = student.addPreferenceLine(self.plan, row, self.studentDictionary, self.courseDictionary,
+                                              self.eligibilityMatrix, warningsLevel=self.warningsLevel)
+            if email in self.state.problem.studentIndex:
+                # Their earlier answers are replaced; the match is rerun
+                # once everyone's been added
+                s = self.state.problem.studentIndex[email]
+                self.state.slots[s] = 0
+                self.state.undoStudent(s)
+            emails.pop(email, None)
+            emails[email] = None
+        if emails:
+            self.state.addStudents(list(emails), [self.maxCoursesDictionary.get(email, 1) for email in emails])
+        self.numRows += len(rows)
+        return len(rows)
+
+    def getSummary(self):
+        '''
+        Returns the summary described at the top of this file, as a
+        dictionary.
+        '''
+        state = self.state
+        problem = state.problem
+        active = [s for s in range(len(problem.emails)) if state.slots[s] > 0]
+        firstChoices = [0] * len(problem.courses)
+        for s in active:
+            if problem.preferences[s]:
+                firstChoices[problem.preferences[s][0]] += 1
+        courses = []
+        for c, courseObject in enumerate(problem.courses):
+            capacity = state.capacities[c]
+            numProposals = len(state.history.courseProposals[c])
+            courses.append({"course" : courseObject.getCourseName(),
+                            "capacity" : capacity,
+                            "filled" : len(state.rosters[c]),
+                            "proposals" : numProposals,
+                            "firstChoices" : firstChoices[c],
+                            "oversubscription" : numProposals / capacity if capacity > 0 else None})
+        return {"updated" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "preferenceRows" : self.numRows,
+                "participants" : len(active),
+                "matched" : sum(len(roster) for roster in state.rosters),
+                "rejections" : len(state.rejections),
+                "courses" : courses}
+
+    def saveSummary(self, fileName):
+        '''
+        Writes the summary to fileName, replacing it in one step so that
+        whatever reads it never sees half of it.
+        '''
+        temporaryFileName = fileName + ".tmp"
+        with open(temporaryFileName, "w") as summaryFile:
+            json.dump(self.getSummary(), summaryFile, indent=1)
+        os.replace(temporaryFileName, fileName)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep a provisional match up to date as preferences come in.')
+    parser.add_argument('--output', type=str, default=DEFAULT_OUTPUT,
+                        help='JSON file to save the fill and demand summary to')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help='seconds to wait between checks of the input files')
+    parser.add_argument('--once', action='store_true',
+                        help='check the input files and save the summary once, then stop')
+    parser.add_argument('--senior_class_year', type=str, required=True,
+                        help='senior class grad year (4 digits) at the time data was pulled')
+    parser.add_argument('--upcoming_term', type=str, choices=['fall', 'winter', 'spring'],
+                        help='term that students are registering for', required=True)
+    parser.add_argument('--num_courses_exception', type=str, nargs='*', default=[],
+                        help="exceptions where student is allowed multiple matches; format: 'email:num matches'")
+    parser.add_argument('--deterministic', action='store_true',
+                        help='use nonrandom [reproducible] tiebreaker based on MD5 hash of student email address')
+    parser.add_argument('--seed', type=int,
+                        help='use reproducible random tiebreakers seeded by value given (deterministic takes priority)')
+    parser.add_argument('--warnings', type=int, default=0,
+                        help='display warning messages (see match.py)')
+    args = parser.parse_args()
+    diagnostics.configure(args.warnings)
+
+    tiebreaker = priorityDict.PriorityDictionary(debug=args.deterministic, seed=args.seed)
+    student.Student.setGeneralCalendarInfo(
+        student.getNumericYearFromText(args.senior_class_year),
+        args.upcoming_term)
+    courseDictionary = course.loadCourses(filenames.coursesFileName, tiebreaker)
+    watcher = PreferenceWatcher(filenames.registrarFileName, filenames.preferenceFileName, courseDictionary,
+                                match.parseMaxCoursesExceptionString(args.num_courses_exception),
+                                warningsLevel=args.warnings)
+    try:
+        while True:
+            numRows = watcher.check()
+            watcher.saveSummary(args.output)
+            diagnostics.flush()
+            if numRows:
+                print("%s: %d new preference rows, %d students in the match" % (
+                    time.strftime("%H:%M:%S"), numRows, len(watcher.state.problem.studentIndex)))
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()